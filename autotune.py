@@ -0,0 +1,341 @@
+# autotune.py — 하드웨어별 n_threads / n_threads_batch / n_batch / n_ubatch 자동 조정
+#
+# 기본값 n_threads = cpu_count()-1 은 P/E 코어 혼합·SMT CPU 에서 자주 손해이고, n_batch 는 프롬프트 평가 속도를 크게 바꾼다.
+# 선택한 GGUF 로 짧은 측정을 돌려 prefill 과 decode 의 최적 설정을 따로 찾는다.
+#   - decode : 토큰 1개씩 eval → 스레드 수만 영향 (메모리 대역폭 한계라 보통 물리 코어 수 이하가 최적) → n_threads
+#     (고른 prefill 조합으로 로드해, 앞부분 prefill 후 상태를 저장·복원하며 1토큰 eval 구간만 잰다)
+#   - prefill: n_prompt 토큰 한 번에 eval → 스레드 × (n_batch, n_ubatch) 격자 → n_threads_batch, n_batch, n_ubatch
+#     (n_batch/n_ubatch 는 context 파라미터라 조합마다 다시 로드, 스레드는 llama_set_n_threads 로 바꿔 가며 측정)
+# 결과는 (모델 파일 해시, CPU 시그니처) 키로 .cache/autotune.json 에 저장 → load_llm 이 llama_kwargs() 로 자동 적용.
+# 실행: python autotune.py --model X.gguf   또는 chat_cli.py --autotune
+from __future__ import annotations
+import argparse
+import hashlib
+import json
+import os
+import platform
+import time
+from dataclasses import asdict, dataclass, field
+from typing import Any, Callable, Dict, List, Optional, Sequence, Tuple
+
+from llama_cpp import Llama
+
+import metrics
+from prompt_snapshot import model_fingerprint
+
+DEF_CACHE = os.path.join(".cache", "autotune.json")
+DEF_BATCHES = (128, 256, 512)
+DEF_UBATCHES = (128, 256, 512)
+# 측정용 프롬프트 (토큰 수를 채울 때까지 반복)
+PROBE_TEXT = ("부재 단면 검토: 폭 400mm, 높이 600mm, 콘크리트 강도 27MPa, 철근 SD400. "
+              "The quick brown fox jumps over the lazy dog while the model estimates the flexural capacity. ")
+
+log = metrics.get_logger("autotune")
+
+
+@dataclass
+class Tuned:
+    n_threads: int              # decode
+    n_threads_batch: int        # prefill
+    n_batch: int
+    n_ubatch: int
+    decode_tok_s: float = 0.0
+    prefill_tok_s: float = 0.0
+    trials: List[Dict[str, Any]] = field(default_factory=list)
+
+    def llama_kwargs(self) -> Dict[str, int]:
+        return {"n_threads": self.n_threads, "n_threads_batch": self.n_threads_batch,
+                "n_batch": self.n_batch, "n_ubatch": self.n_ubatch}
+
+
+# ---------- CPU ----------
+def _read(path: str) -> str:
+    try:
+        with open(path, encoding="utf-8", errors="replace") as f:
+            return f.read()
+    except OSError:
+        return ""
+
+
+def _count_cpulist(s: str) -> int:
+    """'0-7,16-23' 형식의 CPU 목록 개수."""
+    n = 0
+    for part in s.strip().split(","):
+        if "-" in part:
+            a, b = part.split("-", 1)
+            n += int(b) - int(a) + 1
+        elif part:
+            n += 1
+    return n
+
+
+def cpu_info() -> Dict[str, Any]:
+    """CPU 모델명, 논리/물리 코어 수, (Linux 하이브리드 CPU 면) P 코어 논리 스레드 수."""
+    logical = os.cpu_count() or 1
+    info: Dict[str, Any] = {"machine": platform.machine(), "name": platform.processor() or "",
+                            "logical": logical, "physical": 0, "p_threads": 0}
+    cpuinfo = _read("/proc/cpuinfo")
+    if cpuinfo:
+        cores = set()
+        names: List[str] = []
+        phys = core = ""
+        for line in cpuinfo.splitlines():
+            k, _, v = line.partition(":")
+            k, v = k.strip(), v.strip()
+            if k == "model name" and not names:
+                names.append(v)                               # Linux 의 platform.processor() 는 'x86_64' 정도라 대체
+            elif k == "physical id":
+                phys = v
+            elif k == "core id":
+                core = v
+            elif not k and core:
+                cores.add((phys, core))
+                phys = core = ""
+        if core:
+            cores.add((phys, core))
+        if names:
+            info["name"] = names[0]
+        info["physical"] = len(cores)
+        p_cpus = _read("/sys/devices/cpu_core/cpus")          # Intel 하이브리드 (P 코어)
+        if p_cpus.strip():
+            info["p_threads"] = _count_cpulist(p_cpus)
+    if not info["physical"]:
+        try:
+            import psutil
+            info["physical"] = psutil.cpu_count(logical=False) or 0
+        except ImportError:
+            pass
+    info["physical"] = info["physical"] or logical
+    return info
+
+
+def cpu_signature(info: Optional[Dict[str, Any]] = None) -> str:
+    """같은 CPU + 같은 llama.cpp 빌드면 같은 값 (빌드가 바뀌면 커널 성능이 달라지므로 포함)."""
+    info = info or cpu_info()
+    try:
+        import llama_cpp
+        build = f"{llama_cpp.__version__}|{llama_cpp.llama_print_system_info().decode(errors='replace')}"
+    except Exception:
+        build = ""
+    raw = "\x00".join([info["machine"], info["name"], str(info["logical"]), str(info["physical"]),
+                       str(info["p_threads"]), build])
+    return hashlib.sha1(raw.encode("utf-8")).hexdigest()[:16]
+
+
+def default_threads() -> int:
+    return max(1, (os.cpu_count() or 4) - 1)
+
+
+def thread_candidates(info: Optional[Dict[str, Any]] = None) -> List[int]:
+    """물리 코어 절반 ~ 논리 코어 전체 중 의미 있는 값들 (P 코어 수 포함)."""
+    info = info or cpu_info()
+    lg, ph, pt = info["logical"], info["physical"], info["p_threads"]
+    cands = {ph, max(1, ph // 2), max(1, ph - 1), lg, max(1, lg - 1)}
+    if pt:
+        cands |= {pt, max(1, pt // 2)}          # SMT 켜진 P 코어면 pt//2 = P 코어 수
+    if ph >= 8:
+        cands.add(ph * 3 // 4)
+    return sorted(c for c in cands if 1 <= c <= lg)
+
+
+# ---------- 측정 ----------
+def _probe_tokens(llm: Llama, n: int) -> List[int]:
+    toks = llm.tokenize(PROBE_TEXT.encode("utf-8"), add_bos=True)
+    body = toks[1:] or toks
+    while len(toks) < n:
+        toks = toks + body
+    return toks[:n]
+
+
+def _best_time(fn: Callable[[], None], repeats: int) -> float:
+    best = float("inf")
+    for _ in range(max(1, repeats)):
+        t0 = time.perf_counter()
+        fn()
+        best = min(best, time.perf_counter() - t0)
+    return best
+
+
+def _prefill(llm: Llama, toks: List[int]) -> None:
+    llm.reset()
+    llm.eval(toks)
+
+
+def _decode_time(llm: Llama, state, steps: List[int]) -> float:
+    """prefill 끝난 상태(state)로 되돌린 뒤 토큰 1개씩 eval 하는 구간만 잰다."""
+    llm.load_state(state)
+    t0 = time.perf_counter()
+    for t in steps:
+        llm.eval([t])
+    return time.perf_counter() - t0
+
+
+def _load(model_path: str, n_ctx: int, n_batch: int, n_ubatch: int, threads: int) -> Llama:
+    return Llama(model_path=model_path, n_ctx=n_ctx, n_batch=n_batch, n_ubatch=n_ubatch,
+                 n_threads=threads, n_threads_batch=threads, verbose=False)
+
+
+def tune(model_path: str, threads: Optional[Sequence[int]] = None,
+         batches: Sequence[int] = DEF_BATCHES, ubatches: Sequence[int] = DEF_UBATCHES,
+         n_prompt: int = 512, n_gen: int = 32, repeats: int = 2,
+         progress: Optional[Callable[[str], None]] = None) -> Tuned:
+    """
+    prefill 은 스레드 × (n_batch, n_ubatch ≤ n_batch) 격자를, decode 는 고른 prefill 조합으로 다시 로드해 스레드 후보만 측정한다.
+    조합마다 1회 워밍업 후 repeats 회 중 최소 시간을 쓴다. decode 시간에는 앞부분 prefill 이 들어가지 않는다.
+    """
+    say = progress or (lambda s: None)
+    threads = sorted(set(int(t) for t in threads)) if threads else thread_candidates()
+    combos = [(b, u) for b in sorted(set(batches)) for u in sorted(set(ubatches)) if u <= b]
+    if not combos:
+        raise ValueError("n_ubatch 후보가 모두 n_batch 보다 큽니다")
+    n_ctx = n_prompt + n_gen + 64
+    trials: List[Dict[str, Any]] = []
+    best_dec: Tuple[float, int] = (0.0, threads[0])
+    best_pre: Tuple[float, int, int, int] = (0.0, threads[0], *combos[0])
+
+    with metrics.span("autotune"):
+        for nb, nu in combos:
+            llm = _load(model_path, n_ctx, nb, nu, max(threads))
+            try:
+                toks = _probe_tokens(llm, n_prompt)
+                for t in threads:
+                    llm._ctx.set_n_threads(t, t)
+                    _prefill(llm, toks)                                    # 워밍업
+                    pre = n_prompt / _best_time(lambda: _prefill(llm, toks), repeats)
+                    trial = {"phase": "prefill", "n_threads": t, "n_batch": nb, "n_ubatch": nu, "tok_s": round(pre, 2)}
+                    trials.append(trial)
+                    log.debug("autotune %s", trial)
+                    say(f"prefill  threads={t:<3} n_batch={nb:<5} n_ubatch={nu:<5} {pre:8.1f} tok/s")
+                    if pre > best_pre[0]:
+                        best_pre = (pre, t, nb, nu)
+            finally:
+                llm.close()
+
+        _, _, nb, nu = best_pre
+        llm = _load(model_path, n_ctx, nb, nu, max(threads))
+        try:
+            toks = _probe_tokens(llm, n_prompt)
+            head, steps = toks[:32], toks[32:32 + n_gen]
+            for t in threads:
+                llm._ctx.set_n_threads(t, t)
+                llm.reset()
+                llm.eval(head)
+                state = llm.save_state()
+                _decode_time(llm, state, steps)                           # 워밍업
+                dec = len(steps) / min(_decode_time(llm, state, steps) for _ in range(max(1, repeats)))
+                trial = {"phase": "decode", "n_threads": t, "n_batch": nb, "n_ubatch": nu, "tok_s": round(dec, 2)}
+                trials.append(trial)
+                log.debug("autotune %s", trial)
+                say(f"decode   threads={t:<3} {dec:8.1f} tok/s")
+                if dec > best_dec[0]:
+                    best_dec = (dec, t)
+        finally:
+            llm.close()
+
+    return Tuned(n_threads=best_dec[1], n_threads_batch=best_pre[1], n_batch=best_pre[2], n_ubatch=best_pre[3],
+                 decode_tok_s=round(best_dec[0], 2), prefill_tok_s=round(best_pre[0], 2), trials=trials)
+
+
+# ---------- 캐시 ----------
+_fp_memo: Dict[Tuple[str, int, int], str] = {}
+
+
+def _model_key(model_path: str) -> str:
+    st = os.stat(model_path)
+    k = (os.path.abspath(model_path), st.st_size, st.st_mtime_ns)
+    fp = _fp_memo.get(k)
+    if fp is None:
+        fp = _fp_memo[k] = model_fingerprint(model_path)
+    return fp
+
+
+def _cache_key(model_path: str) -> str:
+    return f"{_model_key(model_path)}@{cpu_signature()}"
+
+
+def _read_cache(cache_path: str) -> Dict[str, Any]:
+    try:
+        with open(cache_path, encoding="utf-8") as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+
+def save(model_path: str, tuned: Tuned, cache_path: str = DEF_CACHE) -> None:
+    data = _read_cache(cache_path)
+    rec = asdict(tuned)
+    rec.update(model=os.path.basename(model_path), cpu=cpu_info()["name"], tuned_at=time.strftime("%Y-%m-%d %H:%M:%S"))
+    data[_cache_key(model_path)] = rec
+    os.makedirs(os.path.dirname(cache_path) or ".", exist_ok=True)
+    tmp = f"{cache_path}.{os.getpid()}.tmp"
+    with open(tmp, "w", encoding="utf-8") as f:
+        json.dump(data, f, ensure_ascii=False, indent=1)
+    os.replace(tmp, cache_path)
+
+
+def lookup(model_path: str, cache_path: str = DEF_CACHE) -> Optional[Tuned]:
+    """이 모델 파일 + 이 CPU 의 튜닝 결과 (없거나 모델 파일이 없으면 None)."""
+    if not model_path or not os.path.exists(model_path) or not os.path.exists(cache_path):
+        return None
+    rec = _read_cache(cache_path).get(_cache_key(model_path))
+    if not rec:
+        return None
+    try:
+        return Tuned(**{k: rec[k] for k in Tuned.__dataclass_fields__ if k in rec})
+    except TypeError:
+        return None
+
+
+def llama_kwargs(model_path: str, n_threads: Optional[int] = None, cache_path: str = DEF_CACHE) -> Dict[str, int]:
+    """
+    Llama(...) 에 넘길 스레드/배치 인자. 튜닝 결과가 있으면 적용하고, n_threads 를 명시하면 decode 스레드만 그 값으로.
+    결과가 없으면 기존 기본값 (n_threads = cpu_count-1, 나머지는 llama_cpp 기본).
+    """
+    tuned = lookup(model_path, cache_path)
+    if tuned is None:
+        return {"n_threads": n_threads or default_threads()}
+    kw = tuned.llama_kwargs()
+    if n_threads:
+        kw["n_threads"] = int(n_threads)
+    return kw
+
+
+def format_tuned(t: Tuned) -> str:
+    return (f"decode threads {t.n_threads} ({t.decode_tok_s:.1f} tok/s) · prefill threads {t.n_threads_batch}, "
+            f"batch {t.n_batch}/{t.n_ubatch} ({t.prefill_tok_s:.0f} tok/s)")
+
+
+def _ints(s: str) -> List[int]:
+    return [int(x) for x in s.replace(" ", "").split(",") if x]
+
+
+def main():
+    p = argparse.ArgumentParser(description="n_threads / n_batch / n_ubatch 자동 조정 (결과는 load_llm 이 자동 적용)")
+    p.add_argument("--model", required=True, help="GGUF model path")
+    p.add_argument("--threads", default="", help="스레드 후보 (예: 4,6,8). 기본: CPU 구성으로 자동")
+    p.add_argument("--batch", default=",".join(map(str, DEF_BATCHES)), help="n_batch 후보")
+    p.add_argument("--ubatch", default=",".join(map(str, DEF_UBATCHES)), help="n_ubatch 후보")
+    p.add_argument("--prompt-tokens", type=int, default=512, help="prefill 측정 토큰 수")
+    p.add_argument("--gen-tokens", type=int, default=32, help="decode 측정 토큰 수")
+    p.add_argument("--repeats", type=int, default=2)
+    p.add_argument("--cache", default=DEF_CACHE, help="결과 저장 파일")
+    p.add_argument("--show", action="store_true", help="측정 없이 저장된 결과만 출력")
+    args = p.parse_args()
+
+    if not os.path.exists(args.model):
+        raise SystemExit(f"[ERR] model not found: {args.model}")
+    info = cpu_info()
+    print(f"[INFO] CPU: {info['name']} · logical {info['logical']} · physical {info['physical']}"
+          + (f" · P-core threads {info['p_threads']}" if info["p_threads"] else ""))
+    if args.show:
+        t = lookup(args.model, args.cache)
+        print(f"[TUNED] {format_tuned(t)}" if t else "[INFO] no autotune result for this model/CPU")
+        return
+    t = tune(args.model, _ints(args.threads) or None, _ints(args.batch), _ints(args.ubatch),
+             n_prompt=args.prompt_tokens, n_gen=args.gen_tokens, repeats=args.repeats, progress=print)
+    save(args.model, t, args.cache)
+    print(f"[TUNED] {format_tuned(t)} → {args.cache}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,428 @@
+# batch_decode.py — 여러 세션의 생성을 한 번의 llama_decode 로 묶는 배치 스케줄러
+#
+# st.cache_resource 로 공유되는 Llama 하나에서는 세션들의 create_chat_completion 이 한 줄로 서서 차례로 돈다.
+# BatchScheduler 는 같은 모델 가중치 위에 n_seq_max=n_seq 인 컨텍스트를 따로 만들고,
+# 활성 세션마다 KV 시퀀스(seq_id) 하나를 배정해 매 step 마다
+#   - 생성 중인 세션: 직전 토큰 1개씩
+#   - 새로 들어온 세션: prompt 일부 (n_batch 남는 자리만큼)
+# 를 한 batch 로 decode 한다 (continuous batching). 토큰은 세션별 큐로 흘려보낸다.
+# create_chat_completion(stream=True) 호환 → stream_chat / server.py 에 Llama 대신 넣으면 된다.
+# 세션별 KV 캐시(llm_cache)·프롬프트 스냅샷은 쓰지 않는다 (요청마다 prompt 전체를 prefill).
+from __future__ import annotations
+import codecs
+import ctypes
+import queue
+import threading
+import time
+import uuid
+from collections import deque
+from dataclasses import dataclass, field
+from typing import Any, Deque, Dict, Iterator, List, Optional
+
+import llama_cpp
+from llama_cpp import llama_chat_format
+
+_DONE = object()
+_LIVE: List["BatchScheduler"] = []           # close_all() 대상 (워커 스레드가 참조를 잡고 있어 GC 되지 않음)
+
+
+# ---------- llama_cpp 버전 차이 흡수 ----------
+def _seq_rm(ctx, seq_id: int) -> None:
+    """seq_id 의 KV 를 모두 지움 (0.3.x memory API → 구 kv_self / kv_cache API 순)."""
+    get_mem = getattr(llama_cpp, "llama_get_memory", None)
+    if get_mem is not None and hasattr(llama_cpp, "llama_memory_seq_rm"):
+        llama_cpp.llama_memory_seq_rm(get_mem(ctx), seq_id, -1, -1)
+        return
+    fn = getattr(llama_cpp, "llama_kv_self_seq_rm", None) or getattr(llama_cpp, "llama_kv_cache_seq_rm")
+    fn(ctx, seq_id, -1, -1)
+
+
+def _piece(vocab, tok: int, buf) -> bytes:
+    """토큰 하나의 바이트열 (LlamaModel.token_to_piece 는 버전에 따라 32바이트 버퍼를 그대로 돌려줌)."""
+    n = llama_cpp.llama_token_to_piece(vocab, tok, buf, len(buf), 0, False)
+    if n < 0:
+        buf = ctypes.create_string_buffer(-n)
+        n = llama_cpp.llama_token_to_piece(vocab, tok, buf, len(buf), 0, False)
+    return buf.raw[:n]
+
+
+def _eog_checker(model):
+    vocab = getattr(model, "vocab", None)
+    if vocab is not None and hasattr(llama_cpp, "llama_vocab_is_eog"):
+        return lambda tok: bool(llama_cpp.llama_vocab_is_eog(vocab, tok))
+    return lambda tok: bool(llama_cpp.llama_token_is_eog(model.model, tok))
+
+
+def supported(llm) -> bool:
+    """이 llama_cpp / Llama 로 배치 스케줄러를 만들 수 있는지."""
+    need = ("llama_batch_init", "llama_decode", "llama_sampler_sample")
+    return (all(hasattr(llama_cpp, n) for n in need)
+            and hasattr(llm, "_model") and hasattr(llm, "context_params")
+            and hasattr(llm.context_params, "n_seq_max"))
+
+
+def _formatter_for(llm):
+    """llm.chat_format 에 맞는 포매터 (messages → ChatFormatterResponse). 없으면 GGUF 내장 템플릿."""
+    name = getattr(llm, "chat_format", None) or ""
+    if name and not name.startswith("chat_template."):
+        fn = getattr(llama_chat_format, "format_" + name.replace("-", "").replace(".", "_"), None)
+        if fn is not None:
+            return fn
+    meta = getattr(llm, "metadata", None) or {}
+    key = "tokenizer.chat_template" if name in ("", "chat_template.default") else "tokenizer." + name
+    template = meta.get(key) or meta.get("tokenizer.chat_template")
+    if not template:
+        raise ValueError(f"batch decode: unsupported chat_format {name!r}")
+    model = llm._model
+
+    def tok_text(t: int) -> str:
+        return model.token_get_text(t) if t >= 0 else ""
+
+    return llama_chat_format.Jinja2ChatFormatter(
+        template=template, eos_token=tok_text(model.token_eos()), bos_token=tok_text(model.token_bos()),
+    )
+
+
+def _partial_stop(text: str, stops: List[str]) -> int:
+    """text 끝부분 중 stop 문자열의 접두사와 겹치는 최대 길이 (아직 내보내면 안 되는 부분)."""
+    keep = 0
+    for s in stops:
+        for n in range(min(len(text), len(s) - 1), keep, -1):
+            if s.startswith(text[-n:]):
+                keep = n
+                break
+    return keep
+
+
+@dataclass
+class _Request:
+    rid: str
+    prompt: List[int]
+    max_tokens: int
+    temperature: float
+    top_p: float
+    repeat_penalty: float
+    seed: int
+    stop: List[str]
+    out: "queue.Queue[Any]"
+    cancel: threading.Event
+    t_submit: float
+    seq: int = -1
+    n_past: int = 0                               # KV 에 들어간 토큰 수
+    pending: List[int] = field(default_factory=list)   # 다음 step 에 넣을 토큰 (prompt 나머지 또는 직전 토큰)
+    prefilling: bool = True
+    sampler: Any = None
+    decoder: Any = None
+    text: str = ""
+    emitted: int = 0
+    n_gen: int = 0
+    t_first: Optional[float] = None
+    t_last: Optional[float] = None
+
+
+class BatchScheduler:
+    """
+    n_seq 개 세션을 동시에 decode 하는 스케줄러 (전용 워커 스레드 1개).
+    n_ctx_seq: 세션 하나가 쓸 수 있는 컨텍스트 (기본: llm.n_ctx()). KV 메모리는 n_seq 배.
+    stats(): aggregate_tok_s(전체 처리량) 와 session_tok_s(세션 하나가 체감하는 속도) 등.
+    """
+
+    def __init__(self, llm, n_seq: int = 4, n_ctx_seq: Optional[int] = None):
+        if not supported(llm):
+            raise RuntimeError("batch decode: llama_cpp 0.3.x 의 multi-sequence API 가 필요합니다")
+        from llama_cpp import _internals as internals
+
+        self.llm = llm
+        self.n_seq = max(1, int(n_seq))
+        self.n_ctx_seq = int(n_ctx_seq or llm.n_ctx())
+        self._model = llm._model
+        self._format = _formatter_for(llm)
+        self._is_eog = _eog_checker(self._model)
+        self._piece_buf = ctypes.create_string_buffer(64)
+        self.model_name = getattr(llm, "model_path", "") or ""
+
+        params = type(llm.context_params).from_buffer_copy(llm.context_params)
+        params.n_ctx = self.n_ctx_seq * self.n_seq
+        params.n_seq_max = self.n_seq
+        if hasattr(params, "kv_unified"):
+            # 시퀀스별 버퍼로 나누면 CPU 에서 ubatch 가 시퀀스마다 쪼개져 배치 이득이 사라진다 (4세션: 0.85x vs 2.5x)
+            params.kv_unified = True
+        self.n_batch = params.n_batch = max(int(params.n_batch), self.n_seq)
+        self._ctx = internals.LlamaContext(model=self._model, params=params, verbose=False)
+        self._batch = internals.LlamaBatch(n_tokens=self.n_batch, embd=0, n_seq_max=1, verbose=False)
+        self._new_sampler = internals.LlamaSampler
+
+        self._waiting: Deque[_Request] = deque()
+        self._cv = threading.Condition()
+        self._closed = False
+        self._free = list(range(self.n_seq))
+        self._active: List[_Request] = []
+
+        # 통계
+        self.steps = 0
+        self.gen_tokens = 0
+        self.prefill_tokens = 0
+        self.busy_s = 0.0
+        self._decode_seqs = 0                     # step 별 생성 중 세션 수 합 (평균 batch 폭)
+        self._done_rates: Deque[float] = deque(maxlen=64)
+        self._done_ttft: Deque[float] = deque(maxlen=64)
+
+        self._thread = threading.Thread(target=self._loop, name="batch-decode", daemon=True)
+        self._thread.start()
+        _LIVE.append(self)
+
+    # ---------- public ----------
+    def create_chat_completion(self, messages: List[Dict[str, str]], stream: bool = False,
+                               temperature: float = 0.2, top_p: float = 0.95, max_tokens: Optional[int] = None,
+                               stop=None, seed: Optional[int] = None, repeat_penalty: float = 1.0, **_):
+        """Llama.create_chat_completion 의 텍스트 채팅 부분과 같은 형식."""
+        fr = self._format(messages=messages)
+        prompt = self.llm.tokenize(fr.prompt.encode("utf-8"), add_bos=not getattr(fr, "added_special", False),
+                                   special=True)
+        if len(prompt) >= self.n_ctx_seq:
+            raise ValueError(f"prompt ({len(prompt)} tokens) exceeds per-session context {self.n_ctx_seq}")
+        stops = [stop] if isinstance(stop, str) else list(stop or [])
+        if fr.stop:
+            stops += [fr.stop] if isinstance(fr.stop, str) else list(fr.stop)
+        limit = self.n_ctx_seq - len(prompt)
+        req = _Request(
+            rid="chatcmpl-" + uuid.uuid4().hex[:24], prompt=prompt,
+            max_tokens=min(int(max_tokens), limit) if max_tokens and max_tokens > 0 else limit,
+            temperature=float(temperature), top_p=float(top_p), repeat_penalty=float(repeat_penalty),
+            seed=int(seed) if seed is not None else llama_cpp.LLAMA_DEFAULT_SEED,
+            stop=[s for s in stops if s], out=queue.Queue(), cancel=threading.Event(),
+            t_submit=time.perf_counter(),
+        )
+        with self._cv:
+            if self._closed:
+                raise RuntimeError("batch scheduler closed")
+            self._waiting.append(req)
+            self._cv.notify()
+        it = self._iter(req)
+        if stream:
+            return it
+        parts, finish = [], None
+        for ch in it:
+            c = ch["choices"][0]
+            parts.append(c["delta"].get("content", "") or "")
+            finish = c.get("finish_reason") or finish
+        return {
+            "id": req.rid, "object": "chat.completion", "created": int(time.time()), "model": self.model_name,
+            "choices": [{"index": 0, "message": {"role": "assistant", "content": "".join(parts)},
+                         "finish_reason": finish}],
+            "usage": {"prompt_tokens": len(req.prompt), "completion_tokens": req.n_gen,
+                      "total_tokens": len(req.prompt) + req.n_gen},
+        }
+
+    def stats(self) -> Dict[str, Any]:
+        with self._cv:
+            waiting = len(self._waiting)
+        active = sum(1 for r in self._active if r.seq >= 0)
+        rates = list(self._done_rates)
+        ttft = list(self._done_ttft)
+        return {
+            "n_seq": self.n_seq,
+            "active": active,
+            "waiting": waiting,
+            "steps": self.steps,
+            "gen_tokens": self.gen_tokens,
+            "prefill_tokens": self.prefill_tokens,
+            "avg_batch": self._decode_seqs / self.steps if self.steps else 0.0,
+            "aggregate_tok_s": self.gen_tokens / self.busy_s if self.busy_s > 0 else 0.0,
+            "session_tok_s": sum(rates) / len(rates) if rates else 0.0,
+            "avg_ttft_s": sum(ttft) / len(ttft) if ttft else 0.0,
+        }
+
+    def close(self) -> None:
+        if self in _LIVE:
+            _LIVE.remove(self)
+        with self._cv:
+            if self._closed:
+                return
+            self._closed = True
+            self._cv.notify()
+        self._thread.join(timeout=5.0)
+        for r in list(self._waiting) + self._active:
+            r.out.put(RuntimeError("batch scheduler closed"))
+        self._batch.close()
+        self._ctx.close()
+
+    # ---------- consumer ----------
+    def _iter(self, req: _Request) -> Iterator[Dict[str, Any]]:
+        created = int(time.time())
+
+        def chunk(delta: Dict[str, str], finish: Optional[str]) -> Dict[str, Any]:
+            return {"id": req.rid, "object": "chat.completion.chunk", "created": created, "model": self.model_name,
+                    "choices": [{"index": 0, "delta": delta, "finish_reason": finish}]}
+
+        try:
+            yield chunk({"role": "assistant"}, None)
+            while True:
+                item = req.out.get()
+                if item is _DONE:
+                    return
+                if isinstance(item, Exception):
+                    raise item
+                text, finish = item
+                yield chunk({"content": text} if text else {}, finish)
+        finally:
+            req.cancel.set()                      # 소비자가 중간에 멈추면(close) 워커가 자리를 반납
+
+    # ---------- worker ----------
+    def _loop(self) -> None:
+        while True:
+            with self._cv:
+                while not self._closed and not self._waiting and not self._active:
+                    self._cv.wait()
+                if self._closed:
+                    return
+                while self._waiting and self._free:
+                    self._admit(self._waiting.popleft())
+            self._active = [r for r in self._active if not self._drop_cancelled(r)]
+            if not self._active:
+                continue
+            try:
+                self._step()
+            except Exception as e:
+                for r in self._active:
+                    self._finish(r, None, error=e)
+                self._active = []
+
+    def _admit(self, r: _Request) -> None:
+        if r.cancel.is_set():
+            r.out.put(_DONE)
+            return
+        r.seq = self._free.pop()
+        _seq_rm(self._ctx.ctx, r.seq)
+        # Llama._init_sampler 와 같은 순서 (penalty 는 greedy 에도 적용)
+        s = self._new_sampler()
+        if r.repeat_penalty != 1.0:
+            s.add_penalties(64, r.repeat_penalty, 0.0, 0.0)
+        if r.temperature <= 0:
+            s.add_greedy()
+        else:
+            s.add_top_k(40)
+            s.add_top_p(r.top_p, 1)
+            s.add_min_p(0.05, 1)
+            s.add_temp(r.temperature)
+            s.add_dist(r.seed)
+        r.sampler = s
+        r.decoder = codecs.getincrementaldecoder("utf-8")(errors="ignore")
+        r.pending = list(r.prompt)
+        self._active.append(r)
+
+    def _drop_cancelled(self, r: _Request) -> bool:
+        if not r.cancel.is_set():
+            return False
+        self._release(r)
+        r.out.put(_DONE)
+        return True
+
+    def _step(self) -> None:
+        b = self._batch.batch
+        n = 0
+        logits_at: List[tuple] = []               # (batch index, request, 넣은 토큰 수)
+
+        def put(tok: int, pos: int, seq: int, logits: bool) -> None:
+            nonlocal n
+            b.token[n] = tok
+            b.pos[n] = pos
+            b.n_seq_id[n] = 1
+            b.seq_id[n][0] = seq
+            b.logits[n] = logits
+            n += 1
+
+        # 생성 중인 세션 먼저 (토큰 1개씩) → 새 세션 prefill 은 남는 자리만큼
+        decoding = [r for r in self._active if not r.prefilling]
+        for r in decoding:
+            put(r.pending[0], r.n_past, r.seq, True)
+            logits_at.append((n - 1, r, 1))
+        for r in self._active:
+            if not r.prefilling or n >= self.n_batch:
+                continue
+            take = min(len(r.pending), self.n_batch - n)
+            last = take == len(r.pending)
+            for i in range(take):
+                put(r.pending[i], r.n_past + i, r.seq, last and i == take - 1)
+            if last:
+                logits_at.append((n - 1, r, take))
+            else:
+                r.pending = r.pending[take:]
+                r.n_past += take
+            self.prefill_tokens += take
+        b.n_tokens = n
+
+        t0 = time.perf_counter()
+        rc = llama_cpp.llama_decode(self._ctx.ctx, b)
+        if rc != 0:
+            raise RuntimeError(f"llama_decode returned {rc}")
+        for idx, r, used in logits_at:
+            r.n_past += used
+            r.prefilling = False
+            tok = r.sampler.sample(self._ctx, idx)
+            self._on_token(r, tok)
+        self.busy_s += time.perf_counter() - t0
+        self.steps += 1
+        self._decode_seqs += len(decoding)
+        self._active = [r for r in self._active if r.seq >= 0]
+
+    def _on_token(self, r: _Request, tok: int) -> None:
+        now = time.perf_counter()
+        if self._is_eog(tok):
+            self._finish(r, "stop")
+            return
+        r.n_gen += 1
+        self.gen_tokens += 1
+        if r.t_first is None:
+            r.t_first = now
+        r.t_last = now
+        r.text += r.decoder.decode(_piece(self._model.vocab, tok, self._piece_buf))
+        for s in r.stop:
+            i = r.text.find(s, max(0, r.emitted - len(s)))
+            if i >= 0:
+                r.text = r.text[:i]
+                self._finish(r, "stop")
+                return
+        if r.n_gen >= r.max_tokens or r.n_past + 1 >= self.n_ctx_seq:
+            self._finish(r, "length")
+            return
+        keep = _partial_stop(r.text, r.stop) if r.stop else 0
+        if len(r.text) - keep > r.emitted:
+            r.out.put((r.text[r.emitted:len(r.text) - keep], None))
+            r.emitted = len(r.text) - keep
+        r.pending = [tok]
+
+    def _finish(self, r: _Request, reason: Optional[str], error: Optional[Exception] = None) -> None:
+        self._release(r)
+        if error is not None:
+            r.out.put(error)
+            return
+        if r.t_first is not None:
+            self._done_ttft.append(r.t_first - r.t_submit)
+            if r.n_gen > 1 and r.t_last > r.t_first:
+                self._done_rates.append((r.n_gen - 1) / (r.t_last - r.t_first))
+        r.text += r.decoder.decode(b"", final=True)
+        r.out.put((r.text[r.emitted:], reason))
+        r.out.put(_DONE)
+
+    def _release(self, r: _Request) -> None:
+        if r.seq >= 0:
+            _seq_rm(self._ctx.ctx, r.seq)
+            self._free.append(r.seq)
+            r.seq = -1
+        if r.sampler is not None:
+            r.sampler.close()
+            r.sampler = None
+
+
+def close_all(llm=None) -> None:
+    """모델 재로드 전에 모든 스케줄러(llm 을 주면 그 모델을 쓰는 것만)를 닫는다."""
+    for s in list(_LIVE):
+        if llm is None or s.llm is llm:
+            s.close()
+
+
+def format_batch_stats(s: Dict[str, Any]) -> str:
+    return (f"batch x{s['n_seq']}: {s['aggregate_tok_s']:.1f} tok/s total · "
+            f"{s['session_tok_s']:.1f} tok/s per session · avg batch {s['avg_batch']:.2f} · "
+            f"active {s['active']} / waiting {s['waiting']}")
@@ -0,0 +1,427 @@
+# bench.py — 채팅/예측 경로 end-to-end 벤치마크
+#
+# n_threads · n_ctx · 양자화 · 코드 변경 전후를 같은 조건으로 비교하기 위한 하네스.
+#   - parser : predict_parser.extract (앱이 매 메시지마다 호출)
+#   - predict: ModelBundle.predict_all (1건씩) + predict_batch (N행 한 번)
+#   - chat   : chat_once(앱: ThinkRouter + 전체 텍스트 렌더) / stream_answer(CLI: delta 렌더) 와 같은 stream_chat 경로
+# LLM 은 --model 의 실제 GGUF 또는 FakeLLM(정해진 속도로 결정적 토큰을 내는 대역)이라 모델 파일 없이도 돈다.
+# --bundle 이 없으면 합성 데이터로 작은 번들을 만들어 쓴다.
+# 결과: p50/p95 지연, TTFT, tokens/s, predictions/s, peak RSS → JSON(--out). --baseline 과 비교해 회귀 표시.
+# --metrics 면 metrics.py 구간 지표(타깃별 predict, solver iteration 등)도 JSON 에 넣는다.
+#
+# 예) python bench.py --out bench_base.json
+#     python bench.py --model qwen.gguf --threads 4 --baseline bench_base.json
+from __future__ import annotations
+import argparse
+import contextlib
+import io
+import json
+import os
+import platform
+import sys
+import time
+from typing import Any, Callable, Dict, Iterator, List, Optional
+
+import numpy as np
+
+import metrics
+from predict_parser import extract
+from stream_render import StreamRenderer, stream_chat
+from think_stream import ThinkRouter
+
+# 값이 클수록 좋은 지표 (나머지 지연/메모리 지표는 작을수록 좋음)
+HIGHER_IS_BETTER = ("_per_s",)
+
+PARSER_CORPUS = [
+    "콘크리트 강도 27 MPa, 철근항복강도 400, 단면 폭 800mm, 높이 1000, 휨모멘트 1000 kN-m",
+    "/predict fck=27 fy=400 width=800 height=1000 phi_mn=1000",
+    "/predict {\"fck\":27, \"fy\":400, \"b\":800, \"h\":1000, \"mu\":1000}",
+    "fck=30, 철근강도 fy=500 MPa, 단면폭=600mm, 단면높이=900mm, mu=1500 kN-m 일 때 철근비는?",
+    "철근 강도랑 단면 높이는 어떻게 정하나요?",
+    "오늘 점심 메뉴 추천해줘. 가능하면 한식으로 부탁해요.",
+    "Explain the difference between working stress design and strength design in two sentences.",
+]
+
+CHAT_PROMPTS = [
+    "철근콘크리트 보의 휨 설계 절차를 간단히 설명해줘.",
+    "fck 27 MPa 콘크리트의 탄성계수는 대략 얼마야?",
+    "What is a balanced reinforcement ratio?",
+    "단면 폭을 늘리면 철근비는 어떻게 변하나요?",
+]
+
+_FAKE_WORDS = ("철근", "콘크리트", "단면", "강도", "설계", "모멘트", "the", "beam", "ratio", "is",
+               "됩니다", "입니다", "따라서", "0.85", "fck", "×", "\n", "·")
+
+
+class FakeLLM:
+    """
+    llama_cpp.Llama 대역. create_chat_completion(스트림/논스트림), tokenize, detokenize, n_ctx, set_cache 만 구현.
+    출력은 (seed, 마지막 메시지)로 정해지고, 첫 토큰은 ttft_s 뒤, 이후 tok_s 속도로 나온다.
+    think_tokens > 0 이면 앞에 <think>…</think> 블록을 붙인다 (ThinkRouter 경로 측정용).
+    """
+
+    def __init__(self, tok_s: float = 30.0, ttft_s: float = 0.2, think_tokens: int = 0,
+                 seed: int = 0, n_ctx: int = 4096):
+        self.tok_s = float(tok_s)
+        self.ttft_s = float(ttft_s)
+        self.think_tokens = int(think_tokens)
+        self.seed = int(seed)
+        self._n_ctx = int(n_ctx)
+
+    # ---------- Llama 호환 ----------
+    def n_ctx(self) -> int:
+        return self._n_ctx
+
+    def tokenize(self, text: bytes, add_bos: bool = True, special: bool = False) -> List[int]:
+        # 대략 4 byte 당 1 토큰
+        return ([1] if add_bos else []) + list(range(2, 2 + (len(text) + 3) // 4))
+
+    def detokenize(self, tokens) -> bytes:
+        return b"x" * (4 * len(tokens))
+
+    def set_cache(self, cache) -> None:
+        pass
+
+    def close(self) -> None:
+        pass
+
+    def _pieces(self, messages: List[Dict[str, str]], max_tokens: int) -> List[str]:
+        last = messages[-1]["content"] if messages else ""
+        rng = np.random.default_rng([self.seed, sum(last.encode("utf-8")) % (1 << 31)])
+        words = rng.integers(0, len(_FAKE_WORDS), size=max_tokens)
+        pieces = [(" " if i else "") + _FAKE_WORDS[w] for i, w in enumerate(words)]
+        if self.think_tokens:
+            k = min(self.think_tokens, max(0, max_tokens - 2))
+            pieces = ["<think>"] + pieces[:k] + ["</think>"] + pieces[k:max_tokens - 2]
+        return pieces[:max_tokens]
+
+    def _paced(self, pieces: List[str]) -> Iterator[str]:
+        # 목표 시각 기준으로 sleep → 소비자 쪽 지연이 누적되지 않는다
+        t0 = time.perf_counter()
+        step = 1.0 / self.tok_s if self.tok_s > 0 else 0.0
+        for i, p in enumerate(pieces):
+            delay = t0 + self.ttft_s + i * step - time.perf_counter()
+            if delay > 0:
+                time.sleep(delay)
+            yield p
+
+    def create_chat_completion(self, messages: List[Dict[str, str]], stream: bool = False,
+                               max_tokens: int = 256, **_):
+        pieces = self._pieces(messages, int(max_tokens or 256))
+        if stream:
+            return self._stream(pieces)
+        text = "".join(self._paced(pieces))
+        return {"choices": [{"index": 0, "message": {"role": "assistant", "content": text},
+                             "finish_reason": "length"}],
+                "usage": {"completion_tokens": len(pieces)}}
+
+    def _stream(self, pieces: List[str]) -> Iterator[Dict[str, Any]]:
+        yield {"choices": [{"index": 0, "delta": {"role": "assistant"}, "finish_reason": None}]}
+        for p in self._paced(pieces):
+            yield {"choices": [{"index": 0, "delta": {"content": p}, "finish_reason": None}]}
+        yield {"choices": [{"index": 0, "delta": {}, "finish_reason": "length"}]}
+
+
+# ---------- 측정 도우미 ----------
+def _pct(xs, q: float) -> float:
+    return float(np.percentile(xs, q)) if len(xs) else 0.0
+
+
+def peak_rss_mb() -> Optional[float]:
+    """프로세스 최대 상주 메모리(MB). 측정 불가하면 None."""
+    try:
+        import resource
+        rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        return rss / (1024 * 1024) if sys.platform == "darwin" else rss / 1024   # macOS 는 byte, Linux 는 KB
+    except ImportError:
+        pass
+    try:
+        import psutil   # Windows
+        mi = psutil.Process().memory_info()
+        return getattr(mi, "peak_wset", mi.rss) / (1024 * 1024)
+    except ImportError:
+        return None
+
+
+def _timed(fn: Callable[[], Any], n: int, quiet: bool = True) -> List[float]:
+    """fn 을 n 번 호출한 각 소요 시간(s). quiet 이면 stdout 출력은 버린다 (출력 비용은 포함)."""
+    out: List[float] = []
+    sink = io.StringIO()
+    with contextlib.redirect_stdout(sink) if quiet else contextlib.nullcontext():
+        for _ in range(n):
+            t0 = time.perf_counter()
+            fn()
+            out.append(time.perf_counter() - t0)
+            sink.seek(0)
+            sink.truncate()
+    return out
+
+
+# ---------- 시나리오 ----------
+def bench_parser(n: int = 2000) -> Dict[str, float]:
+    """메시지 1개당 extract() 지연 (코퍼스를 순환)."""
+    corpus = PARSER_CORPUS
+    i = iter(range(1 << 62))
+    lat = _timed(lambda: extract(corpus[next(i) % len(corpus)]), n, quiet=False)
+    return {
+        "n": n,
+        "p50_us": _pct(lat, 50) * 1e6,
+        "p95_us": _pct(lat, 95) * 1e6,
+        "messages_per_s": n / sum(lat),
+    }
+
+
+def synthetic_bundle(n: int = 400, seed: int = 0):
+    """번들 파일이 없을 때 쓰는 작은 합성 번들 (RandomForest 3개 + Ridge 1개)."""
+    import pandas as pd
+    from sklearn.ensemble import RandomForestRegressor
+    from sklearn.linear_model import Ridge
+    from model_bundle import ModelBundle
+
+    rng = np.random.default_rng(seed)
+    df = pd.DataFrame({
+        "f_idx": rng.choice([24.4, 27.4, 30.5, 35.5], n),
+        "width": rng.uniform(300, 1500, n),
+        "height": rng.uniform(400, 1500, n),
+        "phi_mn": rng.uniform(100, 3000, n),
+    })
+    df["bd"] = df.width * df.height * 0.9
+    df["Sm"] = df.width * df.height ** 2 / 6
+    df["rho"] = df.phi_mn / (df.bd * df.height) * 1e3
+    feats = {
+        "bd": ["f_idx", "width", "height", "phi_mn", "rho"],
+        "Sm": ["f_idx", "width", "height", "bd"],
+        "rho": ["f_idx", "width", "height", "phi_mn", "bd", "Sm"],
+        "phi_mn": ["f_idx", "width", "height", "rho", "bd"],
+    }
+    models = {}
+    for t, f in feats.items():
+        m = Ridge() if t == "Sm" else RandomForestRegressor(30, random_state=seed)
+        models[t] = m.fit(df[f], df[t])
+    return ModelBundle(models=models, features_by_target=feats, targets=list(feats), source="<synthetic>")
+
+
+def _predict_inputs(n: int, seed: int = 0) -> List[Dict[str, float]]:
+    rng = np.random.default_rng(seed)
+    return [{"fck": float(rng.choice([24, 27, 30, 35])), "fy": float(rng.choice([400, 500])),
+             "width": float(rng.uniform(300, 1500)), "height": float(rng.uniform(400, 1500)),
+             "phi_mn": float(rng.uniform(100, 3000))} for _ in range(n)]
+
+
+def bench_predict(bundle, n: int = 100, batch_rows: int = 2000, seed: int = 0) -> Dict[str, float]:
+    """predict_all 1건씩 n 회 + predict_batch batch_rows 행 1회."""
+    import pandas as pd
+    rows = _predict_inputs(n, seed)
+    _timed(lambda: bundle.predict_all(rows[0]), 1)   # 지연 로드/작업 버퍼 준비
+    i = iter(range(n))
+    lat = _timed(lambda: bundle.predict_all(rows[next(i)]), n)
+    res = {
+        "n": n,
+        "p50_ms": _pct(lat, 50) * 1e3,
+        "p95_ms": _pct(lat, 95) * 1e3,
+        "predictions_per_s": n / sum(lat),
+    }
+    if batch_rows:
+        frame = pd.DataFrame(_predict_inputs(batch_rows, seed + 1))
+        (t,) = _timed(lambda: bundle.predict_batch(frame), 1)
+        res["batch_rows"] = batch_rows
+        res["batch_s"] = t
+        res["batch_rows_per_s"] = batch_rows / t
+    return res
+
+
+class _NullPlaceholder:
+    """st.empty() 대역: 렌더 호출만 받고 버린다."""
+
+    def markdown(self, _text: str) -> None:
+        pass
+
+    def caption(self, _text: str) -> None:
+        pass
+
+
+def _app_renderer(interval_ms: float, max_pending: int) -> ThinkRouter:
+    # chat_app_V2.1.chat_once 와 같은 구성 (본문 전체 텍스트 렌더 + 추론 캡션)
+    ph = _NullPlaceholder()
+    vis = StreamRenderer(ph.markdown, full=True, interval_ms=interval_ms, max_pending=max_pending)
+    rsn = StreamRenderer(lambda t: ph.caption(f"💭 …{t[-300:]}"), full=True,
+                         interval_ms=interval_ms, max_pending=max_pending)
+    return ThinkRouter(vis, rsn)
+
+
+def _cli_renderer(interval_ms: float, max_pending: int) -> StreamRenderer:
+    # chat_cli.stream_answer 와 같은 구성 (delta 출력)
+    return StreamRenderer(lambda d: None, full=False, interval_ms=interval_ms, max_pending=max_pending)
+
+
+CHAT_PATHS = {"chat_once": _app_renderer, "stream_answer": _cli_renderer}
+
+
+def bench_chat(llm, path: str = "chat_once", n: int = 4, max_tokens: int = 128,
+               temperature: float = 0.0, top_p: float = 0.95,
+               interval_ms: float = 100.0, max_pending: int = 32) -> Dict[str, float]:
+    """요청 n 개를 순서대로 생성. 지연 = 요청 시작 ~ 마지막 토큰 렌더까지."""
+    make = CHAT_PATHS[path]
+    lat, ttft, tps, toks = [], [], [], 0
+    for k in range(n):
+        messages = [{"role": "system", "content": "간결하게 답하라."},
+                    {"role": "user", "content": CHAT_PROMPTS[k % len(CHAT_PROMPTS)]}]
+        _, s = stream_chat(llm, messages, make(interval_ms, max_pending),
+                           temperature=temperature, top_p=top_p, max_tokens=max_tokens)
+        lat.append(s["total_s"])
+        ttft.append(s["ttft_s"])
+        tps.append(s["tok_per_s"])
+        toks += s["tokens"]
+    return {
+        "n": n,
+        "p50_s": _pct(lat, 50),
+        "p95_s": _pct(lat, 95),
+        "ttft_p50_s": _pct(ttft, 50),
+        "ttft_p95_s": _pct(ttft, 95),
+        "tokens_per_s": float(np.mean(tps)) if tps else 0.0,
+        "e2e_tokens_per_s": toks / sum(lat) if lat else 0.0,
+        "tokens": toks,
+    }
+
+
+# ---------- baseline 비교 ----------
+def _flatten(d: Dict[str, Any], prefix: str = "") -> Dict[str, float]:
+    out: Dict[str, float] = {}
+    for k, v in d.items():
+        key = f"{prefix}{k}"
+        if isinstance(v, dict):
+            out.update(_flatten(v, key + "."))
+        elif isinstance(v, (int, float)) and not isinstance(v, bool):
+            out[key] = float(v)
+    return out
+
+
+def compare(results: Dict[str, Any], baseline: Dict[str, Any], threshold: float = 0.10) -> List[Dict[str, Any]]:
+    """
+    두 결과의 공통 지표를 비교. delta 는 (현재 - 기준) / 기준.
+    좋아지는 방향의 반대로 threshold 이상 변하면 regressed=True (n, tokens 같은 개수 지표는 제외).
+    """
+    cur, base = _flatten(results["results"]), _flatten(baseline["results"])
+    rows = []
+    for key in sorted(cur.keys() & base.keys()):
+        leaf = key.rsplit(".", 1)[-1]
+        if leaf in ("n", "tokens", "batch_rows"):
+            continue
+        b, c = base[key], cur[key]
+        delta = (c - b) / b if b else 0.0
+        higher = key.endswith(HIGHER_IS_BETTER)
+        worse = -delta if higher else delta
+        rows.append({"metric": key, "baseline": b, "current": c, "delta": delta,
+                     "regressed": worse > threshold})
+    return rows
+
+
+def format_compare(rows: List[Dict[str, Any]]) -> str:
+    w = max((len(r["metric"]) for r in rows), default=10)
+    lines = [f"{'metric':<{w}}  {'baseline':>12}  {'current':>12}  {'delta':>8}"]
+    for r in rows:
+        flag = "  << REGRESSED" if r["regressed"] else ""
+        lines.append(f"{r['metric']:<{w}}  {r['baseline']:>12.4g}  {r['current']:>12.4g}  "
+                     f"{r['delta'] * 100:>+7.1f}%{flag}")
+    return "\n".join(lines)
+
+
+# ---------- main ----------
+def parse_args(argv=None):
+    p = argparse.ArgumentParser(description="chat / predict 경로 벤치마크")
+    p.add_argument("--only", default="parser,predict,chat", help="실행할 시나리오 (쉼표 구분)")
+    p.add_argument("--model", default="", help="GGUF 경로. 비우면 FakeLLM 사용")
+    p.add_argument("--chat-format", default="auto")
+    p.add_argument("--draft", default="", help="speculative decoding (--model 과 함께): lookup 또는 draft GGUF 경로")
+    p.add_argument("--draft-n", type=int, default=8)
+    p.add_argument("--ctx", type=int, default=2048)
+    p.add_argument("--threads", type=int, default=None, help="decode 스레드 수 (기본: autotune 결과 또는 cpu_count-1)")
+    p.add_argument("--fake-tok-s", type=float, default=30.0, help="FakeLLM 생성 속도 (tokens/s)")
+    p.add_argument("--fake-ttft", type=float, default=0.2, help="FakeLLM 첫 토큰 지연 (s)")
+    p.add_argument("--fake-think", type=int, default=16, help="FakeLLM <think> 토큰 수")
+    p.add_argument("--bundle", default="", help="회귀 번들 경로. 비우면 합성 번들")
+    p.add_argument("--n-parse", type=int, default=5000)
+    p.add_argument("--n-predict", type=int, default=100)
+    p.add_argument("--batch-rows", type=int, default=2000)
+    p.add_argument("--n-chat", type=int, default=4, help="채팅 경로별 요청 수")
+    p.add_argument("--tokens", type=int, default=128, help="채팅 max_tokens")
+    p.add_argument("--metrics", action="store_true", help="metrics 구간 지표도 수집해 JSON 에 포함 (측정 오버헤드 포함)")
+    p.add_argument("--out", default="", help="결과 JSON 저장 경로")
+    p.add_argument("--baseline", default="", help="비교할 이전 결과 JSON")
+    p.add_argument("--threshold", type=float, default=0.10, help="회귀 판정 비율 (0.10 = 10%%)")
+    return p.parse_args(argv)
+
+
+def main(argv=None) -> int:
+    a = parse_args(argv)
+    only = {s.strip() for s in a.only.split(",") if s.strip()}
+    meta: Dict[str, Any] = {
+        "time": time.strftime("%Y-%m-%d %H:%M:%S"),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "cpu_count": os.cpu_count(),
+    }
+    results: Dict[str, Any] = {}
+    metrics.enable(a.metrics)
+
+    if "parser" in only:
+        results["parser"] = bench_parser(a.n_parse)
+        print(f"[parser]  p50 {results['parser']['p50_us']:.1f}µs · {results['parser']['messages_per_s']:,.0f} msg/s")
+
+    if "predict" in only:
+        if a.bundle:
+            from model_bundle import get_shared_bundle
+            bundle = get_shared_bundle(a.bundle)
+        else:
+            bundle = synthetic_bundle()
+        meta["bundle"] = a.bundle or "<synthetic>"
+        r = results["predict"] = bench_predict(bundle, a.n_predict, a.batch_rows)
+        print(f"[predict] p50 {r['p50_ms']:.2f}ms · p95 {r['p95_ms']:.2f}ms · {r['predictions_per_s']:.1f} pred/s"
+              + (f" · batch {r['batch_rows_per_s']:,.0f} rows/s" if "batch_rows_per_s" in r else ""))
+
+    if "chat" in only:
+        if a.model:
+            from chat_cli import auto_chat_format, load_llm
+            llm = load_llm(a.model, a.ctx, a.threads, auto_chat_format(a.model, a.chat_format))
+            meta.update(model=a.model, n_ctx=a.ctx, n_threads=llm.n_threads, n_threads_batch=llm.n_threads_batch,
+                        n_batch=llm.n_batch, draft=a.draft)
+            if a.draft:
+                import speculative
+                speculative.attach(llm, speculative.make_drafter(a.draft, a.draft_n, a.ctx, llm.n_threads), a.draft_n)
+            stream_chat(llm, [{"role": "user", "content": "hi"}], _cli_renderer(100, 32), max_tokens=4)  # 워밍업
+        else:
+            llm = FakeLLM(a.fake_tok_s, a.fake_ttft, a.fake_think)
+            meta.update(model="<fake>", fake_tok_s=a.fake_tok_s, fake_ttft_s=a.fake_ttft, fake_think=a.fake_think)
+        for path in CHAT_PATHS:
+            r = results[path] = bench_chat(llm, path, a.n_chat, a.tokens)
+            print(f"[{path}] p50 {r['p50_s']:.2f}s · TTFT p50 {r['ttft_p50_s']:.2f}s · {r['tokens_per_s']:.1f} tok/s")
+        close = getattr(llm, "close", None)
+        if close is not None:
+            close()
+
+    results["peak_rss_mb"] = peak_rss_mb()
+    if results["peak_rss_mb"] is not None:
+        print(f"[memory]  peak RSS {results['peak_rss_mb']:.0f} MB")
+    doc = {"meta": meta, "results": results}
+    if a.metrics:
+        doc["metrics"] = metrics.snapshot()
+
+    if a.out:
+        with open(a.out, "w", encoding="utf-8") as f:
+            json.dump(doc, f, ensure_ascii=False, indent=2)
+        print(f"[SAVED] {a.out}")
+
+    if a.baseline:
+        with open(a.baseline, encoding="utf-8") as f:
+            base = json.load(f)
+        rows = compare(doc, base, a.threshold)
+        print(format_compare(rows))
+        bad = [r["metric"] for r in rows if r["regressed"]]
+        if bad:
+            print(f"[REGRESSION] {len(bad)} metric(s) worse than baseline by > {a.threshold:.0%}: {', '.join(bad)}")
+            return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
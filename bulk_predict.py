@@ -0,0 +1,243 @@
+# bulk_predict.py — CSV/Excel 일괄 예측
+#
+# 단면 일람표(CSV/Excel) 전체를 ModelBundle.predict_batch 로 chunk 단위 예측하고,
+# chunk 가 끝날 때마다 결과를 CSV/Parquet 파일에 이어 쓴다 → 메모리는 chunk 크기로 제한된다.
+# 컬럼명은 predict_parser.KEYMAP 별칭으로 해석한다 (예: b, bw → width / mu → phi_mn).
+#   python bulk_predict.py --bundle stack_bundle_1.joblib --input sections.csv --out sections_pred.parquet
+from __future__ import annotations
+import argparse
+import time
+from pathlib import Path
+from typing import Any, Callable, Dict, Iterator, List, Optional
+
+import numpy as np
+import pandas as pd
+
+from predict_parser import resolve_columns
+
+EXCEL_SUFFIXES = (".xlsx", ".xlsm", ".xls")
+PARQUET_SUFFIXES = (".parquet", ".pq")
+DEF_CHUNK_ROWS = 5000
+
+
+def _suffix(name: str) -> str:
+    return Path(str(name)).suffix.lower()
+
+
+def count_rows(src, name: Optional[str] = None) -> Optional[int]:
+    """CSV 데이터 행 수 (진행률용). 줄바꿈만 세므로 따옴표 안 줄바꿈이 있으면 근사값."""
+    name = name or getattr(src, "name", None) or str(src)
+    if _suffix(name) in EXCEL_SUFFIXES:
+        return None
+    n = 0
+    if isinstance(src, (str, Path)):
+        with open(src, "rb") as f:
+            for block in iter(lambda: f.read(1 << 20), b""):
+                n += block.count(b"\n")
+    elif hasattr(src, "seek"):
+        pos = src.tell()
+        while True:
+            block = src.read(1 << 20)
+            if not block:
+                break
+            n += block.count(b"\n" if isinstance(block, bytes) else "\n")
+        src.seek(pos)
+    else:
+        return None
+    return max(n - 1, 0)
+
+
+def iter_chunks(src, chunk_rows: int = DEF_CHUNK_ROWS, name: Optional[str] = None) -> Iterator[pd.DataFrame]:
+    """
+    입력을 chunk_rows 행씩 읽는다. src: 경로 또는 파일 객체(Streamlit UploadedFile 등).
+    Excel 은 pandas 가 부분 읽기를 지원하지 않아 한 번에 읽은 뒤 나눈다.
+    """
+    name = name or getattr(src, "name", None) or str(src)
+    if _suffix(name) in EXCEL_SUFFIXES:
+        df = pd.read_excel(src)
+        for start in range(0, len(df), chunk_rows):
+            yield df.iloc[start:start + chunk_rows]
+        return
+    yield from pd.read_csv(src, chunksize=chunk_rows)
+
+
+def _input_frame(chunk: pd.DataFrame, colmap: Dict[str, str]) -> pd.DataFrame:
+    """표준키 컬럼만 숫자로 변환한 predict_batch 입력."""
+    inp = pd.DataFrame(index=chunk.index)
+    for std in ("fck", "fy", "width", "height", "phi_mn"):
+        if std in colmap:
+            inp[std] = pd.to_numeric(chunk[colmap[std]], errors="coerce")
+    if "f_idx" in chunk.columns:
+        inp["f_idx"] = pd.to_numeric(chunk["f_idx"], errors="coerce")
+    return inp
+
+
+def _valid_rows(inp: pd.DataFrame) -> np.ndarray:
+    def fin(c):
+        return np.isfinite(inp[c].to_numpy(dtype=float)) if c in inp.columns else np.zeros(len(inp), bool)
+    # model_bundle._f_idx_array 와 같은 규칙: fck/fy 가 유한하고 rint(fy) >= 0 이거나, f_idx 가 유한
+    with np.errstate(invalid="ignore"):
+        fy_ok = np.rint(inp["fy"].to_numpy(dtype=float)) >= 0 if "fy" in inp.columns else np.zeros(len(inp), bool)
+    has_f = (fin("fck") & fin("fy") & fy_ok) | fin("f_idx")
+    return has_f & fin("width") & fin("height") & fin("phi_mn")
+
+
+def _predict_rows(bundle, inp: pd.DataFrame, targets: List[str]):
+    """
+    predict_batch 를 한 번에 시도하고, 실패하면 반씩 나눠 다시 시도 → 문제 있는 행만 error 로 남는다.
+    반환: (pred, iterations, converged, error) — error 는 성공한 행이 "".
+    """
+    n = len(inp)
+    try:
+        p, info = bundle.predict_batch(inp, return_info=True)
+        return (p[targets].to_numpy(dtype=float), info["iterations"].to_numpy(),
+                info["converged"].to_numpy(dtype=bool), np.full(n, "", dtype=object))
+    except Exception as e:
+        if n == 1:
+            return (np.full((1, len(targets)), np.nan), np.zeros(1, dtype=int), np.zeros(1, dtype=bool),
+                    np.array([f"predict failed: {e}"], dtype=object))
+    h = n // 2
+    parts = [_predict_rows(bundle, inp.iloc[:h], targets), _predict_rows(bundle, inp.iloc[h:], targets)]
+    return tuple(np.concatenate([a[i] for a in parts]) for i in range(4))
+
+
+class _CsvSink:
+    def __init__(self, path: Path):
+        self.f = open(path, "w", encoding="utf-8-sig", newline="")
+        self.first = True
+
+    def write(self, df: pd.DataFrame) -> None:
+        df.to_csv(self.f, header=self.first, index=False)
+        self.f.flush()
+        self.first = False
+
+    def close(self) -> None:
+        self.f.close()
+
+
+class _ParquetSink:
+    """chunk 마다 row group 하나. 첫 chunk 의 스키마로 고정 (숫자는 float64, 그 외는 문자열)."""
+
+    def __init__(self, path: Path):
+        try:
+            import pyarrow as pa
+            import pyarrow.parquet as pq
+        except ImportError as e:
+            raise ImportError("Parquet 출력에는 pyarrow 가 필요합니다 (pip install pyarrow)") from e
+        self.pa, self.pq = pa, pq
+        self.path = path
+        self.writer = None
+
+    @staticmethod
+    def _normalize(df: pd.DataFrame) -> pd.DataFrame:
+        out = {}
+        for c in df.columns:
+            s = df[c]
+            if pd.api.types.is_bool_dtype(s):
+                out[str(c)] = s
+            elif pd.api.types.is_numeric_dtype(s):
+                out[str(c)] = s.astype("float64")
+            else:
+                out[str(c)] = s.astype("string")
+        return pd.DataFrame(out)
+
+    def write(self, df: pd.DataFrame) -> None:
+        df = self._normalize(df)
+        if self.writer is None:
+            table = self.pa.Table.from_pandas(df, preserve_index=False)
+            self.writer = self.pq.ParquetWriter(str(self.path), table.schema)
+        else:
+            table = self.pa.Table.from_pandas(df, schema=self.writer.schema, preserve_index=False)
+        self.writer.write_table(table)
+
+    def close(self) -> None:
+        if self.writer is not None:
+            self.writer.close()
+
+
+def bulk_predict(bundle, src, out_path: str | Path, chunk_rows: int = DEF_CHUNK_ROWS,
+                 name: Optional[str] = None,
+                 progress: Optional[Callable[[int, Optional[int]], None]] = None) -> Dict[str, Any]:
+    """
+    src 의 각 행을 예측해 out_path(.csv | .parquet)에 원본 컬럼 + pred_<타깃> + iterations/converged/error 로 쓴다.
+    입력이 부족한 행은 건너뛰고 error 에 이유를 남긴다. progress(처리 행 수, 전체 행 수 또는 None)
+    반환: rows, predicted, failed, not_converged, seconds, rows_per_s, out_path, columns
+    """
+    out_path = Path(out_path)
+    out_path.parent.mkdir(parents=True, exist_ok=True)
+    name = name or getattr(src, "name", None) or str(src)
+    total = count_rows(src, name)
+    targets = list(bundle.targets)
+    sink = _ParquetSink(out_path) if out_path.suffix.lower() in PARQUET_SUFFIXES else _CsvSink(out_path)
+
+    t0 = time.perf_counter()
+    rows = predicted = failed = not_conv = 0
+    colmap: Optional[Dict[str, str]] = None
+    try:
+        for chunk in iter_chunks(src, chunk_rows, name):
+            if colmap is None:
+                colmap = resolve_columns(chunk.columns)
+                need = ["width", "height", "phi_mn"] + ([] if "f_idx" in chunk.columns else ["fck", "fy"])
+                missing = [k for k in need if k not in colmap]
+                if missing:
+                    raise ValueError(f"bulk input missing columns: {missing} (columns: {list(chunk.columns)})")
+            n = len(chunk)
+            inp = _input_frame(chunk, colmap)
+            ok = _valid_rows(inp)
+
+            pred = np.full((n, len(targets)), np.nan)
+            iters = np.zeros(n, dtype=int)
+            conv = np.zeros(n, dtype=bool)
+            err = np.where(ok, "", "missing or invalid input (fy < 0 or non-numeric)").astype(object)
+            if ok.any():
+                pred[ok], iters[ok], conv[ok], err[ok] = _predict_rows(bundle, inp[ok], targets)
+                ok = err == ""
+
+            out = chunk.reset_index(drop=True)
+            for j, t in enumerate(targets):
+                out[f"pred_{t}"] = pred[:, j]
+            out["iterations"] = iters
+            out["converged"] = conv
+            out["error"] = err
+            sink.write(out)
+
+            rows += n
+            predicted += int(ok.sum())
+            failed += int(n - ok.sum())
+            not_conv += int((ok & ~conv).sum())
+            if progress is not None:
+                progress(rows, total)
+    finally:
+        sink.close()
+
+    sec = time.perf_counter() - t0
+    return {
+        "rows": rows, "predicted": predicted, "failed": failed, "not_converged": not_conv,
+        "seconds": sec, "rows_per_s": rows / sec if sec > 0 else 0.0,
+        "out_path": str(out_path), "columns": colmap or {},
+    }
+
+
+def main():
+    p = argparse.ArgumentParser(description="CSV/Excel 단면 일괄 예측")
+    p.add_argument("--bundle", required=True, help="joblib bundle path (or split dir)")
+    p.add_argument("--input", required=True, help="input .csv / .xlsx")
+    p.add_argument("--out", default="", help="output .csv / .parquet (기본: <input>_pred.csv)")
+    p.add_argument("--chunk", type=int, default=DEF_CHUNK_ROWS, help="chunk rows")
+    args = p.parse_args()
+
+    from model_bundle import ModelBundle
+    bundle = ModelBundle.load(args.bundle)
+    out = args.out or str(Path(args.input).with_name(Path(args.input).stem + "_pred.csv"))
+
+    def progress(done, total):
+        print(f"\r[INFO] {done:,}/{total:,}" if total else f"\r[INFO] {done:,}", end="", flush=True)
+
+    s = bulk_predict(bundle, args.input, out, chunk_rows=args.chunk, progress=progress)
+    print()
+    print(f"[SAVED] {s['out_path']} — {s['predicted']:,}/{s['rows']:,} rows predicted, "
+          f"{s['failed']:,} failed, {s['not_converged']:,} not converged, {s['rows_per_s']:,.0f} rows/s")
+
+
+if __name__ == "__main__":
+    main()
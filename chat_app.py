@@ -1,10 +1,12 @@
 import os
 import json
-import re
 import time
 import streamlit as st
 from typing import List, Dict, Optional
 from llama_cpp import Llama
+from prompt_snapshot import PromptSnapshotStore
+from stream_render import StreamRenderer, stream_chat
+from think_stream import ThinkRouter, split_think
 
 st.set_page_config(page_title="BKChat Local", layout="wide")
 st.markdown("""
@@ -78,7 +80,12 @@ def auto_chat_format(model_path: str, user_choice: str) -> Optional[str]:
 
 def strip_think(text: str) -> str:
     # 필요 시 체크박스로 On/Off
-    return re.sub(r"<think>.*?</think>", "", text, flags=re.DOTALL).strip()
+    return split_think(text)[0]
+
+@st.cache_resource(show_spinner=False)
+def get_snapshot_store() -> PromptSnapshotStore:
+    '''system prompt KV 스냅샷 저장소 (프로세스 공유)'''
+    return PromptSnapshotStore()
 
 @st.cache_resource(show_spinner="Loading model...")
 def load_llm(model_path: str, n_ctx: int, n_threads: int, chat_format: Optional[str]) -> Llama:
@@ -91,30 +98,12 @@ def load_llm(model_path: str, n_ctx: int, n_threads: int, chat_format: Optional[
                          chat_format=None, verbose=False)
         raise
 
-def _split_reasoning(text: str) -> tuple[str, str]:
-    """모델 응답에서 <think> 블록을 분리한다. visible, think 를 반환."""
-    thinks = re.findall(r"<think>(.*?)</think>", text, flags=re.DOTALL)
-    think_text = "\n\n".join(t.strip() for t in thinks) if thinks else ""
-    visible = re.sub(r"<think>.*?</think>", "", text, flags=re.DOTALL).strip()
-    return visible, think_text
-
 def chat_once(llm: Llama, messages: List[Dict[str,str]], temperature: float, top_p: float, max_tokens: int, stream_placeholder):
-    # 스트리밍 출력
-    try:
-        it = llm.create_chat_completion(messages=messages, temperature=temperature, top_p=top_p, max_tokens=max_tokens, stream=True)
-        buf=[]
-        for ch in it:
-            delta = ch["choices"][0]["delta"].get("content","")
-            if delta:
-                buf.append(delta)
-                stream_placeholder.markdown("".join(buf))
-        raw = "".join(buf)
-        return _split_reasoning(raw)
-    except TypeError:
-        resp = llm.create_chat_completion(messages=messages, temperature=temperature, top_p=top_p, max_tokens=max_tokens)
-        raw = resp["choices"][0]["message"]["content"]
-        stream_placeholder.markdown(raw)
-        return _split_reasoning(raw)
+    # 스트리밍 출력: delta 를 모아 100ms 단위로만 다시 그림
+    # <think> 구간은 본문 말풍선에 흘리지 않고 따로 모음
+    router = ThinkRouter(StreamRenderer(stream_placeholder.markdown, full=True))
+    stream_chat(llm, messages, router, temperature=temperature, top_p=top_p, max_tokens=max_tokens)
+    return router.visible, router.reasoning
 
 # ---------- sidebar ----------
 with st.sidebar:
@@ -160,6 +149,7 @@ if not os.path.exists(model_path):
 
 chat_format = auto_chat_format(model_path, chat_fmt_choice)
 llm = load_llm(model_path, ctx, int(threads), chat_format)
+snapshots = get_snapshot_store()
 
 # ---------- UI ----------
 st.title("BKChat Local")
@@ -181,6 +171,9 @@ if user_msg:
     # 모델 응답
     with st.chat_message("assistant"):
         placeholder = st.empty()
+        if len(st.session_state.history) == 1:
+            # 새 대화: system prompt 평가 직후 상태(스냅샷)에서 시작
+            snapshots.prime(llm, model_path, int(ctx), system_prompt, chat_format)
         msgs = [{"role":"system","content":system_prompt}, *st.session_state.history]
         visible, think = chat_once(llm, msgs, float(temp), float(topp), int(toks), placeholder)
         # 새 메시지에 한해 기본 접힘 상태 결정
@@ -2,20 +2,53 @@
 
 import os
 import json
-import re
 import time
+import uuid
+from contextlib import nullcontext
+from functools import partial
 # import pandas as pd   # only for table expression printing
 import streamlit as st
 from typing import List, Dict, Optional
 from llama_cpp import Llama
+from prompt_snapshot import PromptSnapshotStore, model_fingerprint
+from stream_render import StreamRenderer, stream_chat, format_stats
+from think_stream import ThinkRouter, split_think
+from predict_report import render_report, PolishJob
+from bulk_predict import bulk_predict
+from server_client import RemoteLLM, RemoteBundle
+import batch_decode
+import speculative
+import autotune
+import preload
+import model_registry
+import llm_worker
+from model_registry import ModelRegistry
+from llm_access import LLMAccess, LLMView, Cancelled, format_access_stats
+import metrics
 # user functions
-from model_bundle import ModelBundle
+from model_bundle import ModelBundle, get_shared_bundle, release_shared
+from llm_cache import KVCacheManager
+from chat_context import ContextWindow, POLICIES
 from predict_parser import (
-    parse_predict_message,
-    parse_predict_natural,
+    extract,
     build_missing_prompt,
     REQUIRED_INPUT,
-    is_predict_intent,
+)
+
+@st.cache_resource(show_spinner=False)
+def init_metrics() -> bool:
+    '''로그 레벨 / 지표 싱크를 환경변수로 프로세스당 1회 설정 (이후 로그 레벨은 사이드바에서 바꿀 때만)'''
+    metrics.configure_logging()
+    metrics.sinks_from_env()
+    return metrics.enabled()
+
+init_metrics()
+log = metrics.get_logger("chat_app")
+
+# 예측 결과 요약용 고정 system prompt (KV 스냅샷 대상)
+PREDICT_SYS_PROMPT = (
+    "너는 구조공학 예측 결과를 한국어로 보고하는 도우미다. "
+    "주어진 수치를 변경하지 말고 그대로 사용해서 한 문단으로 간결히 설명하라."
 )
 
 st.set_page_config(page_title="BKChat Local", layout="wide")
@@ -90,62 +123,200 @@ def auto_chat_format(model_path: str, user_choice: str) -> Optional[str]:
 
 def strip_think(text: str) -> str:
     # 필요 시 체크박스로 On/Off
-    return re.sub(r"<think>.*?</think>", "", text, flags=re.DOTALL).strip()
-
-@st.cache_data(show_spinner=False, max_entries = 4)
-def load_bundle_cached(path: str) -> ModelBundle:
-    '''joblib 번들을 디스크에 로드하고 캐시'''
-    return ModelBundle.load(path)
-
-@st.cache_resource(show_spinner="Loading model...")
-def load_llm(model_path: str, n_ctx: int, n_threads: int, chat_format: Optional[str]) -> Llama:
-    try:
-        return Llama(model_path=model_path, n_ctx=n_ctx, n_threads=n_threads,
-                     chat_format=chat_format, verbose=False)
-    except Exception as e:
-        if "Invalid chat handler" in str(e):
-            return Llama(model_path=model_path, n_ctx=n_ctx, n_threads=n_threads,
-                         chat_format=None, verbose=False)
-        raise
-
-def _split_reasoning(text: str) -> tuple[str, str]:
-    """모델 응답에서 <think> 블록을 분리한다. visible, think 를 반환."""
-    thinks = re.findall(r"<think>(.*?)</think>", text, flags=re.DOTALL)
-    think_text = "\n\n".join(t.strip() for t in thinks) if thinks else ""
-    visible = re.sub(r"<think>.*?</think>", "", text, flags=re.DOTALL).strip()
-    return visible, think_text
-
-def chat_once(llm: Llama, messages: List[Dict[str,str]], temperature: float, top_p: float, max_tokens: int, stream_placeholder):
-    # 스트리밍 출력
-    try:
-        it = llm.create_chat_completion(messages=messages, temperature=temperature, top_p=top_p, max_tokens=max_tokens, stream=True)
-        buf=[]
-        for ch in it:
-            delta = ch["choices"][0]["delta"].get("content","")
-            if delta:
-                buf.append(delta)
-                stream_placeholder.markdown("".join(buf))
-        raw = "".join(buf)
-        return _split_reasoning(raw)
-    except TypeError:
-        resp = llm.create_chat_completion(messages=messages, temperature=temperature, top_p=top_p, max_tokens=max_tokens)
-        raw = resp["choices"][0]["message"]["content"]
-        stream_placeholder.markdown(raw)
-        return _split_reasoning(raw)
+    return split_think(text)[0]
+
+def load_bundle_cached(path: str, mmap: bool = False) -> ModelBundle:
+    '''번들을 프로세스 공유 핸들로 로드 (세션 간 pickle 복사 없음, 파일이 바뀌면 재로드).
+    디렉터리면 분할 번들로 보고 타깃별 모델을 처음 사용할 때 로드한다.'''
+    return get_shared_bundle(path, mmap_mode="r" if mmap else None)
+
+def new_kv_manager(model_path: str, n_ctx: int, capacity_mb: int, disk: bool) -> KVCacheManager:
+    '''모델별 KV 상태 캐시 (세션별 prefix 재사용). 레지스트리의 모델 warm pool 로 모델과 함께 유지/해제.
+    디스크 항목은 (모델 fingerprint, n_ctx, 세션) 별로 구분된다'''
+    fp = model_fingerprint(model_path)
+    return KVCacheManager(capacity_bytes=capacity_mb << 20, model_id=f"{fp}:{n_ctx}",
+                          disk_dir=os.path.join(".cache", "llama_kv", fp) if disk else None)
+
+@st.cache_resource(show_spinner=False)
+def get_snapshot_store() -> PromptSnapshotStore:
+    '''system prompt KV 스냅샷 저장소 (프로세스 공유)'''
+    return PromptSnapshotStore()
+
+@st.cache_resource(show_spinner="Loading draft model...")
+def load_drafter(model_key: tuple, spec: str, n_draft: int, n_ctx: int, n_threads: int):
+    '''speculative decoding drafter. DraftLlama 는 KV 상태를 가지므로 대상 모델(model_key)마다 하나씩'''
+    return speculative.make_drafter(spec, n_draft, n_ctx, n_threads)
+
+def load_llm(model_path: str, n_ctx: int, n_threads: int, chat_format: Optional[str]) -> LLMAccess:
+    '''세션 간 공유 Llama (레지스트리의 백그라운드 스레드에서 호출). 생성/상태 변경은 LLMAccess 잠금을 거친다 (세션별 뷰: .for_owner(sid))'''
+    tuned = autotune.llama_kwargs(model_path, n_threads)      # 저장된 autotune 결과: prefill 스레드 / n_batch / n_ubatch
+    with metrics.span("model_load"):
+        try:
+            llm = Llama(model_path=model_path, n_ctx=n_ctx, chat_format=chat_format, verbose=False, **tuned)
+        except Exception as e:
+            if "Invalid chat handler" not in str(e):
+                raise
+            llm = Llama(model_path=model_path, n_ctx=n_ctx, chat_format=None, verbose=False, **tuned)
+    return LLMAccess(llm)
+
+def warm_model(access: LLMAccess, store: PromptSnapshotStore, model_path: str, n_ctx: int,
+               chat_format: Optional[str], prompts: tuple) -> None:
+    '''로드 직후 (백그라운드): 짧은 생성 1회 + 알려진 system prompt 스냅샷 생성/확인'''
+    preload.warm_llm(access)
+    with access.hold():
+        store.ensure(access, model_path, n_ctx, prompts, chat_format)
+
+def dispose_llm(access: LLMAccess) -> None:
+    '''교체/해제된 모델 정리: 이 모델의 배치 스케줄러를 닫고, 진행 중인 생성이 끝나면 Llama 해제'''
+    batch_decode.close_all(access.llm)
+    access.close()
+
+@st.cache_resource(show_spinner=False)
+def get_registry() -> ModelRegistry:
+    '''프로세스 공유 모델/번들 레지스트리: RAM 예산 안에서 여러 모델 상주, LRU 해제, 항목별 reload'''
+    return ModelRegistry()
+
+def configure_bundle(base: ModelBundle, cache_size: int, cache_tol: float, cache_disk: bool,
+                     par_mode: str, par_workers: int) -> ModelBundle:
+    '''공유 번들의 설정별 뷰: 모델은 공유하고 예측 캐시 / 병렬 풀은 이 뷰가 따로 가진다'''
+    b = base.view()
+    if cache_size > 0:
+        b.enable_cache(maxsize=cache_size, tol=cache_tol,
+                       disk_path=os.path.join(".cache", "predict_cache.sqlite") if cache_disk else None)
+    if par_mode != "off":
+        b.enable_parallel(par_mode, par_workers)
+    return b
+
+def session_bundle(registry: ModelRegistry, key, settings: tuple) -> ModelBundle:
+    '''세션용 번들. 캐시/병렬 설정이 같은 세션끼리만 캐시·풀을 공유하고 (레지스트리 pool — 번들이 내려가거나
+    다시 로드되면 함께 닫힘), response grid 는 세션마다 따로 (.view())'''
+    base = registry.get(key).value
+    shared = registry.pool(key, f"bundle{settings}", partial(configure_bundle, base, *settings), config=settings, bind=True)
+    return shared.view()
+
+def request_bundle(registry: ModelRegistry, path: str, mmap: bool):
+    '''번들을 레지스트리에 요청 (백그라운드 로드 + 더미 predict_all). 반환: 항목'''
+    return registry.request((path, mmap), partial(load_bundle_cached, path, mmap), preload.warm_bundle,
+                            est_bytes=model_registry.file_bytes(path), kind=model_registry.BUNDLE,
+                            name=os.path.basename(path.rstrip("/\\")), dispose=lambda _b: release_shared(path))
+
+@st.cache_resource(show_spinner=False)
+def get_worker_slot() -> preload.Slot:
+    '''LLM 워커 연결 자리 (프로세스 공유). 값은 WorkerClient, 교체되면 이전 클라이언트의 연결을 닫는다'''
+    return preload.Slot(model_registry.LLM, dispose=lambda c: c.close())
+
+def connect_worker(spec: llm_worker.WorkerSpec, restart: bool = False) -> llm_worker.WorkerClient:
+    '''워커에 연결 (백그라운드 스레드). 없으면 이 설정으로 띄우고 모델 로드까지 대기, restart 면 실행 중인 워커를 내리고 새로 띄움'''
+    if restart:
+        try:
+            llm_worker.WorkerClient(connect_timeout=0).shutdown()
+        except llm_worker.WorkerError:
+            pass                  # 실행 중인 워커 없음
+    client = llm_worker.WorkerClient(spawn=spec)
+    client.ensure()
+    return client
+
+def model_turn(llm):
+    '''로컬 공유 모델이면 스냅샷 복원 ~ 생성 끝까지 잠금 (같은 세션의 새 요청이 오면 이 생성은 취소됨)'''
+    return llm.hold(stream=True) if isinstance(llm, LLMView) else nullcontext()
+
+def chat_once(llm: Llama, messages: List[Dict[str,str]], temperature: float, top_p: float, max_tokens: int, stream_placeholder,
+              interval_ms: float = 100.0, max_pending: int = 32, think_placeholder=None, max_think_tokens: int = 0):
+    # 스트리밍 출력: delta 를 모아 interval_ms / max_pending 단위로만 다시 그림
+    # <think> 구간은 본문 대신 think_placeholder 로(끝부분만 표시), 본문은 stream_placeholder 로 바로 흐른다
+    vis = StreamRenderer(stream_placeholder.markdown, full=True, interval_ms=interval_ms, max_pending=max_pending)
+    rsn = None
+    if think_placeholder is not None:
+        rsn = StreamRenderer(lambda t: think_placeholder.caption(f"💭 …{t[-300:]}"), full=True,
+                             interval_ms=interval_ms, max_pending=max_pending)
+    router = ThinkRouter(vis, rsn, max_reasoning_tokens=max_think_tokens)
+    _, stats = stream_chat(llm, messages, router, metrics_path="app",
+                           temperature=temperature, top_p=top_p, max_tokens=max_tokens)
+    if think_placeholder is not None:
+        think_placeholder.empty()
+    stats["reasoning_tokens"] = router.reasoning_tokens
+    st.session_state.last_gen_stats = stats
+    if router.truncated:
+        st.warning(f"추론이 {max_think_tokens} 토큰 예산을 넘어 생성을 중단했습니다.")
+    return router.visible, router.reasoning
 
 # ---------- sidebar ----------
 with st.sidebar:
     st.header("⚙️ Settings")
     model_path = st.text_input("Model (.gguf) path", r"c:\Users\BKHOME\mycode\chatbot\models\Qwen3-4B-Instruct-2507-Q3_K_S.gguf")
+    server_url = st.text_input("Inference server URL", "", placeholder="http://127.0.0.1:8765",
+                               help="server.py 주소. 지정하면 모델/번들을 로컬에 올리지 않고 서버에 요청").strip()
+    use_worker = st.checkbox("Run LLM in worker process", value=False, disabled=bool(server_url),
+                             help="Llama 를 별도 프로세스(llm_worker.py)에서 실행: UI 가 decode 와 경쟁하지 않고, "
+                                  "워커가 죽어도 앱은 살아 있으며 자동 재시작. 실행 중인 워커(CLI --worker 등)가 있으면 공유") \
+        and not server_url
+    worker_info = st.empty()
     chat_fmt_choice = st.selectbox("chat_format", ["auto","qwen","llama-3","none"], index=0)
     ctx = st.number_input("n_ctx", 256, 8192, 2048, 256)
-    threads = st.number_input("n_threads", 1, 64, max(1,(os.cpu_count() or 4)-1), 1)
+    tuned = None if server_url else autotune.lookup(model_path)
+    threads = st.number_input("n_threads", 1, 64, tuned.n_threads if tuned else autotune.default_threads(), 1,
+                              help="decode 스레드 수. 기본값은 autotune 결과 (없으면 cpu_count-1)")
+    if tuned:
+        st.caption(f"⚡ autotuned: {autotune.format_tuned(tuned)}")
     temp = st.slider("temperature", 0.0, 1.5, 0.6, 0.05)
     topp = st.slider("top_p", 0.1, 1.0, 0.95, 0.01)
     toks = st.number_input("max_tokens", 16, 4096, 512, 16)
     # 새 메시지에만 적용되는 기본 접힘 옵션
     hide_think_default = st.checkbox("Hide reasoning by default", value=True, help="변경은 새 응답에만 적용됩니다.")
+    kv_mb = st.number_input("KV cache (MB)", 0, 65536, 2048, 256, help="세션별 프롬프트 상태 캐시 용량. 0 이면 끔")
+    kv_disk = st.checkbox("KV cache disk tier", value=False, help="RAM 에서 밀려난 상태를 .cache/llama_kv 에 보관")
+    kv_metrics = st.empty()
+    history_policy = st.selectbox("history policy", list(POLICIES), index=0,
+                                  help="토큰 예산 초과 시: window=최근 메시지만, pin=최근 예측 결과 고정, summary=오래된 턴 요약")
+    ctx_metrics = st.empty()
+    stream_ms = st.number_input("stream flush (ms)", 0, 2000, 100, 20, help="스트리밍 화면 갱신 간격. 0 이면 토큰마다")
+    stream_tokens = st.number_input("stream flush (tokens)", 1, 1024, 32, 8, help="이만큼 쌓이면 간격과 무관하게 갱신")
+    think_budget = st.number_input("max reasoning tokens", 0, 8192, 0, 64, help="<think> 구간이 이 토큰 수를 넘으면 생성 중단. 0 이면 제한 없음")
+    batch_seq = st.number_input("batched sessions", 0, 16, 0, 1,
+                                help="동시 사용자의 일반 채팅을 한 batch 로 decode (KV 메모리 × 세션 수). 0 이면 끔")
+    batch_metrics = st.empty()
+    spec_mode = st.selectbox("speculative decoding", ["off", "prompt lookup", "draft model"], index=0,
+                             help="출력은 그대로, decode 를 빠르게. prompt lookup=프롬프트의 n-gram 재사용(예측 요약에 유리), "
+                                  "draft model=같은 vocab 의 작은 GGUF (예: Qwen3-0.6B). 모든 세션에 적용")
+    draft_path = st.text_input("draft model (.gguf)", "", placeholder="Qwen3-0.6B-Q4_K_M.gguf",
+                               disabled=spec_mode != "draft model").strip()
+    n_draft = st.number_input("draft tokens", 1, 32, speculative.DEF_N_DRAFT, 1, help="검증 1회에 추측할 최대 토큰 수")
+    spec_metrics = st.empty()
+    gen_metrics = st.empty()
+    lock_metrics = st.empty()
+    with st.expander("📈 Metrics", expanded=False):
+        # 수집/싱크는 프로세스 전체 설정 → 환경변수로만 (한 세션이 끄면 다른 세션과 /metrics 까지 멈추므로)
+        show_metrics = st.checkbox("show metrics", value=metrics.enabled(), disabled=not metrics.enabled(),
+                                   help="이 세션에 지표 표 표시. 수집(모델/번들 로드, 프롬프트 평가, TTFT, decode 속도, "
+                                        "타깃별 predict 시간)은 BKCHAT_METRICS=1 로 앱을 실행할 때 켜진다")
+        if not metrics.enabled():
+            st.caption("metrics collection off — BKCHAT_METRICS=1 (sinks: BKCHAT_METRICS_JSONL / BKCHAT_METRICS_PROM)")
+        cur_level = metrics.log_level()
+        st.selectbox("log level", metrics.LOG_LEVELS, key="log_level",
+                     index=metrics.LOG_LEVELS.index(cur_level) if cur_level in metrics.LOG_LEVELS else 0,
+                     on_change=lambda: metrics.configure_logging(st.session_state.log_level),
+                     help="프로세스 전체 로그 레벨 (바꿀 때만 적용)")
+        metrics_panel = st.empty()
+    registry = get_registry()
+    with st.expander("🗂 Resident models", expanded=False):
+        budget_gb = st.number_input("RAM budget (GB)", 0.5, 1024.0,
+                                    round(model_registry.default_budget_bytes() / 2**30, 1), 0.5,
+                                    help="상주 모델/번들(가중치 + KV + 세션 KV 캐시) 합이 넘으면 최근에 쓰지 않은 것부터 내림")
+        if int(budget_gb * 2**30) != registry.budget_bytes:
+            registry.set_budget(int(budget_gb * 2**30))
+        registry_info = st.empty()
+        registry_panel = st.empty()
+        resident = registry.entries()
+        picked = st.selectbox("entry", range(len(resident)), format_func=lambda i: resident[i].name,
+                              disabled=not resident)
+        c1, c2 = st.columns(2)
+        if c1.button("Reload", width="stretch", disabled=not resident, help="이 항목만 다시 로드 (준비될 때까지 현재 인스턴스 사용)"):
+            registry.reload(resident[picked].key)
+        if c2.button("Evict", width="stretch", disabled=not resident, help="이 항목만 메모리에서 내림"):
+            registry.evict(resident[picked].key)
     reload_btn = st.button("Reload model", width="stretch")
+    autotune_btn = st.button("⚡ Autotune threads / batch", width="stretch", disabled=bool(server_url),
+                             help="이 모델로 prefill/decode 속도를 측정해 최적 설정을 저장하고 모델을 다시 로드 (1~수 분)")
     st.divider()
     sys_default = "당신은 한국어와 영어를 명확하고 간결하게 답하는 조수입니다."
     system_prompt = st.text_area("System prompt", sys_default, height=80)
@@ -166,35 +337,279 @@ with st.sidebar:
     st.subheader("🧮 Regression bundle")
     if "bundle" not in st.session_state:
         st.session_state.bundle = None
-    bundle_path = st.text_input("bundle (.joblib) path", r"c:\Users\BKHOME\mycode\rcmodel\output\stack_bundle_1.joblib", key="bundle_path")
+    bundle_path = st.text_input("bundle (.joblib or split dir) path", r"c:\Users\BKHOME\mycode\rcmodel\output\stack_bundle_1.joblib", key="bundle_path")
+    cache_size = st.number_input("predict cache size", 0, 100000, 256, 64, help="0 이면 캐시 사용 안 함")
+    cache_tol = st.number_input("cache rounding tol", 0.0, 100.0, 0.0, 0.5, help="입력 반올림 간격 (mm, kN·m)")
+    cache_disk = st.checkbox("persist cache to disk", value=False, help=".cache/predict_cache.sqlite 에 저장")
+    par_mode = st.selectbox("parallel targets", ["off", "thread", "process"], index=0,
+                            help="iteration 내 타깃별 predict 동시 실행")
+    par_workers = st.number_input("parallel workers", 1, 64, max(1, min(4, os.cpu_count() or 1)), 1)
+    bundle_mmap = st.checkbox("memory-map arrays (mmap)", value=False,
+                              help="비압축 번들의 큰 배열을 메모리 맵으로 열어 프로세스 간 공유")
+    polish_predict = st.checkbox("polish predict summary with LLM", value=False,
+                                 help="결과는 템플릿으로 즉시 표시하고, 백그라운드에서 LLM 으로 문장을 다듬어 교체")
+    preload_bundle = st.checkbox("preload bundle at start", value=True,
+                                 help="앱 시작 시 백그라운드로 번들을 로드하고 더미 예측으로 데운 뒤 자동 연결")
     load_bundle_btn = st.button("Load bundle", width="stretch", key="btn_load_bundle")
-
+    bundle_settings = (int(cache_size), float(cache_tol), bool(cache_disk), par_mode, int(par_workers))
+
+    bundle_slot = None
+    if preload_bundle and not server_url and bundle_path and os.path.exists(bundle_path):
+        bundle_entry = request_bundle(registry, bundle_path, bool(bundle_mmap))
+        bundle_slot = bundle_entry.slot
+        preloaded = registry.get(bundle_entry.key)
+        if preloaded is not None and st.session_state.bundle is None and not load_bundle_btn:
+            st.session_state.bundle = session_bundle(registry, bundle_entry.key, bundle_settings)
+            st.caption(f"bundle preloaded ({preloaded.load_s + preloaded.warm_s:.1f}s): {', '.join(preloaded.value.targets)}")
     if load_bundle_btn:
         try:
-            st.session_state.bundle = load_bundle_cached(bundle_path)
+            if server_url:
+                # 번들은 서버 프로세스에 올라가 있음. 캐시/병렬 옵션은 서버 설정을 따른다
+                st.session_state.bundle = RemoteBundle(server_url)
+            else:
+                entry = request_bundle(registry, bundle_path, bool(bundle_mmap))
+                entry.slot.wait()
+                if registry.get(entry.key) is None:
+                    raise RuntimeError(entry.slot.status()["error"] or "not loaded")
+                st.session_state.bundle = session_bundle(registry, entry.key, bundle_settings)
             st.success(f"Bundle loaded: {', '.join(st.session_state.bundle.targets)}")
         except Exception as e:
             st.session_state.bundle = None
             st.error(f"Bundle load failed: {e}")
+    grid_path = st.text_input("response grid (.npz) path", "", key="grid_path",
+                              help="response_grid.py 로 생성. grid 위의 질의는 보간으로 즉시 응답")
+    if st.button("Attach grid", width="stretch", key="btn_attach_grid"):
+        if st.session_state.bundle is None:
+            st.warning("bundle 을 먼저 로드하세요.")
+        else:
+            try:
+                st.session_state.bundle.attach_grid(grid_path)
+                st.success("Response grid attached.")
+            except Exception as e:
+                st.error(f"Grid attach failed: {e}")
+    if st.session_state.bundle is not None and st.session_state.bundle.cache_stats():
+        cs = st.session_state.bundle.cache_stats()
+        st.caption(f"predict cache: {cs['size']}/{cs['maxsize']} · hit {cs['hits']} / miss {cs['misses']} "
+                   f"· evict {cs['evictions']} · disk hit {cs['disk_hits']}")
+    if st.session_state.bundle is not None and st.session_state.bundle.parallel_stats():
+        ps = st.session_state.bundle.parallel_stats()
+        st.caption(f"parallel ({ps['mode']} x{ps['workers']}): {ps['calls']} iters · "
+                   + (f"speedup {ps['speedup']:.2f}x (vs serial) · " if ps['speedup'] is not None else "")
+                   + f"overlap {ps['overlap']:.2f}x"
+                   + (f" · serial fallback {ps['fallbacks']} (pool rebuilt {ps['rebuilds']})" if ps['fallbacks'] else ""))
+
+    # --- Bulk predict (CSV/Excel) ---
+    bulk_file = st.file_uploader("Bulk predict (CSV/Excel)", type=["csv", "xlsx", "xls"], key="bulk_file",
+                                 help="컬럼명은 fck, fy, width(b), height(h), phi_mn(mu) 등 별칭 허용")
+    bulk_fmt = st.selectbox("bulk output format", ["csv", "parquet"], index=0)
+    if bulk_file is not None and st.button("Run bulk predict", width="stretch", key="btn_bulk"):
+        if st.session_state.bundle is None:
+            st.warning("bundle 을 먼저 로드하세요.")
+        else:
+            bar = st.progress(0.0, text="bulk predict…")
+
+            def _bulk_progress(done, total):
+                if total:
+                    bar.progress(min(done / total, 1.0), text=f"{done:,}/{total:,} rows")
+                else:
+                    bar.progress(0.0, text=f"{done:,} rows")
+
+            out_path = os.path.join(".cache", "bulk", f"{os.path.splitext(bulk_file.name)[0]}_pred.{bulk_fmt}")
+            try:
+                st.session_state.bulk_result = bulk_predict(st.session_state.bundle, bulk_file, out_path,
+                                                            progress=_bulk_progress)
+                bar.progress(1.0, text="done")
+            except Exception as e:
+                st.session_state.bulk_result = None
+                st.error(f"Bulk predict failed: {e}")
+    if st.session_state.get("bulk_result"):
+        br = st.session_state.bulk_result
+        st.caption(f"bulk: {br['predicted']:,}/{br['rows']:,} rows · failed {br['failed']:,} · "
+                   f"not converged {br['not_converged']:,} · {br['seconds']:.1f}s")
+        if os.path.exists(br["out_path"]):
+            with open(br["out_path"], "rb") as f:
+                st.download_button("Download bulk result", f.read(), file_name=os.path.basename(br["out_path"]),
+                                   mime="text/csv" if br["out_path"].endswith(".csv") else "application/octet-stream",
+                                   width="stretch", key="btn_bulk_dl")
 
 # ---------- state ----------
 if "history" not in st.session_state:
     st.session_state.history = []
+if "polish_jobs" not in st.session_state:
+    st.session_state.polish_jobs = []
+if "sid" not in st.session_state:
+    st.session_state.sid = uuid.uuid4().hex
+kv = None
 if clear_chat:
     st.session_state.history = []
-if reload_btn:
-    st.cache_resource.clear()
+chat_format = None if server_url else auto_chat_format(model_path, chat_fmt_choice)
+model_key = (model_path, int(ctx), int(threads), chat_format)
+if reload_btn and not use_worker:
+    # 이 모델만 백그라운드로 다시 로드해 준비되면 교체 (그동안 현재 인스턴스가 계속 응답, 다른 상주 모델은 그대로)
+    registry.reload(model_key)
+if autotune_btn and os.path.exists(model_path):
+    # 이 모델을 내린 상태에서 측정 (같은 CPU 를 두고 경쟁하지 않도록)
+    registry.evict(model_key, wait=True)
+    progress = st.empty()
+    with st.spinner("Autotuning threads / batch..."):
+        result = autotune.tune(model_path, progress=progress.text)
+    autotune.save(model_path, result)
+    progress.empty()
+    st.rerun()                    # 사이드바 n_threads 기본값을 새 결과로
 
 # ---------- model ----------
-if not os.path.exists(model_path):
-    st.error(f"Model not found: {model_path}")
-    st.stop()
-
-chat_format = auto_chat_format(model_path, chat_fmt_choice)
-llm = load_llm(model_path, ctx, int(threads), chat_format)
+if server_url:
+    # 서버 모드: 생성/토큰화는 server.py 가 처리 (KV 캐시·스냅샷도 서버 쪽 세션별)
+    remote = st.session_state.get("remote_llm")
+    if remote is None or remote.base_url != server_url.rstrip("/"):
+        remote = st.session_state.remote_llm = RemoteLLM(server_url, session=st.session_state.sid)
+    try:
+        remote.health(refresh=True)
+    except Exception as e:
+        st.error(f"Server not reachable: {server_url} ({e})")
+        st.stop()
+    llm = remote
+    ctx = remote.n_ctx() or ctx            # history 예산은 서버 모델의 n_ctx 기준
+    chat_format = None
+    snapshots = None
+    access = None
+    llm_slot = None
+elif use_worker:
+    # 워커 모드: 생성은 llm_worker 프로세스가 처리 (KV 캐시도 워커 쪽 세션별). 연결/기동은 백그라운드,
+    # 준비 전에는 llm=None → 입력은 버퍼에 두고 화면은 바로 그린다. Reload 는 현재 설정으로 워커를 다시 띄움
+    llm_slot = get_worker_slot()
+    worker_spec = llm_worker.WorkerSpec(model_path, int(ctx), int(threads), chat_format, int(kv_mb))
+    if reload_btn:
+        llm_slot.unload()
+        llm_slot.request(model_key, partial(connect_worker, worker_spec, restart=True), force=True)
+    else:
+        llm_slot.request(model_key, partial(connect_worker, worker_spec))
+    worker_status = llm_slot.status()
+    client = llm_slot.value
+    if client is None and worker_status["stage"] == preload.FAILED:
+        st.error(f"LLM worker failed: {worker_status['error']}")
+        st.stop()
+    llm = client.for_session(st.session_state.sid) if client is not None else None
+    if client is not None:
+        other = client.info.get("model_path") != os.path.abspath(model_path)
+        worker_info.caption(llm_worker.format_worker_info(client.info)
+                            + (" — 선택한 모델과 다름 (Reload 로 다시 띄움)" if other else ""))
+        ctx = client.info.get("n_ctx") or ctx     # history 예산은 워커 모델의 n_ctx 기준
+        if clear_chat:
+            client.forget(st.session_state.sid)
+    chat_format = None
+    snapshots = None
+    access = None
+else:
+    if not os.path.exists(model_path):
+        st.error(f"Model not found: {model_path}")
+        st.stop()
+
+    snapshots = get_snapshot_store()
+    # 레지스트리에 요청: 상주 중이면 즉시, 아니면 백그라운드 로드 (예산을 넘으면 LRU 모델부터 내림).
+    # 준비 전에는 이 세션이 직전에 쓰던 상주 모델로 응답하거나, 없으면 llm=None → 입력은 버퍼에 두고 화면은 바로 그린다
+    model_entry = registry.request(model_key, partial(load_llm, model_path, int(ctx), int(threads), chat_format),
+                                   partial(warm_model, store=snapshots, model_path=model_path, n_ctx=int(ctx),
+                                           chat_format=chat_format, prompts=(system_prompt, PREDICT_SYS_PROMPT)),
+                                   est_bytes=model_registry.estimate_llm_bytes(model_path, int(ctx)),
+                                   name=f"{os.path.basename(model_path)} · ctx {int(ctx)}",
+                                   dispose=dispose_llm, measure=model_registry.measure_llm_bytes)
+    llm_slot = model_entry.slot
+    loaded = registry.get(model_key)
+    model_status = llm_slot.status()
+    if loaded is None and model_status["stage"] == preload.FAILED:
+        st.error(f"Model load failed: {model_status['error']}")
+        st.stop()
+    if model_status["stage"] == preload.FAILED:
+        st.warning(f"Model reload failed, keeping the current model: {model_status['error']}")
+    prev_key = st.session_state.get("model_key")
+    if loaded is None and prev_key and prev_key != model_key and registry.get(prev_key) is not None:
+        # 새 모델이 준비될 때까지 직전 모델로 (아래 스냅샷/컨텍스트 설정도 그 모델 기준)
+        loaded = registry.get(prev_key)
+        registry.touch(prev_key)
+        model_key = prev_key
+        model_path, ctx, threads, chat_format = prev_key
+    elif loaded is not None:
+        st.session_state.model_key = model_key
+    # speculative decoding: 설정이 바뀐 경우에만 (생성 중이 아닐 때) drafter 교체
+    spec = {"prompt lookup": speculative.LOOKUP, "draft model": draft_path}.get(spec_mode, "")
+    if spec_mode == "draft model" and spec and not os.path.exists(spec):
+        spec_metrics.caption(f"draft model not found: {spec}")
+        spec = ""
+    if loaded is None:
+        llm = access = None
+    else:
+        access = loaded.value
+        if kv_mb > 0:
+            kv = registry.pool(model_key, "kv", partial(new_kv_manager, model_path, int(ctx), int(kv_mb), bool(kv_disk)),
+                               config=(int(kv_mb), bool(kv_disk)))
+            if clear_chat:
+                kv.drop_session(st.session_state.sid)
+        drafter = load_drafter(model_key, spec, int(n_draft), int(ctx), int(threads)) if spec else None
+        if not speculative.is_attached(access.llm, drafter, int(n_draft)):
+            with access.hold():
+                try:
+                    speculative.attach(access.llm, drafter, int(n_draft))
+                except ValueError as e:
+                    st.warning(f"speculative decoding off: {e}")
+                    speculative.detach(access.llm)
+        llm = access.for_owner(st.session_state.sid)
+        # 이 세션의 KV 상태 캐시 연결: 이전 턴까지의 prefix 를 복원하고 새 suffix 만 평가 (잠금을 잡을 때 적용)
+        llm.set_cache(kv.for_session(st.session_state.sid) if kv is not None else None)
+
+# 일반 채팅 생성기: batched sessions > 0 이면 세션 간 배치 스케줄러 (예측 요약 등 짧은 호출은 llm 그대로)
+gen_llm = llm
+if batch_seq > 0 and access is not None:
+    if batch_decode.supported(access.llm):
+        gen_llm = registry.pool(model_key, "batch", partial(batch_decode.BatchScheduler, access.llm, n_seq=int(batch_seq)),
+                                config=int(batch_seq), bind=True)
+    else:
+        batch_metrics.caption("batched sessions: 이 llama_cpp 버전은 multi-sequence decode 미지원")
+
+# 토큰 예산 기반 history 관리 (세션별, 모델/정책이 바뀌면 새로 생성)
+ctxwin = st.session_state.get("ctxwin")
+if ctxwin is None or ctxwin.llm is not llm or ctxwin.policy != history_policy:
+    ctxwin = st.session_state.ctxwin = ContextWindow(llm, int(ctx), reserve_tokens=int(toks), policy=history_policy)
+ctxwin.reserve_tokens = int(toks)
+
+def settle_polish_jobs(wait: bool = False) -> bool:
+    '''끝난 LLM polish 결과를 해당 예측 메시지에 반영. 아직 진행 중인 작업이 있으면 True'''
+    pending = []
+    for msg, job in st.session_state.polish_jobs:
+        if wait:
+            job.wait()
+        if not job.done:
+            pending.append((msg, job))
+        elif job.result:
+            msg['content'] = job.result
+    st.session_state.polish_jobs = pending
+    return bool(pending)
+
+def preload_panel(slots) -> None:
+    '''백그라운드 로드/워밍업 진행 표시. 끝나면(교체·실패) 전체를 다시 그려 버퍼에 둔 입력을 처리'''
+    busy = [s for s in slots if s is not None and s.busy]
+    if not busy:
+        return
+
+    @st.fragment(run_every=0.5)
+    def _poll():
+        if not any(s.busy for s in busy):
+            st.rerun()
+        for s in busy:
+            stt = s.status()
+            frac = min(stt["elapsed_s"] / stt["eta_s"], 0.95) if stt["eta_s"] else 0.0
+            st.progress(frac, text=f"⏳ {preload.format_status(stt)}"
+                                   + (" — 현재 모델로 응답 중" if s.name == model_registry.LLM and llm is not None else ""))
+        if st.session_state.get("pending_input"):
+            st.caption(f"대기 중인 입력 {len(st.session_state.pending_input)}건 — 준비되면 이어서 처리합니다.")
+    _poll()
 
 # ---------- UI ----------
 st.title("BKChat Local")
+preload_panel([llm_slot, bundle_slot])
+registry_info.caption(model_registry.format_registry(registry))
+registry_panel.dataframe(registry.stats(), hide_index=True, width="stretch")
+settle_polish_jobs()
 for turn in st.session_state.history:
     with st.chat_message(turn["role"]):
         st.markdown(turn["content"])
@@ -203,12 +618,30 @@ for turn in st.session_state.history:
             with st.expander("Show reasoning", expanded=bool(turn.get("expanded", False))):
                 st.markdown(turn["think"])
 
+if "pending_input" not in st.session_state:
+    st.session_state.pending_input = []
+bundle_loading = bundle_slot is not None and bundle_slot.busy and st.session_state.bundle is None
+
+def buffer_input(msg: str, what: str) -> None:
+    '''모델/번들 로드 중에 받은 입력: history 에는 이미 있고, 준비되면 다시 처리'''
+    st.session_state.pending_input.append(msg)
+    with st.chat_message("assistant"):
+        st.info(f"⏳ {what} 불러오는 중입니다 — 준비되면 이어서 답변합니다.")
+
 user_msg = st.chat_input("메시지를 입력하세요…")
+replay = False
+if not user_msg and st.session_state.pending_input and llm is not None and not bundle_loading:
+    # 로드 중 버퍼에 둔 입력을 하나씩 처리 (남아 있으면 끝에서 다시 실행)
+    user_msg = st.session_state.pending_input.pop(0)
+    replay = True
 if user_msg:
-    # 사용자 메시지 출력
-    st.session_state.history.append({"role":"user","content":user_msg})
-    with st.chat_message("user"):
-        st.markdown(user_msg)
+    # 같은 llm 을 동시에 쓰지 않도록 진행 중인 polish 를 먼저 마무리
+    settle_polish_jobs(wait=True)
+    # 사용자 메시지 출력 (버퍼에서 꺼낸 입력은 이미 history 에 있음)
+    if not replay:
+        st.session_state.history.append({"role":"user","content":user_msg})
+        with st.chat_message("user"):
+            st.markdown(user_msg)
 
     #### 예측 마법사 상태 초기화
     if "predict_wizard" not in st.session_state:
@@ -221,8 +654,13 @@ if user_msg:
     bundle_loaded = st.session_state.get("bundle") is not None
 
     # 0) 번들 미로드/비활성 시 안내    
-    intent_now = is_predict_intent(user_msg) or (parse_predict_message(user_msg) is not None) or (len(parse_predict_natural(user_msg)) > 0)
-    if intent_now and not bundle_loaded:
+    # 의도 / CLI 값 / 자연어 값을 한 번에 추출
+    parsed = extract(user_msg)
+    intent_now = parsed.intent
+    if intent_now and not bundle_loaded and bundle_loading:
+        buffer_input(user_msg, "bundle 을")
+        did_predict = True
+    elif intent_now and not bundle_loaded:
         with st.chat_message("assistant"):
             st.warning("bundle 이 로드되지 않았습니다. 경로 확인후 **Load bundle**.")
         did_predict = True
@@ -231,17 +669,17 @@ if user_msg:
     if not did_predict and st.session_state.predict_wizard["active"] and bundle_loaded:
         # CLI 메시지에는 자연어 파서를 적용하지 않아 값 덮어쓰기를 방지
         if user_msg.strip().lower().startswith("/predict"):
-            d_cli = parse_predict_message(user_msg) or {}
+            d_cli = parsed.cli or {}
             d_nat = {}
         else:
-            d_cli = parse_predict_message(user_msg) or {}
-            d_nat = parse_predict_natural(user_msg) or {}
+            d_cli = parsed.cli or {}
+            d_nat = parsed.natural
         st.session_state.predict_wizard["data"].update({**d_nat, **d_cli})
 
         merged = {**d_nat, **d_cli}
         st.session_state.predict_wizard["data"].update(merged)
         # --- debug: 예측 입력 echo ---
-        print("[DEBUG] predict_wizard step inputs:", merged)
+        log.debug("predict_wizard step inputs: %s", merged)
 
         collected = st.session_state.predict_wizard["data"]
         missing = [k for k in REQUIRED_INPUT if k not in collected]
@@ -253,33 +691,21 @@ if user_msg:
             # 모든 입력 확보 → 예측 수행
             with st.chat_message("assistant"):
                 try:
-                    preds = st.session_state.bundle.predict_all(collected)
-                    # LLM 을 이용한 자연어 요약
-                    sys_prompt = (
-                        "너는 구조공학 예측 결과를 한국어로 보고하는 도우미다. "
-                        "주어진 수치를 변경하지 말고 그대로 사용해서 한 문단으로 간결히 설명하라."
-                    )
-                    user_prompt = (
-                        "입력값과 예측값을 문장으로 요약하세요.\n"
-                        f"- 입력: fck={collected.get('fck')} MPa, "
-                        f"fy={collected.get('fy')} MPa, "
-                        f"width={collected.get('width')} mm, "
-                        f"height={collected.get('height')} mm, "
-                        f"phi_mn={collected.get('phi_mn')} kN·m\n"
-                        f"- 예측: Sm={preds.get('Sm')} mm², "
-                        f"bd={preds.get('bd')} mm², "
-                        f"rho={preds.get('rho')}, "
-                        f"phi_mn={preds.get('phi_mn')} kN·m\n"
-                        "형식 예: '단면계수 Sm은 (), 철근비 rho는 (), bd는 (), 공칭휨강도는 () 입니다'."
-                    )
-                    msgs = [
-                        {'role':'system', 'content': sys_prompt},
-                        {'role':'user',   'content': user_prompt},
-                    ]
-                    placeholder = st.empty()
-                    visible, think = chat_once(llm, msgs, float(temp), float(topp), int(toks), placeholder)
-                    placeholder.markdown(visible)
-                    st.session_state.history.append({'role':'assistant', 'content': visible})
+                    preds, info = st.session_state.bundle.predict_all(collected, return_info=True)
+                    if not info["converged"]:
+                        st.warning(f"반복 예측 미수렴 (iterations={info['iterations']}, residual={info['residual']:.3g}) — 결과 확인 필요")
+                    # 템플릿 요약 + 단위 표 (LLM 호출 없음)
+                    report = render_report(collected, preds)
+                    st.markdown(report)
+                    msg = {'role':'assistant', 'content': report, 'kind': 'predict'}
+                    st.session_state.history.append(msg)
+                    if polish_predict and llm is not None:
+                        # 선택: 백그라운드에서 LLM 으로 문장 다듬기 → 끝나면 msg 내용 교체
+                        prime = (lambda: snapshots.prime(llm, model_path, int(ctx), PREDICT_SYS_PROMPT, chat_format)) \
+                            if snapshots is not None else None
+                        job = PolishJob(llm, PREDICT_SYS_PROMPT, collected, preds, max_tokens=int(toks), temperature=float(temp),
+                                        prepare=prime)
+                        st.session_state.polish_jobs.append((msg, job.start()))
                 except Exception as e:
                     st.error(f"예측 실패: {e}")
                     st.session_state.history.append({"role":"assistant","content": f"예측 실패: {e}"})
@@ -290,11 +716,11 @@ if user_msg:
     # 2) 새 입력으로 마법사 시작 여부 결정    
     if not did_predict and bundle_loaded:
         if user_msg.strip().lower().startswith("/predict"):
-            d_cli0 = parse_predict_message(user_msg or "") or {}
+            d_cli0 = parsed.cli or {}
             d_nat0 = {}
         else:
-            d_cli0 = parse_predict_message(user_msg or "") or {}
-            d_nat0 = parse_predict_natural(user_msg or "") or {}
+            d_cli0 = parsed.cli or {}
+            d_nat0 = parsed.natural
         # trigger = (d_cli0 is not None) or (len(d_nat0) > 0)
         trigger = intent_now
         if trigger:
@@ -305,7 +731,7 @@ if user_msg:
             base.update(d_nat0)
             
             # --- debug: 최초 예측 입력 echo ---
-            print("[DEBUG] initial predict inputs:", base)
+            log.debug("initial predict inputs: %s", base)
             missing = [k for k in REQUIRED_INPUT if k not in base]
 
             if missing:
@@ -316,32 +742,21 @@ if user_msg:
             else:
                 with st.chat_message('assistant'):
                     try:
-                        preds = st.session_state.bundle.predict_all(base)
-                        sys_prompt = (
-                            "너는 구조공학 예측 결과를 한국어로 보고하는 도우미다. "
-                            "주어진 수치를 변경하지 말고 그대로 한 문단으로 간결히 설명하라."
-                        )
-                        user_prompt = (
-                            "입력값과 예측값을 문장으로 요약하세요.\n"
-                            f"- 입력: fck={base.get('fck')} MPa, "
-                            f"fy={base.get('fy')} MPa, "
-                            f"width={base.get('width')} mm, "
-                            f"height={base.get('height')} mm, "
-                            f"phi_mn={base.get('phi_mn')} kN·m\n"
-                            f"- 예측: Sm={preds.get('Sm')} mm², "
-                            f"bd={preds.get('bd')} mm², "
-                            f"rho={preds.get('rho')}, "
-                            f"phi_mn={preds.get('phi_mn')} kN·m\n"
-                            "형식 예: '단면계수 Sm은 (), 철근비 rho는 (), bd는 (), 공칭휨강도는 () 입니다'."
-                        )
-                        msgs = [
-                            {'role':'system', 'content': sys_prompt},
-                            {'role':'user',   'content': user_prompt},
-                        ]
-                        placeholder = st.empty()
-                        visible, think = chat_once(llm, msgs, float(temp), float(topp), int(toks), placeholder)
-                        placeholder.markdown(visible)
-                        st.session_state.history.append({'role':'assistant', 'content': visible})
+                        preds, info = st.session_state.bundle.predict_all(base, return_info=True)
+                        if not info["converged"]:
+                            st.warning(f"반복 예측 미수렴 (iterations={info['iterations']}, residual={info['residual']:.3g}) — 결과 확인 필요")
+                        # 템플릿 요약 + 단위 표 (LLM 호출 없음)
+                        report = render_report(base, preds)
+                        st.markdown(report)
+                        msg = {'role':'assistant', 'content': report, 'kind': 'predict'}
+                        st.session_state.history.append(msg)
+                        if polish_predict and llm is not None:
+                            # 선택: 백그라운드에서 LLM 으로 문장 다듬기 → 끝나면 msg 내용 교체
+                            prime = (lambda: snapshots.prime(llm, model_path, int(ctx), PREDICT_SYS_PROMPT, chat_format)) \
+                                if snapshots is not None else None
+                            job = PolishJob(llm, PREDICT_SYS_PROMPT, base, preds, max_tokens=int(toks), temperature=float(temp),
+                                            prepare=prime)
+                            st.session_state.polish_jobs.append((msg, job.start()))
                     except Exception as e:
                         st.error(f'예측 실패: {e}')
                         st.session_state.history.append({"role":"assistant","content": f"예측 실패: {e}"})
@@ -349,11 +764,34 @@ if user_msg:
                 did_predict = True
 
     # 모델 응답 (예측 플로우가 아니거나 종료된 경우)
-    if not did_predict:
+    if not did_predict and llm is None:
+        buffer_input(user_msg, "모델을")
+    elif not did_predict:
         with st.chat_message("assistant"):
+            think_ph = st.empty()
             placeholder = st.empty()
-            msgs = [{"role":"system","content":system_prompt}, *st.session_state.history]
-            visible, think = chat_once(llm, msgs, float(temp), float(topp), int(toks), placeholder)
+            try:
+                with model_turn(gen_llm):
+                    if len(st.session_state.history) == 1 and gen_llm is llm:
+                        # 새 대화: system prompt 평가 직후 상태(스냅샷)에서 시작
+                        if snapshots is not None:
+                            snapshots.prime(llm, model_path, int(ctx), system_prompt, chat_format)
+                    msgs = ctxwin.fit(system_prompt, st.session_state.history)
+                    visible, think = chat_once(gen_llm, msgs, float(temp), float(topp), int(toks), placeholder, float(stream_ms), int(stream_tokens),
+                                               think_placeholder=think_ph, max_think_tokens=int(think_budget))
+            except llm_worker.WorkerError as e:
+                # 워커가 생성 도중 종료됨 → 감시 프로세스가 다시 띄우는 동안 백그라운드로 재연결 (부분 응답은 기록하지 않음)
+                st.toast(f"LLM worker: {e}", icon="⚠️")
+                llm_slot.unload()
+                llm_slot.reload()
+                st.rerun()
+            except Cancelled:
+                if access is not None and access.closed:
+                    # 생성 직전에 모델이 교체됨 → 새 모델로 다시 처리
+                    st.session_state.pending_input.insert(0, user_msg)
+                    st.rerun()
+                # 같은 세션의 새 요청이 이 생성을 대체함 → 부분 응답은 기록하지 않음
+                st.stop()
             expanded_now = not hide_think_default
             placeholder.markdown(visible)
             if think:
@@ -374,3 +812,43 @@ if st.button("Save chat"):
                        file_name=f"chat_{int(time.time())}.json",
                        mime="application/json",
                        use_container_width=True)
+
+# 컨텍스트 사용량 (마지막 요청 기준)
+if ctxwin.last_total:
+    ctx_metrics.caption(f"context: {ctxwin.last_total}/{ctxwin.budget} tokens · dropped {ctxwin.last_dropped} msgs")
+
+# 생성 속도 (마지막 응답 기준, 렌더링 시간 제외)
+if st.session_state.get("last_gen_stats"):
+    gen_metrics.caption(f"generation: {format_stats(st.session_state.last_gen_stats)}")
+if gen_llm is not llm:
+    batch_metrics.caption(batch_decode.format_batch_stats(gen_llm.stats()))
+if isinstance(llm, LLMView):
+    lock_metrics.caption(format_access_stats(llm.access.stats()))
+    spec_stats = speculative.stats(llm.access.llm)
+    if spec_stats is not None:
+        spec_metrics.caption(f"speculative · {speculative.format_spec_stats(None, spec_stats)}")
+
+# 수집 지표 표 (이번 턴 반영 후)
+if metrics.enabled() and show_metrics:
+    metrics_panel.dataframe(metrics.snapshot_rows(), hide_index=True, width="stretch")
+
+# KV 캐시 지표 (이번 턴 반영 후 표시)
+if kv is not None:
+    ks = kv.stats()
+    kv_metrics.caption(
+        f"KV cache: {ks['bytes'] / 2**20:.0f}/{ks['capacity_bytes'] / 2**20:.0f} MB · "
+        f"hit {ks['hits']} / miss {ks['misses']} (disk {ks['disk_hits']}) · "
+        f"evict {ks['evictions']} · sessions {ks['sessions']}"
+    )
+
+# 버퍼에 입력이 남았고 준비가 끝났으면 다음 입력 처리
+if replay and st.session_state.pending_input:
+    st.rerun()
+
+# polish 진행 중이면 1초 간격으로 확인 → 끝나면 다시 그림
+if st.session_state.polish_jobs:
+    @st.fragment(run_every=1.0)
+    def _poll_polish():
+        if any(job.done for _, job in st.session_state.polish_jobs):
+            st.rerun()
+    _poll_polish()
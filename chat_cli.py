@@ -6,9 +6,20 @@ import sys
 import json
 import time
 import argparse
+import shlex
 from pathlib import Path
 from typing import List, Dict, Tuple, Optional
 from llama_cpp import Llama
+from prompt_snapshot import PromptSnapshotStore, DEF_SNAPSHOT_DIR
+from chat_context import ContextWindow, POLICIES
+from stream_render import StreamRenderer, stream_chat, format_stats
+from model_bundle import get_shared_bundle
+from bulk_predict import bulk_predict
+from server_client import RemoteLLM, RemoteBundle, ServerError
+from llm_worker import WorkerClient, WorkerSpec, format_worker_info, DEF_PORT as DEF_WORKER_PORT
+import metrics
+import speculative
+import autotune
 
 DEF_MODEL = r"c:\Users\BKHOME\mycode\LLM\models\Qwen3-1.7B-Q4_K_M.gguf"
 #DEF_MODEL = r"c:\Users\BKHOME\mycode\LLM\models\Qwen3-4B-Q4_K_M.gguf"
@@ -17,7 +28,8 @@ DEF_MODEL = r"c:\Users\BKHOME\mycode\LLM\models\Qwen3-1.7B-Q4_K_M.gguf"
 
 BANNER = (
     "[READY] /q 종료  /new 새대화  /save [파일.json]  /load 파일.json  /sys [문구]\n"
-    "        /temp 값  /toks 값  /ctx 값  /threads 값  /help 도움말"
+    "        /temp 값  /toks 값  /ctx 값  /threads 값  /metrics  /help 도움말\n"
+    "        /predict @입력.csv|xlsx [출력.csv|parquet]  (--bundle 또는 --server 필요)"
 )
 
 # ---------- args ----------
@@ -26,7 +38,10 @@ def parse_args():
     p.add_argument("--model", default=DEF_MODEL, help="GGUF model path")
     p.add_argument("--chat-format", default="auto", help="auto | qwen | llama-3 | ...")
     p.add_argument("--ctx", type=int, default=2048, help="context window size")
-    p.add_argument("--threads", type=int, default=max(1, (os.cpu_count() or 4) - 1))
+    p.add_argument("--threads", type=int, default=None,
+                   help="decode 스레드 수 (기본: autotune 결과 또는 cpu_count-1)")
+    p.add_argument("--autotune", action="store_true",
+                   help="로드 전에 스레드/배치 설정을 측정해 저장 (이후 실행은 저장된 값을 자동 사용)")
     p.add_argument("--temp", type=float, default=0.6)
     p.add_argument("--topp", type=float, default=0.95)
     p.add_argument("--tokens", type=int, default=512)
@@ -35,6 +50,22 @@ def parse_args():
         default="당신은 한국어와 영어를 명확하고 간결하게 답하는 조수입니다.",
         help="system prompt",
     )
+    p.add_argument("--snapshot-dir", default=DEF_SNAPSHOT_DIR,
+                   help="system prompt KV 스냅샷 저장 폴더 ('' 이면 사용 안 함)")
+    p.add_argument("--history-policy", default="window", choices=POLICIES,
+                   help="토큰 예산 초과 시 history 처리: window | pin | summary")
+    p.add_argument("--bundle", default="", help="회귀 번들(.joblib 또는 분할 폴더) — /predict @파일 일괄 예측용")
+    p.add_argument("--server", default="", help="server.py 주소 (예: http://127.0.0.1:8765). 지정하면 모델/번들을 로컬에 올리지 않음")
+    p.add_argument("--worker", action="store_true",
+                   help="Llama 를 전용 워커 프로세스(llm_worker.py)에서 실행. 실행 중인 워커가 있으면 공유, 없으면 띄움")
+    p.add_argument("--worker-port", type=int, default=DEF_WORKER_PORT, help="워커 포트 (127.0.0.1)")
+    p.add_argument("--draft", default="", help="speculative decoding: lookup (프롬프트 n-gram) 또는 draft GGUF 경로 (같은 vocab, 예: Qwen3-0.6B)")
+    p.add_argument("--draft-n", type=int, default=speculative.DEF_N_DRAFT, help="검증 1회에 추측할 최대 토큰 수")
+    p.add_argument("--metrics", action="store_true", help="구간 타이밍/카운터 수집 (/metrics 로 확인)")
+    p.add_argument("--metrics-jsonl", default="", help="지표 이벤트 JSONL 파일 (--metrics 와 함께)")
+    p.add_argument("--metrics-prom", default="", help="Prometheus text 형식 지표 파일 (--metrics 와 함께)")
+    p.add_argument("--log-level", default="", choices=["", *metrics.LOG_LEVELS],
+                   help="로그 레벨 (기본: 환경변수 BKCHAT_LOG_LEVEL 또는 WARNING)")
     return p.parse_args()
 
 # ---------- helpers ----------
@@ -49,56 +80,64 @@ def auto_chat_format(model_path: str, user_arg: str) -> Optional[str]:
         return "llama-3"
     return None
 
-def load_llm(model_path: str, n_ctx: int, n_threads: int, chat_format: Optional[str]) -> Llama:
-    """chat_format 미지원이면 None으로 자동 폴백."""
-    try:
-        return Llama(
-            model_path=model_path,
-            n_ctx=n_ctx,
-            n_threads=n_threads,
-            chat_format=chat_format,
-            verbose=False,
-        )
-    except Exception as e:
-        if "Invalid chat handler" in str(e):
-            print("[WARN] chat_format unsupported → fallback to None")
+def load_llm(model_path: str, n_ctx: int, n_threads: Optional[int], chat_format: Optional[str]) -> Llama:
+    """chat_format 미지원이면 None으로 자동 폴백. autotune 결과가 있으면 스레드/배치 설정 적용 (n_threads 지정 시 decode 스레드는 그 값)."""
+    tuned = autotune.llama_kwargs(model_path, n_threads)
+    with metrics.span("model_load"):
+        try:
             return Llama(
                 model_path=model_path,
                 n_ctx=n_ctx,
-                n_threads=n_threads,
-                chat_format=None,
+                chat_format=chat_format,
                 verbose=False,
+                **tuned,
             )
-        raise
+        except Exception as e:
+            if "Invalid chat handler" in str(e):
+                print("[WARN] chat_format unsupported → fallback to None")
+                return Llama(
+                    model_path=model_path,
+                    n_ctx=n_ctx,
+                    chat_format=None,
+                    verbose=False,
+                    **tuned,
+                )
+            raise
 
 def stream_answer(llm: Llama, messages: List[Dict[str, str]], temp: float, topp: float, toks: int) -> str:
-    """스트리밍 우선, 불가하면 논스트림."""
-    try:
-        it = llm.create_chat_completion(
-            messages=messages,
-            temperature=temp,
-            top_p=topp,
-            max_tokens=toks,
-            stream=True,
-        )
-        buf: List[str] = []
-        for ch in it:
-            delta = ch["choices"][0]["delta"].get("content", "")
-            if delta:
-                print(delta, end="", flush=True)
-                buf.append(delta)
-        print()
-        return "".join(buf)
-    except TypeError:
-        resp = llm.create_chat_completion(
-            messages=messages,
-            temperature=temp,
-            top_p=topp,
-            max_tokens=toks,
-        )
-        txt = resp["choices"][0]["message"]["content"]
-        print(txt)
-        return txt
+    """스트리밍 우선, 불가하면 논스트림. 출력은 50ms 단위로 묶어 flush."""
+    renderer = StreamRenderer(lambda d: print(d, end="", flush=True), full=False, interval_ms=50)
+    spec0 = speculative.stats(llm)
+    txt, stats = stream_chat(llm, messages, renderer, metrics_path="cli",
+                             temperature=temp, top_p=topp, max_tokens=toks)
+    print()
+    spec = speculative.format_spec_stats(spec0, speculative.stats(llm))
+    print(f"[GEN] {format_stats(stats)}" + (f" · {spec}" if spec else ""))
+    return txt
+
+def run_bulk_predict(bundle_path: str, arg: str, server: str = "") -> None:
+    """/predict @입력 [출력]: 파일 전체를 chunk 단위로 예측해 결과 파일로 저장."""
+    parts = [p.strip('"\'') for p in shlex.split(arg, posix=False)]
+    if not parts:
+        print("사용법: /predict @입력.csv [출력.csv|출력.parquet]")
+        return
+    src = parts[0]
+    out = parts[1] if len(parts) > 1 else str(Path(src).with_name(Path(src).stem + "_pred.csv"))
+    if not bundle_path and not server:
+        print("[ERR] --bundle 경로(또는 --server)가 필요합니다")
+        return
+    if not os.path.exists(src):
+        print(f"[ERR] file not found: {src}")
+        return
+
+    def progress(done, total):
+        print(f"\r[BULK] {done:,}/{total:,}" if total else f"\r[BULK] {done:,}", end="", flush=True)
+
+    bundle = RemoteBundle(server) if server else get_shared_bundle(bundle_path)
+    s = bulk_predict(bundle, src, out, progress=progress)
+    print()
+    print(f"[SAVED] {s['out_path']} — {s['predicted']:,}/{s['rows']:,} rows, failed {s['failed']:,}, "
+          f"not converged {s['not_converged']:,}, {s['seconds']:.1f}s")
 
 def save_history(path: str, system_msg: str, history: List[Dict[str, str]]) -> None:
     data = {"system": system_msg, "messages": history}
@@ -112,21 +151,67 @@ def load_history(path: str) -> Tuple[str, List[Dict[str, str]]]:
 # ---------- main ----------
 def main():
     args = parse_args()
-    if not os.path.exists(args.model):
+    metrics.configure_logging(args.log_level or None)
+    if args.metrics:
+        metrics.enable()
+        metrics.set_sinks(args.metrics_jsonl, args.metrics_prom)
+    if not args.server and not os.path.exists(args.model):
         print(f"[ERR] model not found: {args.model}")
         sys.exit(1)
 
-    chat_format = auto_chat_format(args.model, args.chat_format)
+    chat_format = None if args.server else auto_chat_format(args.model, args.chat_format)
 
-    print("[INFO] Loading model…")
     llm: Optional[Llama] = None
     try:
-        llm = load_llm(args.model, args.ctx, args.threads, chat_format)
-        print("[INFO] Model loaded.")
-        print(BANNER)
+        if args.server:
+            # 모델은 서버에 한 번만 올라가 있음 (KV 캐시·스냅샷도 서버 쪽)
+            llm = RemoteLLM(args.server)
+            if args.draft:
+                print("[WARN] --draft 는 로컬 모델에만 적용됩니다 (서버 모드에서는 무시)")
+            if args.autotune:
+                print("[WARN] --autotune 은 로컬 모델에만 적용됩니다 (서버 쪽에서 autotune.py 실행)")
+            print(f"[INFO] Server: {args.server} ({llm.health().get('model') or 'no model'})")
+        elif args.worker:
+            # 생성은 워커 프로세스에서 (죽으면 워커가 자동 재시작, 앱과 같은 워커 공유). KV 캐시도 워커 쪽
+            if args.autotune:
+                print("[INFO] Autotuning threads / batch…")
+                tuned = autotune.tune(args.model, progress=lambda m: print("  " + m))
+                autotune.save(args.model, tuned)
+                print(f"[TUNED] {autotune.format_tuned(tuned)} (새로 띄우는 워커부터 적용)")
+            if args.draft:
+                print("[WARN] --draft 는 로컬 모델에만 적용됩니다 (워커 모드에서는 무시)")
+            print("[INFO] Connecting to LLM worker…")
+            client = WorkerClient(port=args.worker_port,
+                                  spawn=WorkerSpec(args.model, args.ctx, args.threads, chat_format))
+            info = client.ensure()
+            if os.path.abspath(args.model) != info["model_path"]:
+                print(f"[WARN] 실행 중인 워커는 다른 모델을 사용합니다: {info['model']}")
+            print(f"[INFO] {format_worker_info(info)}")
+            llm = client.for_session(None)
+        else:
+            if args.autotune:
+                print("[INFO] Autotuning threads / batch…")
+                tuned = autotune.tune(args.model, progress=lambda m: print("  " + m))
+                autotune.save(args.model, tuned)
+                print(f"[TUNED] {autotune.format_tuned(tuned)}")
+            print("[INFO] Loading model…")
+            llm = load_llm(args.model, args.ctx, args.threads, chat_format)
+            print(f"[INFO] Model loaded. (threads {llm.n_threads}/{llm.n_threads_batch}, batch {llm.n_batch})")
+            if args.draft:
+                speculative.attach(llm, speculative.make_drafter(args.draft, args.draft_n, args.ctx, llm.n_threads),
+                                   args.draft_n)
+                print(f"[INFO] speculative decoding: {args.draft} (≤{args.draft_n} tokens/step)")
 
         system_msg = args.system
         history: List[Dict[str, str]] = []
+        ctxwin = ContextWindow(llm, llm.n_ctx(), reserve_tokens=args.tokens, policy=args.history_policy)
+
+        # system prompt 상태를 미리 준비(복원 또는 생성) → 첫 응답 지연 감소
+        snaps = PromptSnapshotStore(args.snapshot_dir) if args.snapshot_dir and not (args.server or args.worker) else None
+        if snaps is not None:
+            how = snaps.prime(llm, args.model, llm.n_ctx(), system_msg, chat_format)
+            print(f"[INFO] system prompt snapshot: {how}")
+        print(BANNER)
 
         while True:
             try:
@@ -188,6 +273,7 @@ def main():
             if s.startswith("/toks"):
                 try:
                     args.tokens = int(s.split()[1])
+                    ctxwin.reserve_tokens = args.tokens
                     print("[OK] max_tokens =", args.tokens)
                 except Exception:
                     print("사용법: /toks 512")
@@ -209,17 +295,39 @@ def main():
                     print("사용법: /threads 6")
                 continue
 
+            if s.startswith("/predict @"):
+                try:
+                    run_bulk_predict(args.bundle, s[len("/predict @"):], args.server)
+                except Exception as e:
+                    print("[ERR]", e)
+                continue
+
+            if s == "/metrics":
+                print(metrics.format_snapshot() if metrics.enabled() else "[INFO] --metrics 로 실행하면 지표를 수집합니다")
+                continue
+
             if s == "/help":
                 print(BANNER)
                 continue
 
             # normal chat turn
-            messages = [{"role": "system", "content": system_msg}, *history, {"role": "user", "content": s}]
-            ans = stream_answer(llm, messages, args.temp, args.topp, args.tokens)
+            if snaps is not None and not history:
+                # 새 대화: system prompt 평가 직후 상태에서 시작
+                snaps.prime(llm, args.model, llm.n_ctx(), system_msg, chat_format)
+            messages = ctxwin.fit(system_msg, [*history, {"role": "user", "content": s}])
+            if ctxwin.last_dropped:
+                print(f"[CTX] {ctxwin.last_total}/{ctxwin.budget} tokens, {ctxwin.last_dropped} old msgs ({ctxwin.policy})")
+            try:
+                ans = stream_answer(llm, messages, args.temp, args.topp, args.tokens)
+            except ServerError as e:
+                # 서버 대기열 초과(503) / 시간 초과(504) / 워커 종료(503, 다음 질문은 재시작된 워커로) 등 → 이번 질문만 버리고 계속
+                print(f"\n[ERR] {'worker' if args.worker else 'server'}: {e}")
+                continue
             history.append({"role": "user", "content": s})
             history.append({"role": "assistant", "content": ans})
 
     finally:
+        metrics.close_sinks()
         if llm is not None:
             try:
                 llm.close()
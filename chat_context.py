@@ -0,0 +1,232 @@
+# chat_context.py — 토큰 예산 기반 대화 히스토리 관리
+#
+# n_ctx 를 넘기 전에 history 를 예산(n_ctx - max_tokens - margin) 안으로 맞춘다.
+# 정책(policy):
+#   - "window" : system prompt + 예산에 들어가는 최근 메시지만 유지
+#   - "pin"    : window + 가장 최근 예측 결과 메시지(kind="predict")는 밀려나도 고정
+#   - "summary": 밀려난 오래된 턴을 모델로 요약해 system 뒤에 한 메시지로 유지 (요약은 누적 갱신)
+from __future__ import annotations
+import hashlib
+from typing import Dict, List, Optional, Tuple
+
+from think_stream import split_think
+
+POLICIES = ("window", "pin", "summary")
+
+SUMMARY_PROMPT = (
+    "다음은 이전 대화 내용이다. 이후 대화에 필요한 사실, 수치, 결정 사항만 남겨 "
+    "한국어로 5문장 이내로 요약하라."
+)
+
+
+class ContextWindow:
+    """
+    메시지별 토큰 수를 모델 tokenizer 로 계산(캐시)하고, 예산 초과 시 policy 에 따라 줄인다.
+    fit() 결과는 create_chat_completion 에 바로 넣을 수 있는 {"role","content"} 목록.
+    """
+
+    # chat template 이 메시지마다 붙이는 역할 태그 등 대략적 오버헤드
+    MSG_OVERHEAD = 6
+
+    def __init__(self, llm, n_ctx: int, reserve_tokens: int = 512, policy: str = "window",
+                 margin: int = 32, summary_tokens: int = 256):
+        if policy not in POLICIES:
+            raise ValueError(f"unknown history policy: {policy}")
+        self.llm = llm
+        self.n_ctx = int(n_ctx)
+        self.reserve_tokens = int(reserve_tokens)
+        self.policy = policy
+        self.margin = int(margin)
+        self.summary_tokens = int(summary_tokens)
+        self._counts: Dict[Tuple[str, str], int] = {}
+        # 누적 요약 상태: (요약된 메시지들의 서명, 요약문)
+        self._summary_sig: Optional[str] = None
+        self._summary_text: str = ""
+        self._summary_n = 0
+        self.last_total = 0
+        self.last_dropped = 0
+
+    @property
+    def budget(self) -> int:
+        return max(64, self.n_ctx - self.reserve_tokens - self.margin)
+
+    def count(self, msg: Dict[str, str]) -> int:
+        key = (msg.get("role", ""), msg.get("content", ""))
+        n = self._counts.get(key)
+        if n is None:
+            toks = self.llm.tokenize(key[1].encode("utf-8"), add_bos=False, special=True)
+            n = len(toks) + self.MSG_OVERHEAD
+            self._counts[key] = n
+        return n
+
+    def running_totals(self, messages: List[Dict[str, str]]) -> List[int]:
+        """메시지별 누적 토큰 수."""
+        out, acc = [], 0
+        for m in messages:
+            acc += self.count(m)
+            out.append(acc)
+        return out
+
+    def fit(self, system: str, history: List[Dict[str, str]]) -> List[Dict[str, str]]:
+        sys_msg = {"role": "system", "content": system}
+        msgs = [{"role": m["role"], "content": m["content"]} for m in history]
+        budget = self.budget - self.count(sys_msg)
+
+        if self.policy == "summary":
+            extra, kept = self._fit_summary(msgs, budget)
+        else:
+            keep_from = self._keep_from(msgs, budget)
+            kept = msgs[keep_from:]
+            self.last_dropped = keep_from
+            extra = []
+            pinned = self._latest_predict(history[:keep_from]) if self.policy == "pin" else None
+            if pinned is not None:
+                # 고정 메시지 공간 확보: 가장 오래된 kept 부터 제거 (마지막 메시지는 유지)
+                extra = [pinned]
+                used = sum(self.count(m) for m in kept) + self.count(pinned)
+                while used > budget and len(kept) > 1:
+                    used -= self.count(kept.pop(0))
+                if used > budget:
+                    extra = []                # 마지막 메시지와 함께 들어가지 않으면 고정 메시지는 뺀다
+                self.last_dropped = len(msgs) - len(kept)
+
+        if kept:
+            # 마지막 메시지 하나만으로도 예산을 넘으면 (긴 붙여넣기 등) 잘라서 n_ctx 초과를 막는다
+            others = sum(self.count(m) for m in extra + kept[:-1])
+            kept[-1] = self._truncate(kept[-1], budget - others)
+        out = [sys_msg, *extra, *kept]
+        self.last_total = sum(self.count(m) for m in out)
+        return out
+
+    def _keep_from(self, msgs: List[Dict[str, str]], budget: int) -> int:
+        """최근 메시지부터 budget 안에 들어가는 시작 index (마지막 메시지는 항상 포함)."""
+        keep_from = len(msgs)
+        used = 0
+        for i in range(len(msgs) - 1, -1, -1):
+            c = self.count(msgs[i])
+            if used + c > budget and i < len(msgs) - 1:
+                break
+            used += c
+            keep_from = i
+        return keep_from
+
+    def _fit_summary(self, msgs: List[Dict[str, str]], budget: int):
+        """
+        기존 요약이 history 앞부분과 일치하고 나머지가 예산에 들어가면 그대로 재사용(모델 호출 없음).
+        넘치면 예산의 60% 까지 비우도록 한 번에 밀어내고 요약을 갱신한다 → 요약 호출은 여러 턴에 한 번.
+        """
+        n = self._summary_n
+        if n and n <= len(msgs) and self._sig(msgs[:n]) == self._summary_sig:
+            extra = [self._summary_msg()]
+            rest = msgs[n:]
+            if sum(self.count(m) for m in extra + rest) <= budget:
+                self.last_dropped = n
+                return extra, rest
+        if sum(self.count(m) for m in msgs) <= budget:
+            self.last_dropped = 0
+            return [], msgs
+
+        # 마지막 메시지(방금 들어온 질문)는 요약하지 않고 항상 원문으로 남긴다
+        keep_from = min(max(self._keep_from(msgs, int(budget * 0.6)), 1), len(msgs) - 1)
+        if keep_from < 1:
+            self.last_dropped = 0
+            return [], msgs[-1:]
+        summary = self._summarize(msgs[:keep_from])
+        kept = msgs[keep_from:]
+        self.last_dropped = keep_from
+        extra = [self._summary_msg()] if summary else []
+        if not summary:
+            kept = msgs[self._keep_from(msgs, budget):]
+            self.last_dropped = len(msgs) - len(kept)
+        used = sum(self.count(m) for m in extra + kept)
+        while used > budget and len(kept) > 1:
+            used -= self.count(kept.pop(0))
+        return extra, kept
+
+    def _truncate(self, msg: Dict[str, str], budget: int) -> Dict[str, str]:
+        """단독으로도 예산을 넘는 메시지는 요약 대신 앞쪽을 잘라 뒷부분만 남긴다."""
+        limit = max(1, budget - self.MSG_OVERHEAD)
+        toks = self.llm.tokenize(msg["content"].encode("utf-8"), add_bos=False, special=True)
+        if len(toks) <= limit:
+            return msg
+        text = self.llm.detokenize(toks[-limit:]).decode("utf-8", errors="ignore")
+        return {"role": msg["role"], "content": text}
+
+    def _summary_msg(self) -> Dict[str, str]:
+        return {"role": "system", "content": f"이전 대화 요약: {self._summary_text}"}
+
+    # ---------- internal ----------
+    @staticmethod
+    def _latest_predict(history: List[Dict[str, str]]) -> Optional[Dict[str, str]]:
+        for m in reversed(history):
+            if m.get("kind") == "predict":
+                return {"role": m["role"], "content": m["content"]}
+        return None
+
+    @staticmethod
+    def _sig(msgs: List[Dict[str, str]]) -> str:
+        h = hashlib.sha1()
+        for m in msgs:
+            h.update(m["role"].encode())
+            h.update(b"\x00")
+            h.update(m["content"].encode("utf-8"))
+            h.update(b"\x01")
+        return h.hexdigest()
+
+    def _summarize(self, dropped: List[Dict[str, str]]) -> str:
+        """이미 요약한 앞부분은 재사용하고, 새로 밀려난 메시지만 기존 요약과 합쳐 갱신."""
+        n_prev = self._summary_n
+        if self._summary_sig is not None and n_prev <= len(dropped) and self._sig(dropped[:n_prev]) == self._summary_sig:
+            new = dropped[n_prev:]
+            prev = self._summary_text
+        else:
+            new, prev = dropped, ""
+        if not new:
+            return prev
+
+        # 요약 요청 자체도 n_ctx 안에 들어가야 하므로, 넘치면 메시지를 잘라 버리지 않고
+        # 예산에 맞는 묶음 단위로 차례로 요약하며 직전 결과를 다음 묶음의 [기존 요약] 으로 넘긴다
+        limit = max(256, self.n_ctx - self.summary_tokens - 128)
+        summary, lines, used = prev, [], self._seed_tokens(prev)
+        for m in new:
+            c = self.count(m)
+            if lines and used + c > limit:
+                summary = self._summarize_chunk(summary, lines, limit)
+                if summary is None:
+                    return prev
+                lines, used = [], self._seed_tokens(summary)
+            if used + c > limit:
+                m = self._truncate(m, limit - used)   # 한 메시지만으로 넘치면 그 메시지만 자른다
+                c = self.count(m)
+            lines.append(f"[{m['role']}] {m['content']}")
+            used += c
+        summary = self._summarize_chunk(summary, lines, limit)
+        if summary is None:
+            return prev
+        self._summary_text = summary
+        self._summary_sig = self._sig(dropped)
+        self._summary_n = len(dropped)
+        return summary
+
+    def _seed_tokens(self, summary: str) -> int:
+        if not summary:
+            return 0
+        return len(self.llm.tokenize(f"[기존 요약] {summary}".encode("utf-8"), add_bos=False, special=True)) + 1
+
+    def _summarize_chunk(self, prev: str, lines: List[str], limit: int) -> Optional[str]:
+        """기존 요약 + 메시지 묶음 → 새 요약. 실패하면 None."""
+        text = "\n".join(([f"[기존 요약] {prev}"] if prev else []) + lines)
+        # 메시지별 토큰 수는 근사치이므로 마지막 안전장치로만 앞쪽을 자름
+        toks = self.llm.tokenize(text.encode("utf-8"), add_bos=False, special=True)
+        if len(toks) > limit:
+            text = self.llm.detokenize(toks[-limit:]).decode("utf-8", errors="ignore")
+        try:
+            resp = self.llm.create_chat_completion(
+                messages=[{"role": "system", "content": SUMMARY_PROMPT}, {"role": "user", "content": text}],
+                max_tokens=self.summary_tokens,
+                temperature=0.2,
+            )
+            summary = resp["choices"][0]["message"]["content"] or ""
+        except Exception:
+            return None
+        return split_think(summary)[0]
@@ -0,0 +1,231 @@
+# llm_access.py — 공유 Llama 의 스레드 안전 접근 계층
+#
+# st.cache_resource 로 공유되는 Llama 하나를 여러 Streamlit 세션(스크립트 스레드)이 잠금 없이 쓰면
+# 생성 도중 다른 세션이 KV 상태를 덮어써 출력이 깨진다. LLMAccess 는 Llama 사용을 FIFO 순서로 직렬화한다.
+#   - hold(): 여러 호출(스냅샷 복원 → 생성)을 한 번에 묶는 재진입 잠금
+#   - 스트리밍 요청은 같은 owner(세션)의 새 스트리밍 요청이 오면 취소된다
+#     (rerun 으로 버려진 생성이 CPU 를 계속 쓰지 않도록 — 실행 중이면 다음 chunk 에서 멈추고, 대기 중이면 Cancelled)
+#   - stats(): 대기열 길이, 대기 시간, 취소 수
+#   - close(): 진행 중인 요청이 끝난 뒤 Llama 해제 (모델 교체 시). 이후 요청은 Cancelled
+# for_owner(sid) 는 Llama 처럼 쓸 수 있는 세션별 뷰 (set_cache 도 세션별로 보관했다가 잠금을 잡을 때 적용).
+from __future__ import annotations
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+from typing import Any, Callable, Deque, Dict, Iterator, List, Optional
+
+
+class Cancelled(RuntimeError):
+    """대기 중이던 요청이 같은 owner 의 새 요청으로 대체되었거나 cancel() 되었다."""
+
+
+class _Ticket:
+    __slots__ = ("owner", "stream", "cancel", "t_enqueue")
+
+    def __init__(self, owner: Optional[str], stream: bool):
+        self.owner = owner
+        self.stream = stream
+        self.cancel = threading.Event()
+        self.t_enqueue = time.perf_counter()
+
+
+class LLMAccess:
+    def __init__(self, llm):
+        self.llm = llm
+        self._cv = threading.Condition()
+        self._queue: Deque[_Ticket] = deque()
+        self._holder: Optional[_Ticket] = None
+        self._holder_thread: Optional[int] = None
+        self._depth = 0
+        self._views: Dict[str, "LLMView"] = {}
+        self.closed = False
+        # 통계
+        self.acquired = 0
+        self.cancelled = 0
+        self.wait_s = 0.0
+        self.max_wait_s = 0.0
+        self.busy_s = 0.0
+        self._t_hold = 0.0
+
+    # ---------- 잠금 ----------
+    def _acquire(self, owner: Optional[str], stream: bool,
+                 on_acquire: Optional[Callable[[], None]] = None) -> _Ticket:
+        me = threading.get_ident()
+        with self._cv:
+            if self._holder is not None and self._holder_thread == me:
+                self._depth += 1                      # 같은 스레드 안의 중첩 호출 (hold 안에서 생성 등)
+                self._holder.stream |= stream
+                return self._holder
+            if stream and owner is not None:
+                self._supersede(owner)
+            t = _Ticket(owner, stream)
+            self._queue.append(t)
+            while True:
+                if t.cancel.is_set():
+                    self._queue.remove(t)
+                    self.cancelled += 1
+                    self._cv.notify_all()
+                    raise Cancelled(f"request superseded (owner={owner})")
+                if self.closed:
+                    self._queue.remove(t)
+                    self._cv.notify_all()
+                    raise Cancelled("model closed (replaced)")
+                if self._holder is None and self._queue[0] is t:
+                    break
+                self._cv.wait()
+            self._queue.popleft()
+            self._holder, self._holder_thread, self._depth = t, me, 1
+            waited = time.perf_counter() - t.t_enqueue
+            self.acquired += 1
+            self.wait_s += waited
+            self.max_wait_s = max(self.max_wait_s, waited)
+            self._t_hold = time.perf_counter()
+        if on_acquire is not None:
+            try:
+                on_acquire()
+            except BaseException:
+                self._release()
+                raise
+        return t
+
+    def _release(self) -> None:
+        with self._cv:
+            self._depth -= 1
+            if self._depth == 0:
+                self.busy_s += time.perf_counter() - self._t_hold
+                self._holder = self._holder_thread = None
+                self._cv.notify_all()
+
+    def _supersede(self, owner: str) -> None:
+        """owner 의 이전 스트리밍 요청(대기/실행 중)에 취소 표시. _cv 를 잡은 상태에서 호출."""
+        for t in [self._holder, *self._queue]:
+            if t is not None and t.owner == owner and t.stream:
+                t.cancel.set()
+        self._cv.notify_all()
+
+    @contextmanager
+    def hold(self, owner: Optional[str] = None, on_acquire: Optional[Callable[[], None]] = None,
+             stream: bool = False):
+        """
+        with access.hold(): 블록 동안 다른 스레드는 이 Llama 를 쓰지 못한다 (재진입 가능).
+        stream=True 면 스트리밍 요청처럼 같은 owner 의 이전 스트림을 대체하고, 자신도 대체될 수 있다.
+        """
+        t = self._acquire(owner, stream, on_acquire)
+        try:
+            yield t
+        finally:
+            self._release()
+
+    def cancel(self, owner: str) -> int:
+        """owner 의 대기/실행 중 요청을 모두 취소 표시. 표시한 수를 반환."""
+        n = 0
+        with self._cv:
+            for t in [self._holder, *self._queue]:
+                if t is not None and t.owner == owner and not t.cancel.is_set():
+                    t.cancel.set()
+                    n += 1
+            self._cv.notify_all()
+        return n
+
+    # ---------- Llama 호환 ----------
+    def create_chat_completion(self, messages: List[Dict[str, str]], stream: bool = False,
+                               owner: Optional[str] = None, on_acquire: Optional[Callable[[], None]] = None,
+                               **kwargs):
+        if not stream:
+            with self.hold(owner, on_acquire):
+                return self.llm.create_chat_completion(messages=messages, **kwargs)
+        return self._stream(messages, owner, on_acquire, kwargs)
+
+    def _stream(self, messages, owner, on_acquire, kwargs) -> Iterator[Dict[str, Any]]:
+        t = self._acquire(owner, True, on_acquire)
+        it = None
+        try:
+            it = self.llm.create_chat_completion(messages=messages, stream=True, **kwargs)
+            for ch in it:
+                if t.cancel.is_set():
+                    with self._cv:
+                        self.cancelled += 1
+                    raise Cancelled(f"stream superseded (owner={owner})")
+                yield ch
+        finally:
+            close = getattr(it, "close", None)
+            if close is not None:
+                close()                               # llama 생성기를 닫아야 decode 가 멈춘다
+            self._release()
+
+    def close(self) -> None:
+        """잠금을 잡아 진행 중인 생성이 끝나기를 기다린 뒤 Llama 해제. 대기 중이던/이후 요청은 Cancelled."""
+        with self.hold():
+            self.closed = True
+            self.llm.close()
+
+    def for_owner(self, owner: str) -> "LLMView":
+        with self._cv:
+            v = self._views.get(owner)
+            if v is None:
+                v = self._views[owner] = LLMView(self, owner)
+            return v
+
+    def forget(self, owner: str) -> None:
+        """세션이 끝났을 때: 요청 취소 + 뷰 제거."""
+        self.cancel(owner)
+        with self._cv:
+            self._views.pop(owner, None)
+
+    def stats(self) -> Dict[str, Any]:
+        with self._cv:
+            return {
+                "waiting": len(self._queue),
+                "busy": self._holder is not None,
+                "owner": self._holder.owner if self._holder is not None else None,
+                "acquired": self.acquired,
+                "cancelled": self.cancelled,
+                "avg_wait_s": self.wait_s / self.acquired if self.acquired else 0.0,
+                "max_wait_s": self.max_wait_s,
+                "busy_s": self.busy_s,
+            }
+
+    def __getattr__(self, name: str):
+        # tokenize / detokenize / n_ctx 등 모델(vocab)만 읽는 메서드는 잠금 없이 그대로
+        if name == "llm":
+            raise AttributeError(name)
+        return getattr(self.llm, name)
+
+
+class LLMView:
+    """
+    한 owner(세션)의 Llama 뷰. create_chat_completion / set_cache / hold 외에는 Llama 로 그대로 위임.
+    set_cache 는 공유 Llama 에 바로 걸지 않고 보관했다가, 이 뷰가 잠금을 잡을 때마다 적용한다.
+    """
+
+    def __init__(self, access: LLMAccess, owner: str):
+        self.access = access
+        self.owner = owner
+        self._cache = None
+
+    def set_cache(self, cache) -> None:
+        self._cache = cache
+
+    def _apply_cache(self) -> None:
+        self.access.llm.set_cache(self._cache)
+
+    def hold(self, stream: bool = False):
+        return self.access.hold(self.owner, self._apply_cache, stream)
+
+    def create_chat_completion(self, messages: List[Dict[str, str]], stream: bool = False, **kwargs):
+        return self.access.create_chat_completion(messages, stream=stream, owner=self.owner,
+                                                  on_acquire=self._apply_cache, **kwargs)
+
+    def cancel(self) -> int:
+        return self.access.cancel(self.owner)
+
+    def __getattr__(self, name: str):
+        if name == "access":
+            raise AttributeError(name)
+        return getattr(self.access.llm, name)
+
+
+def format_access_stats(s: Dict[str, Any]) -> str:
+    return (f"model lock: waiting {s['waiting']} · wait avg {s['avg_wait_s'] * 1000:.0f}ms / "
+            f"max {s['max_wait_s'] * 1000:.0f}ms · cancelled {s['cancelled']}")
@@ -0,0 +1,216 @@
+# llm_cache.py — 세션별 llama-cpp 프롬프트 KV 상태 캐시
+#
+# llama-cpp 는 Llama.cache 가 설정되어 있으면 응답 생성 후 (프롬프트+응답 토큰 → 상태)를 저장하고,
+# 다음 요청에서 토큰 prefix 가 가장 긴 상태를 복원해 나머지 suffix 만 평가한다.
+# 하나의 Llama 를 여러 세션이 번갈아 쓰면 내부 prefix 가 매번 깨지므로, 세션별로 상태를 보관한다.
+#   - RAM 계층: 전체 capacity_bytes 예산 안에서 (세션, 토큰) 단위 LRU
+#   - 디스크 계층(선택): RAM 에서 밀려난 상태를 diskcache 에 (모델, 세션, 토큰) 키로 보관, 적중 시 RAM 으로 되올림
+#   - 조회: PREFIX_BLOCK 토큰 단위 prefix 해시 색인으로 후보만 비교 (항목 수에 비례하는 전체 탐색 없음)
+from __future__ import annotations
+import hashlib
+import threading
+from array import array
+from collections import OrderedDict
+from typing import Any, Dict, List, Optional, Sequence, Set, Tuple
+
+from llama_cpp import Llama
+from llama_cpp.llama_cache import BaseLlamaCache
+
+import metrics
+
+Key = Tuple[int, ...]
+PREFIX_BLOCK = 32           # prefix 색인 단위 (토큰)
+DISK_IDS_PER_BLOCK = 8      # 디스크 색인: 블록 해시당 기억할 최근 항목 수
+
+log = metrics.get_logger(__name__)
+
+
+class KVCacheManager:
+    """
+    프로세스 전역 KV 상태 캐시. 세션마다 for_session(sid) 로 얻은 뷰를 llm.set_cache() 에 넣는다.
+    항목은 PREFIX_BLOCK 토큰 단위 prefix 해시로 색인해, 조회 시 전체 항목을 훑지 않고 가장 긴 공통 블록의 후보만 비교한다.
+    디스크 계층 키에는 model_id(모델 fingerprint)와 세션이 들어가 다른 모델/세션의 상태를 복원하지 않는다.
+    stats(): hits, misses, disk_hits, evictions, bytes, entries, sessions
+    """
+
+    def __init__(self, capacity_bytes: int = 2 << 30, disk_dir: Optional[str] = None,
+                 disk_capacity_bytes: int = 8 << 30, model_id: str = ""):
+        self.capacity_bytes = int(capacity_bytes)
+        self.model_id = model_id
+        self._ram: "OrderedDict[Tuple[str, Key], Any]" = OrderedDict()
+        self._index: Dict[Tuple[str, bytes], Set[Key]] = {}      # (세션, 블록 prefix 해시) → 항목 키
+        self._digests: Dict[Tuple[str, Key], List[bytes]] = {}
+        self._bytes = 0
+        self._lock = threading.RLock()
+        self._disk = None
+        if disk_dir:
+            import diskcache
+            self._disk = diskcache.Cache(disk_dir, size_limit=int(disk_capacity_bytes),
+                                         eviction_policy="least-recently-used")
+        self.hits = 0
+        self.misses = 0
+        self.disk_hits = 0
+        self.evictions = 0
+
+    def for_session(self, session_id: str) -> "SessionKVCache":
+        return SessionKVCache(self, session_id)
+
+    def drop_session(self, session_id: str) -> None:
+        """세션 종료/대화 초기화 시 해당 세션의 RAM 항목 제거."""
+        with self._lock:
+            for k in [k for k in self._ram if k[0] == session_id]:
+                self._bytes -= self._remove(k).llama_state_size
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            total = self.hits + self.misses
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "disk_hits": self.disk_hits,
+                "evictions": self.evictions,
+                "hit_rate": self.hits / total if total else 0.0,
+                "bytes": self._bytes,
+                "capacity_bytes": self.capacity_bytes,
+                "entries": len(self._ram),
+                "sessions": len({k[0] for k in self._ram}),
+            }
+
+    # ---------- internal ----------
+    def _lookup(self, sid: str, key: Key):
+        blocks, _ = _prefix_digests(key)
+        with self._lock:
+            best = self._best(sid, key, blocks)
+            if best is not None:
+                self._ram.move_to_end((sid, best))
+                self.hits += 1
+                return self._ram[(sid, best)]
+        if self._disk is not None:
+            found = self._disk_pop(sid, key, blocks)
+            if found is not None:
+                dkey, state = found
+                with self._lock:
+                    self.hits += 1
+                    self.disk_hits += 1
+                self._store(sid, dkey, state)
+                return state
+        with self._lock:
+            self.misses += 1
+        raise KeyError("Key not found")
+
+    def _best(self, sid: str, key: Key, blocks: List[bytes]) -> Optional[Key]:
+        # 가장 긴 공통 블록부터: 그 블록을 공유하는 항목 중 실제 공통 prefix 가 가장 긴 것
+        for d in reversed(blocks):
+            cands = self._index.get((sid, d))
+            if cands:
+                return max(cands, key=lambda k: Llama.longest_token_prefix(k, key))
+        return None
+
+    def _has(self, sid: str, key: Key) -> bool:
+        blocks, _ = _prefix_digests(key)
+        with self._lock:
+            return self._best(sid, key, blocks) is not None
+
+    def _store(self, sid: str, key: Key, state) -> None:
+        spilled = []
+        with self._lock:
+            old = self._remove((sid, key))
+            if old is not None:
+                self._bytes -= old.llama_state_size
+            self._ram[(sid, key)] = state
+            self._bytes += state.llama_state_size
+            blocks, _ = _prefix_digests(key)
+            self._digests[(sid, key)] = blocks
+            for d in blocks:
+                self._index.setdefault((sid, d), set()).add(key)
+            while self._bytes > self.capacity_bytes and len(self._ram) > 1:
+                (osid, okey), ostate = next(iter(self._ram.items()))
+                self._bytes -= self._remove((osid, okey)).llama_state_size
+                self.evictions += 1
+                spilled.append((osid, okey, ostate))
+        # 직렬화/디스크 쓰기는 잠금 밖에서 (다른 세션의 조회를 막지 않도록)
+        if self._disk is not None:
+            for osid, okey, ostate in spilled:
+                self._disk_put(osid, okey, ostate)
+
+    def _remove(self, k: Tuple[str, Key]):
+        """RAM 항목과 색인 제거. self._lock 안에서 호출."""
+        state = self._ram.pop(k, None)
+        for d in self._digests.pop(k, ()):
+            cands = self._index.get((k[0], d))
+            if cands is not None:
+                cands.discard(k[1])
+                if not cands:
+                    del self._index[(k[0], d)]
+        return state
+
+    # 디스크 계층: ("tk"|"kv", 모델, 세션, 전체 해시) → 토큰 / 상태,  ("px", 모델, 세션, 블록 해시) → 전체 해시 목록
+    def _disk_put(self, sid: str, key: Key, state) -> None:
+        blocks, full = _prefix_digests(key)
+        if not blocks:
+            return                                 # 한 블록보다 짧은 prefix 는 재사용 가치가 없음
+        m = self.model_id
+        try:
+            with self._disk.transact():
+                self._disk.set(("kv", m, sid, full), state)
+                self._disk.set(("tk", m, sid, full), key)
+                for d in blocks:
+                    ids = self._disk.get(("px", m, sid, d), ())
+                    if full not in ids:
+                        self._disk.set(("px", m, sid, d), (ids + (full,))[-DISK_IDS_PER_BLOCK:])
+        except Exception as e:
+            log.warning("KV disk write failed: %s", e)
+
+    def _disk_pop(self, sid: str, key: Key, blocks: List[bytes]):
+        m = self.model_id
+        for d in reversed(blocks):
+            best, best_len = None, 0
+            for full in self._disk.get(("px", m, sid, d), ()):
+                toks = self._disk.get(("tk", m, sid, full))
+                if toks is None:
+                    continue                       # 디스크 LRU 로 밀려난 항목
+                n = Llama.longest_token_prefix(toks, key)
+                if n > best_len:
+                    best, best_len = (full, toks), n
+            if best is not None:
+                full, toks = best
+                state = self._disk.pop(("kv", m, sid, full), default=None)
+                self._disk.delete(("tk", m, sid, full))
+                if state is not None:
+                    return toks, state
+        return None
+
+
+def _prefix_digests(tokens: Key) -> Tuple[List[bytes], bytes]:
+    """tokens[:B], tokens[:2B], ... 의 누적 해시 목록과 전체 해시 (B = PREFIX_BLOCK, O(len))."""
+    raw = array("i", tokens).tobytes()
+    step = PREFIX_BLOCK * 4
+    h = hashlib.blake2b(digest_size=16)
+    blocks = []
+    for i in range(step, len(raw) + 1, step):
+        h.update(raw[i - step:i])
+        blocks.append(h.digest())
+    h.update(raw[len(blocks) * step:])
+    return blocks, h.digest()
+
+
+class SessionKVCache(BaseLlamaCache):
+    """KVCacheManager 의 세션 뷰. llama-cpp 가 요구하는 BaseLlamaCache 인터페이스를 구현."""
+
+    def __init__(self, manager: KVCacheManager, session_id: str):
+        super().__init__(manager.capacity_bytes)
+        self.manager = manager
+        self.session_id = session_id
+
+    @property
+    def cache_size(self) -> int:
+        return self.manager.stats()["bytes"]
+
+    def __getitem__(self, key: Sequence[int]):
+        return self.manager._lookup(self.session_id, tuple(key))
+
+    def __contains__(self, key: Sequence[int]) -> bool:
+        return self.manager._has(self.session_id, tuple(key))
+
+    def __setitem__(self, key: Sequence[int], value) -> None:
+        self.manager._store(self.session_id, tuple(key), value)
@@ -0,0 +1,611 @@
+# llm_worker.py — Llama 를 전용 워커 프로세스에서 실행 (로컬 소켓 요청 + 공유 메모리 토큰 스트리밍)
+#
+# decode 를 Streamlit 스크립트 스레드에서 돌리면 UI 와 GIL 을 다투고, llama.cpp 안에서 죽으면 앱 전체가 내려간다.
+#   - 워커: python llm_worker.py --model Qwen3-4B.gguf [--port 8766]
+#     감시(supervisor) 프로세스가 서빙 프로세스를 띄우고, 비정상 종료되면 자동으로 다시 띄운다 (backoff).
+#     요청은 multiprocessing.connection (127.0.0.1, authkey) 으로 받고, Llama 사용은 LLMAccess 로 직렬화 (세션별 KV 캐시 포함)
+#   - 스트리밍: 연결마다 클라이언트가 만든 SharedMemory 링 버퍼에 워커가 토큰 delta 를 쓰고 클라이언트가 읽는다.
+#     토큰마다 pickle/소켓 왕복이 없고, 연결로는 요청과 완료/오류 응답만 오간다. 취소도 링 헤더의 플래그로 전달
+#   - WorkerClient: 연결 풀 + 워커 자동 기동(spawn)·재접속. for_session(sid) → Llama 처럼 쓰는 WorkerLLM
+#     (create_chat_completion stream/non-stream, tokenize, detokenize, n_ctx). CLI(--worker)와 앱이 같은 워커를 공유한다
+#   - 생성 도중 워커가 죽으면 그 요청은 WorkerError(ServerError 503). 다음 요청은 재시작된 워커에 다시 연결
+#   python llm_worker.py --status | --stop
+from __future__ import annotations
+import argparse
+import multiprocessing as mp
+import os
+import struct
+import subprocess
+import sys
+import threading
+import time
+from contextlib import contextmanager
+from dataclasses import dataclass
+from multiprocessing import shared_memory
+from multiprocessing.connection import Client, Listener
+from typing import Any, Callable, Dict, Iterator, List, Optional, Sequence, Tuple
+
+import metrics
+from llm_access import Cancelled
+from server_client import ServerError
+
+DEF_HOST = "127.0.0.1"
+DEF_PORT = 8766
+DEF_RING_BYTES = 256 << 10
+AUTHKEY = os.environ.get("BKCHAT_WORKER_KEY", "bkchat-llm-worker").encode("utf-8")
+LOG_PATH = os.path.join(".cache", "llm_worker.log")
+
+_HDR = 64                         # head(u64) · tail(u64) · cancel rid(u64) · 여유
+_HEAD, _TAIL, _CANCEL = 0, 8, 16
+_U64 = struct.Struct("<Q")
+_REC = struct.Struct("<II")       # payload 길이, 요청 id
+_EXIT_FATAL = 3                   # 모델 로드/포트 바인드 실패 → 재시작하지 않음
+
+log = metrics.get_logger("llm_worker")
+
+
+class WorkerError(ServerError):
+    """워커 프로세스에 연결할 수 없거나 요청 도중 워커가 종료됨."""
+
+    def __init__(self, message: str):
+        super().__init__(503, message)
+
+
+# ---------- 공유 메모리 링 ----------
+def _attach_shm(name: str) -> shared_memory.SharedMemory:
+    """만든 쪽(클라이언트)이 unlink 하므로 붙는 쪽은 resource tracker 에 등록하지 않는다."""
+    try:
+        return shared_memory.SharedMemory(name=name, track=False)      # Python 3.13+
+    except TypeError:
+        shm = shared_memory.SharedMemory(name=name)
+        if os.name == "posix":
+            from multiprocessing import resource_tracker
+            try:
+                resource_tracker.unregister(shm._name, "shared_memory")
+            except Exception:
+                pass
+        return shm
+
+
+class Ring:
+    """
+    단일 생산자(워커) / 단일 소비자(클라이언트) 바이트 링. head/tail 은 누적 바이트 수라 wrap 을 따로 세지 않는다.
+    레코드: [payload 길이 u32][요청 id u32][UTF-8 delta]. 생산자는 payload 를 다 쓴 뒤 head 를 올린다.
+    """
+
+    def __init__(self, shm: shared_memory.SharedMemory, owner: bool):
+        self.shm = shm
+        self.owner = owner
+        self.cap = shm.size - _HDR
+
+    @classmethod
+    def create(cls, size: int = DEF_RING_BYTES) -> "Ring":
+        shm = shared_memory.SharedMemory(create=True, size=_HDR + size)
+        shm.buf[:_HDR] = bytes(_HDR)
+        return cls(shm, owner=True)
+
+    @classmethod
+    def attach(cls, name: str) -> "Ring":
+        return cls(_attach_shm(name), owner=False)
+
+    @property
+    def name(self) -> str:
+        return self.shm.name
+
+    @property
+    def max_payload(self) -> int:
+        return self.cap // 2 - _REC.size
+
+    def _get(self, off: int) -> int:
+        return _U64.unpack_from(self.shm.buf, off)[0]
+
+    def _set(self, off: int, v: int) -> None:
+        _U64.pack_into(self.shm.buf, off, v)
+
+    # 생산자 (워커)
+    def write(self, rid: int, data: bytes, stop: Callable[[], bool]) -> bool:
+        """레코드 1개 기록. 링이 가득 차면 소비자를 기다린다. stop() 이 True 가 되면 쓰지 않고 False."""
+        rec = _REC.pack(len(data), rid) + data
+        n = len(rec)
+        head = self._get(_HEAD)
+        delay = 0.0
+        while self.cap - (head - self._get(_TAIL)) < n:
+            if stop():
+                return False
+            delay = min(delay + 0.0005, 0.01)
+            time.sleep(delay)
+        pos = head % self.cap
+        first = min(n, self.cap - pos)
+        self.shm.buf[_HDR + pos:_HDR + pos + first] = rec[:first]
+        if first < n:
+            self.shm.buf[_HDR:_HDR + n - first] = rec[first:]
+        self._set(_HEAD, head + n)
+        return True
+
+    def cancelled(self, rid: int) -> bool:
+        return self._get(_CANCEL) == rid
+
+    # 소비자 (클라이언트)
+    def read(self) -> List[Tuple[int, bytes]]:
+        """쌓인 레코드를 모두 꺼냄."""
+        head, tail = self._get(_HEAD), self._get(_TAIL)
+        out = []
+        while tail < head:
+            size, rid = _REC.unpack(self._copy(tail, _REC.size))
+            out.append((rid, self._copy(tail + _REC.size, size)))
+            tail += _REC.size + size
+        self._set(_TAIL, tail)
+        return out
+
+    def cancel(self, rid: int) -> None:
+        self._set(_CANCEL, rid)
+
+    def _copy(self, at: int, n: int) -> bytes:
+        pos = at % self.cap
+        first = min(n, self.cap - pos)
+        b = bytes(self.shm.buf[_HDR + pos:_HDR + pos + first])
+        return b + bytes(self.shm.buf[_HDR:_HDR + n - first]) if first < n else b
+
+    def close(self) -> None:
+        try:
+            self.shm.close()
+            if self.owner:
+                self.shm.unlink()
+        except (OSError, BufferError):
+            pass
+
+
+def _put_text(ring: Ring, rid: int, text: str, stop: Callable[[], bool]) -> bool:
+    # 링보다 큰 delta 는 문자 단위로 나눠 기록 (UTF-8 경계 유지)
+    step = max(1, ring.max_payload // 4)
+    for i in range(0, len(text), step):
+        if not ring.write(rid, text[i:i + step].encode("utf-8"), stop):
+            return False
+    return True
+
+
+# ---------- 워커 (서빙 프로세스) ----------
+def _handle(conn, access, kv, info: Dict[str, Any], wake: Callable[[], None], n: int) -> None:
+    """연결 1개의 요청을 순서대로 처리. 모든 요청은 (status, rid, value) 응답 1개를 받는다."""
+    ring: Optional[Ring] = None
+    try:
+        while True:
+            try:
+                msg = conn.recv()
+            except (EOFError, OSError):
+                return
+            op, rid = msg[0], msg[1]
+            try:
+                if op == "hello":
+                    ring = Ring.attach(msg[2])
+                    value = info
+                elif op == "chat":
+                    session, messages, kwargs, stream = msg[2:]
+                    view = access.for_owner(session or f"conn-{n}")
+                    if kv is not None:
+                        view.set_cache(kv.for_session(view.owner))
+                    value = _stream(view, ring, conn, rid, messages, kwargs) if stream \
+                        else view.create_chat_completion(messages, **kwargs)
+                elif op == "tokenize":
+                    value = access.tokenize(msg[2], add_bos=msg[3], special=msg[4])
+                elif op == "detokenize":
+                    value = access.detokenize(msg[2])
+                elif op == "forget":
+                    access.forget(msg[2])
+                    if kv is not None:
+                        kv.drop_session(msg[2])
+                    value = None
+                elif op == "info":
+                    value = {**info, "access": access.stats()}
+                elif op == "shutdown":
+                    conn.send(("ok", rid, None))
+                    wake()
+                    return
+                else:
+                    raise ValueError(f"unknown op {op!r}")
+                conn.send(("ok", rid, value))
+            except Cancelled as e:
+                conn.send(("cancelled", rid, str(e)))
+            except (EOFError, OSError):
+                return
+            except Exception as e:
+                conn.send(("error", rid, f"{type(e).__name__}: {e}"))
+    finally:
+        if ring is not None:
+            ring.close()
+        conn.close()
+
+
+def _stream(view, ring: Ring, conn, rid: int, messages, kwargs) -> Dict[str, Any]:
+    """생성 delta 를 링에 기록. 클라이언트가 취소 플래그를 세우거나 연결을 끊으면 다음 토큰에서 멈춘다."""
+    def stop() -> bool:
+        return ring.cancelled(rid) or conn.poll(0)
+
+    finish = None
+    n = 0
+    it = view.create_chat_completion(messages, stream=True, **kwargs)
+    try:
+        for ch in it:
+            c = ch["choices"][0]
+            text = c["delta"].get("content")
+            if text:
+                if not _put_text(ring, rid, text, stop):
+                    break
+                n += 1
+            finish = c.get("finish_reason") or finish
+            if stop():
+                break
+    finally:
+        it.close()
+    return {"finish_reason": finish, "chunks": n}
+
+
+def serve(cfg: Dict[str, Any], restarts: int = 0) -> None:
+    """서빙 프로세스: 포트를 먼저 잡고(중복 기동 방지) 모델을 올린 뒤 연결마다 스레드로 처리."""
+    metrics.configure_logging(cfg.get("log_level") or None)
+    address = (cfg["host"], cfg["port"])
+    try:
+        listener = Listener(address, authkey=AUTHKEY)
+    except OSError as e:
+        print(f"[ERR] cannot listen on {address[0]}:{address[1]}: {e}", flush=True)
+        sys.exit(_EXIT_FATAL)
+    try:
+        from chat_cli import auto_chat_format, load_llm
+        from llm_access import LLMAccess
+        from llm_cache import KVCacheManager
+        chat_format = None if cfg["chat_format"] in ("", "none") else auto_chat_format(cfg["model"], cfg["chat_format"])
+        llm = load_llm(cfg["model"], cfg["ctx"], cfg["threads"], chat_format)
+    except Exception as e:
+        print(f"[ERR] model load failed: {type(e).__name__}: {e}", flush=True)
+        listener.close()
+        sys.exit(_EXIT_FATAL)
+    access = LLMAccess(llm)
+    kv = KVCacheManager(capacity_bytes=cfg["kv_mb"] << 20) if cfg["kv_mb"] > 0 else None
+    info = {"model": os.path.basename(cfg["model"]), "model_path": os.path.abspath(cfg["model"]),
+            "n_ctx": llm.n_ctx(), "chat_format": chat_format, "n_threads": llm.n_threads,
+            "pid": os.getpid(), "restarts": restarts, "started": time.time()}
+    stopping = threading.Event()
+
+    def wake() -> None:
+        stopping.set()
+        try:
+            Client(address, authkey=AUTHKEY).close()      # accept() 대기를 깨움
+        except OSError:
+            pass
+
+    print(f"[READY] llm worker pid {os.getpid()} on {address[0]}:{address[1]} "
+          f"({info['model']}, ctx {info['n_ctx']}, restarts {restarts})", flush=True)
+    n = 0
+    with listener:
+        while not stopping.is_set():
+            try:
+                conn = listener.accept()
+            except (OSError, EOFError, mp.AuthenticationError) as e:
+                log.warning("accept failed: %s", e)
+                continue
+            n += 1
+            threading.Thread(target=_handle, args=(conn, access, kv, info, wake, n), daemon=True,
+                             name=f"llm-worker-conn-{n}").start()
+    print("[EXIT] llm worker stopped", flush=True)
+
+
+def supervise(cfg: Dict[str, Any]) -> int:
+    """서빙 프로세스를 띄우고 비정상 종료(크래시)되면 다시 띄운다. 정상 종료(--stop)·치명적 실패면 끝."""
+    restarts = 0
+    delay = 0.5
+    while True:
+        p = mp.Process(target=serve, args=(cfg, restarts), name="llm-worker")
+        t0 = time.monotonic()
+        p.start()
+        try:
+            p.join()
+        except KeyboardInterrupt:
+            p.terminate()
+            p.join()
+            return 0
+        if p.exitcode == 0:
+            return 0
+        if p.exitcode == _EXIT_FATAL:
+            return 1
+        restarts += 1
+        delay = 1.0 if time.monotonic() - t0 > 60 else min(delay * 2, 30.0)   # 연속 크래시면 간격을 늘림
+        print(f"[WARN] llm worker exited ({p.exitcode}) → restart #{restarts} in {delay:.0f}s", flush=True)
+        time.sleep(delay)
+
+
+# ---------- 클라이언트 ----------
+@dataclass
+class WorkerSpec:
+    """실행 중인 워커가 없을 때 새로 띄울 설정."""
+    model: str
+    ctx: int = 2048
+    threads: Optional[int] = None
+    chat_format: Optional[str] = "auto"
+    kv_mb: int = 2048
+
+    def argv(self) -> List[str]:
+        a = ["--model", self.model, "--ctx", str(self.ctx), "--chat-format", self.chat_format or "none",
+             "--kv-mb", str(self.kv_mb)]
+        return a + (["--threads", str(self.threads)] if self.threads else [])
+
+
+def start_worker(spec: WorkerSpec, host: str = DEF_HOST, port: int = DEF_PORT,
+                 log_path: str = LOG_PATH) -> subprocess.Popen:
+    """감시 프로세스를 별도 세션으로 띄움 (띄운 CLI/앱이 끝나도 다른 클라이언트를 위해 계속 실행). 출력은 log_path."""
+    os.makedirs(os.path.dirname(log_path) or ".", exist_ok=True)
+    kw: Dict[str, Any] = {"creationflags": subprocess.CREATE_NEW_PROCESS_GROUP} if os.name == "nt" \
+        else {"start_new_session": True}
+    with open(log_path, "ab") as out:
+        return subprocess.Popen([sys.executable, os.path.abspath(__file__), *spec.argv(),
+                                 "--host", host, "--port", str(port)],
+                                stdin=subprocess.DEVNULL, stdout=out, stderr=subprocess.STDOUT, **kw)
+
+
+class _Channel:
+    """워커 연결 1개 + 그 연결의 스트리밍 링. 한 번에 요청 하나."""
+
+    def __init__(self, address: Tuple[str, int], ring_bytes: int):
+        self.conn = Client(address, authkey=AUTHKEY)
+        self.ring = Ring.create(ring_bytes)
+        self.rid = 0
+        self.dead = False
+        try:
+            self.info: Dict[str, Any] = self.call("hello", self.ring.name)
+        except BaseException:
+            self.close()
+            raise
+
+    def send(self, op: str, *args) -> int:
+        self.rid += 1
+        try:
+            self.conn.send((op, self.rid, *args))
+        except OSError as e:
+            self.dead = True
+            raise WorkerError(f"worker connection lost: {e}") from None
+        return self.rid
+
+    def reply(self, rid: int) -> Any:
+        while True:
+            try:
+                status, r, value = self.conn.recv()
+            except (EOFError, OSError) as e:
+                self.dead = True
+                raise WorkerError(f"worker process exited during the request ({type(e).__name__})") from None
+            if r != rid:
+                continue
+            if status == "ok":
+                return value
+            if status == "cancelled":
+                raise Cancelled(value)
+            raise ServerError(500, value)
+
+    def call(self, op: str, *args) -> Any:
+        return self.reply(self.send(op, *args))
+
+    @property
+    def stale(self) -> bool:
+        # 쉬는 연결에 읽을 것이 있으면 EOF (워커 종료/재시작)
+        try:
+            return self.dead or self.conn.poll(0)
+        except OSError:
+            return True
+
+    def close(self) -> None:
+        try:
+            self.conn.close()
+        except OSError:
+            pass
+        self.ring.close()
+
+
+class WorkerClient:
+    """
+    워커 연결 풀 (스레드 안전, 프로세스에 하나면 충분). 요청마다 쉬는 연결을 빌리고 없으면 새로 연결한다.
+    spawn 이 있으면 워커가 없을 때 띄우고, 재시작 중이면 connect_timeout 까지 기다려 다시 연결한다.
+    """
+
+    def __init__(self, host: str = DEF_HOST, port: int = DEF_PORT, spawn: Optional[WorkerSpec] = None,
+                 connect_timeout: float = 300.0, ring_bytes: int = DEF_RING_BYTES):
+        self.address = (host, port)
+        self.spawn = spawn
+        self.connect_timeout = connect_timeout
+        self.ring_bytes = ring_bytes
+        self.proc: Optional[subprocess.Popen] = None
+        self.info: Dict[str, Any] = {}
+        self._idle: List[_Channel] = []
+        self._lock = threading.Lock()
+
+    def _connect(self) -> _Channel:
+        deadline = time.monotonic() + self.connect_timeout
+        while True:
+            try:
+                ch = _Channel(self.address, self.ring_bytes)
+            except (ConnectionRefusedError, ConnectionResetError, EOFError, WorkerError) as e:
+                if self.spawn is not None and self.proc is None:
+                    log.info("starting llm worker: %s", self.spawn.model)
+                    self.proc = start_worker(self.spawn, *self.address)
+                elif self.proc is not None and self.proc.poll() is not None:
+                    code, self.proc = self.proc.returncode, None
+                    raise WorkerError(f"llm worker exited ({code}), see {LOG_PATH}") from None
+                if time.monotonic() > deadline:
+                    raise WorkerError(f"llm worker not reachable at {self.address[0]}:{self.address[1]}: {e}") from None
+                time.sleep(0.2)
+                continue
+            if self.info.get("pid") not in (None, ch.info["pid"]):
+                log.warning("llm worker restarted (pid %s, restarts %s)", ch.info["pid"], ch.info["restarts"])
+            self.info = ch.info
+            return ch
+
+    @contextmanager
+    def _channel(self) -> Iterator[_Channel]:
+        ch = None
+        with self._lock:
+            while self._idle and ch is None:
+                ch = self._idle.pop()
+                if ch.stale:
+                    ch.close()
+                    ch = None
+        if ch is None:
+            ch = self._connect()
+        try:
+            yield ch
+        finally:
+            if ch.dead:
+                ch.close()
+            else:
+                with self._lock:
+                    self._idle.append(ch)
+
+    def call(self, op: str, *args) -> Any:
+        with self._channel() as ch:
+            return ch.call(op, *args)
+
+    def ensure(self) -> Dict[str, Any]:
+        """워커가 준비될 때까지 연결 (필요하면 spawn). 반환: 워커 정보."""
+        return self.call("info")
+
+    def chat(self, messages: List[Dict[str, str]], stream: bool = False, session: Optional[str] = None, **kwargs):
+        messages = [{"role": m["role"], "content": m["content"]} for m in messages]
+        if not stream:
+            return self.call("chat", session, messages, kwargs, False)
+        return self._stream(messages, session, kwargs)
+
+    def _stream(self, messages, session, kwargs) -> Iterator[Dict[str, Any]]:
+        with self._channel() as ch:
+            rid = ch.send("chat", session, messages, kwargs, True)
+            base = {"id": f"chatcmpl-w{os.getpid()}-{id(ch):x}-{rid}", "object": "chat.completion.chunk",
+                    "created": int(time.time()), "model": self.info.get("model", "")}
+
+            def chunk(delta: Dict[str, str], finish: Optional[str] = None) -> Dict[str, Any]:
+                return {**base, "choices": [{"index": 0, "delta": delta, "finish_reason": finish}]}
+
+            done = False
+            try:
+                yield chunk({"role": "assistant"})
+                delay = 0.0
+                while True:
+                    recs = ch.ring.read()
+                    for r, data in recs:
+                        if r == rid:
+                            yield chunk({"content": data.decode("utf-8")})
+                    if recs:
+                        delay = 0.0
+                        continue
+                    # 링이 비었으면 연결을 잠깐 기다림: 완료/오류 응답이나 워커 종료(EOF)가 오면 깨어난다
+                    delay = min(delay + 0.0005, 0.005)
+                    if ch.conn.poll(delay):
+                        for r, data in ch.ring.read():       # 응답 전에 기록된 나머지 delta
+                            if r == rid:
+                                yield chunk({"content": data.decode("utf-8")})
+                        done = True
+                        end = ch.reply(rid)
+                        yield chunk({}, end.get("finish_reason"))
+                        return
+            finally:
+                if not done and not ch.dead:
+                    # 소비자가 중간에 닫음 → 워커에 취소를 알리고 응답까지 비워 연결을 재사용 가능하게
+                    ch.ring.cancel(rid)
+                    try:
+                        while not ch.conn.poll(0.005):
+                            ch.ring.read()
+                        ch.ring.read()
+                        ch.reply(rid)
+                    except Exception:
+                        ch.dead = ch.dead or ch.stale
+
+    def forget(self, session: str) -> None:
+        """세션 종료: 워커 쪽 대기 요청 취소 + 세션 KV 캐시 제거."""
+        self.call("forget", session)
+
+    def shutdown(self) -> None:
+        """워커(감시 프로세스 포함)를 정상 종료."""
+        with self._channel() as ch:
+            ch.call("shutdown")
+            ch.dead = True
+        self.close()
+
+    def for_session(self, session: Optional[str] = None) -> "WorkerLLM":
+        return WorkerLLM(self, session)
+
+    def close(self) -> None:
+        """이 클라이언트의 연결/링 정리 (워커 프로세스는 계속 실행)."""
+        with self._lock:
+            idle, self._idle = self._idle, []
+        for ch in idle:
+            ch.close()
+
+
+class WorkerLLM:
+    """llama_cpp.Llama 의 채팅 관련 일부 인터페이스를 워커 요청으로 구현 (세션별 뷰)."""
+
+    def __init__(self, client: WorkerClient, session: Optional[str] = None):
+        self.client = client
+        self.session = session
+
+    def n_ctx(self) -> int:
+        return int((self.client.info or self.client.ensure()).get("n_ctx") or 0)
+
+    def tokenize(self, text: bytes, add_bos: bool = True, special: bool = False) -> List[int]:
+        return self.client.call("tokenize", text, add_bos, special)
+
+    def detokenize(self, tokens: Sequence[int]) -> bytes:
+        return self.client.call("detokenize", list(tokens))
+
+    def set_cache(self, cache) -> None:
+        # KV 캐시는 워커가 세션별로 관리
+        pass
+
+    def close(self) -> None:
+        self.client.close()
+
+    def create_chat_completion(self, messages: List[Dict[str, str]], stream: bool = False, **kwargs):
+        return self.client.chat(messages, stream=stream, session=self.session, **kwargs)
+
+
+def format_worker_info(info: Dict[str, Any]) -> str:
+    if not info:
+        return "llm worker: not connected"
+    return (f"llm worker pid {info['pid']} · {info['model']} · ctx {info['n_ctx']} · "
+            f"threads {info['n_threads']} · restarts {info['restarts']}")
+
+
+def parse_args():
+    p = argparse.ArgumentParser(description="Llama 전용 워커 프로세스 (CLI/앱이 공유, 크래시 시 자동 재시작)")
+    p.add_argument("--model", default="", help="GGUF model path")
+    p.add_argument("--chat-format", default="auto", help="auto | qwen | llama-3 | none ...")
+    p.add_argument("--ctx", type=int, default=2048)
+    p.add_argument("--threads", type=int, default=None, help="decode 스레드 수 (기본: autotune 결과 또는 cpu_count-1)")
+    p.add_argument("--kv-mb", type=int, default=2048, help="세션별 KV 상태 캐시 (MB, 0 이면 끔)")
+    p.add_argument("--host", default=DEF_HOST)
+    p.add_argument("--port", type=int, default=DEF_PORT)
+    p.add_argument("--log-level", default="", choices=["", *metrics.LOG_LEVELS])
+    p.add_argument("--status", action="store_true", help="실행 중인 워커 정보 출력")
+    p.add_argument("--stop", action="store_true", help="실행 중인 워커 종료")
+    return p.parse_args()
+
+
+def main():
+    args = parse_args()
+    if args.status or args.stop:
+        client = WorkerClient(args.host, args.port, connect_timeout=0.0)
+        try:
+            info = client.ensure()
+        except WorkerError as e:
+            print(f"[ERR] {e}")
+            sys.exit(1)
+        print(format_worker_info(info))
+        if args.stop:
+            client.shutdown()
+            print("[OK] stopped")
+        return
+    if not os.path.exists(args.model):
+        print(f"[ERR] model not found: {args.model}")
+        sys.exit(1)
+    metrics.configure_logging(args.log_level or None)
+    cfg = {"model": args.model, "ctx": args.ctx, "threads": args.threads, "chat_format": args.chat_format,
+           "kv_mb": args.kv_mb, "host": args.host, "port": args.port, "log_level": args.log_level}
+    sys.exit(supervise(cfg))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,350 @@
+# metrics.py — 가벼운 구간 타이밍(span) · 카운터 계층
+#
+# 모델/번들 로드, 프롬프트 평가, TTFT, decode tokens/s, 타깃별 predict 시간, 반복 예측 iteration 시간 등을 모은다.
+#   - span("name", target="bd"): with 블록 소요 시간을 기록. 꺼져 있으면 공용 no-op 객체만 반환 (거의 비용 없음)
+#   - observe(name, 값) / inc(name): 값 분포 / 누적 카운터
+#   - snapshot(): {지표: count, avg, p50, p95, max, ...} → Streamlit 사이드바 패널
+#   - 싱크(선택): JsonlSink(이벤트 1줄씩), PrometheusFileSink(Prometheus text 형식 파일을 주기적으로 갱신)
+# 켜기: enable(True) 또는 환경변수 BKCHAT_METRICS=1. 로그 레벨: configure_logging("DEBUG") 또는 BKCHAT_LOG_LEVEL.
+# 싱크 환경변수(sinks_from_env): BKCHAT_METRICS_JSONL, BKCHAT_METRICS_PROM — 여러 세션이 한 프로세스를 쓰는 Streamlit 앱용.
+from __future__ import annotations
+import json
+import logging
+import os
+import threading
+import time
+from collections import deque
+from typing import Any, Deque, Dict, List, Optional, Tuple
+
+import numpy as np
+
+PREFIX = "bkchat_"
+RESERVOIR = 512          # 분위수 계산용으로 보관하는 최근 값 수
+
+_enabled = os.environ.get("BKCHAT_METRICS", "").lower() in ("1", "true", "yes", "on")
+_lock = threading.Lock()
+
+Key = Tuple[str, Tuple[Tuple[str, str], ...]]
+
+
+def enabled() -> bool:
+    return _enabled
+
+
+def enable(on: bool = True) -> None:
+    global _enabled
+    _enabled = bool(on)
+
+
+class _Summary:
+    __slots__ = ("count", "sum", "max", "recent")
+
+    def __init__(self):
+        self.count = 0
+        self.sum = 0.0
+        self.max = float("-inf")
+        self.recent: Deque[float] = deque(maxlen=RESERVOIR)
+
+    def add(self, v: float) -> None:
+        self.count += 1
+        self.sum += v
+        if v > self.max:
+            self.max = v
+        self.recent.append(v)
+
+
+_summaries: Dict[Key, _Summary] = {}
+_counters: Dict[Key, float] = {}
+_sinks: List[Any] = []
+
+
+def _key(name: str, labels: Dict[str, Any]) -> Key:
+    return name, tuple(sorted((k, str(v)) for k, v in labels.items()))
+
+
+def observe(name: str, value: float, **labels) -> None:
+    """값 하나를 분포 지표에 기록 (초 단위 시간은 이름을 *_s 로)."""
+    if not _enabled:
+        return
+    value = float(value)
+    k = _key(name, labels)
+    with _lock:
+        s = _summaries.get(k)
+        if s is None:
+            s = _summaries[k] = _Summary()
+        s.add(value)
+    for sink in _sinks:
+        sink.event("observe", name, labels, value)
+
+
+def inc(name: str, n: float = 1, **labels) -> None:
+    if not _enabled:
+        return
+    k = _key(name, labels)
+    with _lock:
+        _counters[k] = _counters.get(k, 0.0) + n
+    for sink in _sinks:
+        sink.event("inc", name, labels, n)
+
+
+class _Span:
+    __slots__ = ("name", "labels", "t0")
+
+    def __init__(self, name: str, labels: Dict[str, Any]):
+        self.name = name
+        self.labels = labels
+
+    def __enter__(self):
+        self.t0 = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        if exc_type is not None:
+            self.labels["error"] = exc_type.__name__
+        observe(self.name + "_s", time.perf_counter() - self.t0, **self.labels)
+        return False
+
+
+class _NoopSpan:
+    __slots__ = ()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        return False
+
+
+_NOOP = _NoopSpan()
+
+
+def span(name: str, **labels):
+    """with span("model_load"): ... → 지표 model_load_s 에 소요 시간 기록. 꺼져 있으면 no-op."""
+    if not _enabled:
+        return _NOOP
+    return _Span(name, labels)
+
+
+# ---------- LLM 생성 지표 ----------
+def llama_perf(llm) -> Optional[Dict[str, float]]:
+    """
+    llama.cpp 누적 성능 카운터 (프롬프트 평가/디코드 시간·토큰 수). Llama 가 아니면(원격/대역) None.
+    LLMAccess / LLMView 로 감싼 경우 안쪽 Llama 를 찾는다.
+    """
+    if not _enabled:
+        return None
+    for attr in ("access", "llm"):
+        inner = llm.__dict__.get(attr) if hasattr(llm, "__dict__") else None
+        if inner is not None:
+            return llama_perf(inner)
+    ctx = getattr(getattr(llm, "_ctx", None), "ctx", None)
+    if ctx is None or getattr(llm, "draft_model", None) is not None:
+        return None                 # speculative 검증 batch 도 llama.cpp 에서는 prompt 평가로 집계됨
+    try:
+        import llama_cpp
+        d = llama_cpp.llama_perf_context(ctx)
+    except Exception:
+        return None
+    return {"p_eval_ms": d.t_p_eval_ms, "n_p_eval": d.n_p_eval, "eval_ms": d.t_eval_ms, "n_eval": d.n_eval}
+
+
+def record_generation(stats: Dict[str, float], perf_before: Optional[Dict[str, float]] = None,
+                      llm=None, path: str = "chat") -> None:
+    """
+    stream_chat 형태의 통계(ttft_s, tok_per_s, tokens)를 기록.
+    perf_before(생성 직전 llama_perf) 가 있으면 llama.cpp 카운터 차이로 프롬프트 평가 시간/토큰도 기록한다.
+    """
+    if not _enabled:
+        return
+    observe("ttft_s", stats.get("ttft_s", 0.0), path=path)
+    if stats.get("tokens", 0) > 1:
+        observe("decode_tok_per_s", stats.get("tok_per_s", 0.0), path=path)
+    inc("gen_tokens", stats.get("tokens", 0), path=path)
+    if perf_before is not None and llm is not None:
+        after = llama_perf(llm)
+        if after is not None:
+            n_p = after["n_p_eval"] - perf_before["n_p_eval"]
+            if n_p > 0:
+                observe("prompt_eval_s", (after["p_eval_ms"] - perf_before["p_eval_ms"]) / 1000.0, path=path)
+                observe("prompt_tokens", n_p, path=path)
+
+
+# ---------- 조회 ----------
+def _fmt_key(k: Key) -> str:
+    name, labels = k
+    return name + ("{" + ",".join(f"{a}={b}" for a, b in labels) + "}" if labels else "")
+
+
+def snapshot() -> Dict[str, Dict[str, float]]:
+    """{지표{라벨}: {count, sum, avg, p50, p95, max}} + 카운터 {지표{라벨}: {total}}."""
+    with _lock:
+        items = [(k, s.count, s.sum, s.max, list(s.recent)) for k, s in _summaries.items()]
+        counters = dict(_counters)
+    out: Dict[str, Dict[str, float]] = {}
+    for k, count, total, mx, recent in sorted(items):
+        p50, p95 = np.percentile(recent, [50, 95]) if recent else (0.0, 0.0)
+        out[_fmt_key(k)] = {"count": count, "sum": total, "avg": total / count if count else 0.0,
+                            "p50": float(p50), "p95": float(p95), "max": mx}
+    for k, v in sorted(counters.items()):
+        out[_fmt_key(k)] = {"total": v}
+    return out
+
+
+def snapshot_rows() -> List[Dict[str, Any]]:
+    """사이드바 표(st.dataframe)용 행 목록. 시간(*_s)은 ms 로 표시."""
+    rows = []
+    for name, d in snapshot().items():
+        if "total" in d:
+            rows.append({"metric": name, "count": None, "p50": None, "p95": None, "max": None, "total": d["total"]})
+            continue
+        base = name.split("{")[0]
+        scale, unit = (1000.0, " ms") if base.endswith("_s") and not base.endswith("_per_s") else (1.0, "")
+        rows.append({"metric": name + unit, "count": d["count"], "p50": round(d["p50"] * scale, 3),
+                     "p95": round(d["p95"] * scale, 3), "max": round(d["max"] * scale, 3), "total": None})
+    return rows
+
+
+def format_snapshot() -> str:
+    """CLI 출력용: 지표마다 한 줄 (시간은 ms)."""
+    lines = []
+    for r in snapshot_rows():
+        if r["total"] is not None:
+            lines.append(f"{r['metric']}: total {r['total']:g}")
+        else:
+            lines.append(f"{r['metric']}: n={r['count']} p50 {r['p50']:g} · p95 {r['p95']:g} · max {r['max']:g}")
+    return "\n".join(lines) if lines else "(no metrics)"
+
+
+def reset() -> None:
+    with _lock:
+        _summaries.clear()
+        _counters.clear()
+
+
+def _prom_labels(labels: Tuple[Tuple[str, str], ...], extra: str = "") -> str:
+    parts = [f'{a}="{b}"' for a, b in labels] + ([extra] if extra else [])
+    return "{" + ",".join(parts) + "}" if parts else ""
+
+
+def prometheus_text() -> str:
+    """Prometheus text exposition 형식 (분포 → summary, 카운터 → counter)."""
+    with _lock:
+        items = sorted((k, s.count, s.sum, list(s.recent)) for k, s in _summaries.items())
+        counters = sorted(_counters.items())
+    lines: List[str] = []
+    typed = set()
+    for (name, labels), count, total, recent in items:
+        m = PREFIX + name
+        if m not in typed:
+            lines.append(f"# TYPE {m} summary")
+            typed.add(m)
+        if recent:
+            for q, v in zip((0.5, 0.95), np.percentile(recent, [50, 95])):
+                quantile = f'quantile="{q}"'
+                lines.append(f"{m}{_prom_labels(labels, quantile)} {float(v):.6g}")
+        lines.append(f"{m}_sum{_prom_labels(labels)} {total:.6g}")
+        lines.append(f"{m}_count{_prom_labels(labels)} {count}")
+    for (name, labels), v in counters:
+        m = PREFIX + name + "_total"
+        if m not in typed:
+            lines.append(f"# TYPE {m} counter")
+            typed.add(m)
+        lines.append(f"{m}{_prom_labels(labels)} {v:.6g}")
+    return "\n".join(lines) + "\n"
+
+
+# ---------- 싱크 ----------
+class JsonlSink:
+    """이벤트마다 {"ts", "kind", "name", "labels", "value"} 한 줄을 추가."""
+
+    def __init__(self, path: str):
+        self.path = path
+        self._lock = threading.Lock()
+        self._f = open(path, "a", encoding="utf-8", buffering=1)
+
+    def event(self, kind: str, name: str, labels: Dict[str, Any], value: float) -> None:
+        line = json.dumps({"ts": time.time(), "kind": kind, "name": name, "labels": labels, "value": value},
+                          ensure_ascii=False)
+        with self._lock:
+            if not self._f.closed:
+                self._f.write(line + "\n")
+
+    def close(self) -> None:
+        with self._lock:
+            self._f.close()
+
+
+class PrometheusFileSink:
+    """
+    interval_s 마다 prometheus_text() 를 파일에 원자적으로 다시 쓴다
+    (node_exporter textfile collector 등이 읽는 용도).
+    """
+
+    def __init__(self, path: str, interval_s: float = 10.0):
+        self.path = path
+        self.interval_s = float(interval_s)
+        self._next = 0.0
+
+    def event(self, kind: str, name: str, labels: Dict[str, Any], value: float) -> None:
+        now = time.monotonic()
+        if now >= self._next:
+            self._next = now + self.interval_s
+            self.flush()
+
+    def flush(self) -> None:
+        tmp = f"{self.path}.{os.getpid()}.tmp"
+        with open(tmp, "w", encoding="utf-8") as f:
+            f.write(prometheus_text())
+        os.replace(tmp, self.path)
+
+    def close(self) -> None:
+        self.flush()
+
+
+def set_sinks(jsonl: str = "", prom: str = "", interval_s: float = 10.0) -> None:
+    """싱크를 교체 (빈 문자열이면 해당 싱크 없음). 경로가 같은 기존 싱크는 그대로 유지."""
+    keep = {(type(s), s.path): s for s in _sinks}
+    new = []
+    for cls, path in ((JsonlSink, jsonl), (PrometheusFileSink, prom)):
+        if path:
+            old = keep.pop((cls, path), None)
+            new.append(old or (cls(path, interval_s) if cls is PrometheusFileSink else cls(path)))
+    for s in keep.values():
+        s.close()
+    _sinks[:] = new
+
+
+def close_sinks() -> None:
+    set_sinks()
+
+
+def sinks_from_env() -> None:
+    """수집이 켜져 있으면 BKCHAT_METRICS_JSONL / BKCHAT_METRICS_PROM 경로로 싱크 설정."""
+    if _enabled:
+        set_sinks(os.environ.get("BKCHAT_METRICS_JSONL", ""), os.environ.get("BKCHAT_METRICS_PROM", ""))
+
+
+# ---------- 로깅 ----------
+LOG_LEVELS = ("WARNING", "INFO", "DEBUG")
+LOGGER = "bkchat"
+
+
+def get_logger(module: str) -> logging.Logger:
+    """모듈별 로거 (bkchat.<module>). 레벨은 configure_logging 이 bkchat 에 한 번 설정."""
+    return logging.getLogger(f"{LOGGER}.{module}")
+
+
+def log_level() -> str:
+    return logging.getLevelName(logging.getLogger(LOGGER).getEffectiveLevel())
+
+
+def configure_logging(level: Optional[str] = None) -> None:
+    """기존 print("[DEBUG] ...") 대신 쓰는 logging 설정. level 이 없으면 BKCHAT_LOG_LEVEL (기본 WARNING)."""
+    level = (level or os.environ.get("BKCHAT_LOG_LEVEL") or "WARNING").upper()
+    log = logging.getLogger(LOGGER)
+    if not log.handlers:
+        h = logging.StreamHandler()
+        h.setFormatter(logging.Formatter("[%(levelname)s] %(name)s: %(message)s"))
+        log.addHandler(h)
+        log.propagate = False
+    log.setLevel(level)
@@ -1,11 +1,83 @@
 # model_bundle.py
 from __future__ import annotations
-from dataclasses import dataclass
-from typing import Dict, Any, Optional
+from dataclasses import dataclass, field, astuple, replace
+from typing import Dict, Any, Optional, Sequence, Union, Iterator, Mapping
+import copy
+import logging
+import threading
+import time
 import joblib
 import numpy as np
 import pandas as pd
 from pathlib import Path
+from predict_cache import PredictionCache, bundle_fingerprint
+import metrics
+
+log = metrics.get_logger(__name__)
+
+# predict_batch 에 NumPy 행렬을 넘길 때의 기본 열 순서
+BATCH_COLUMNS = ["fck", "fy", "width", "height", "phi_mn"]
+# 반복 예측에서 다음 iteration 입력으로 되먹임되는 타깃
+FEEDBACK_TARGETS = ("bd", "Sm", "rho")
+# 반복 예측 초기 입력 (feature 버퍼 앞쪽 고정 열)
+BASE_FEATURES = ("f_idx", "width", "height", "phi_mn")
+# 분할(split) 번들 디렉터리 구성: manifest + 타깃별 모델 파일
+SPLIT_MANIFEST = "manifest.joblib"
+SPLIT_FORMAT = "split-v1"
+
+
+@dataclass
+class SolverConfig:
+    """
+    반복 예측(동시 갱신) 설정.
+    되먹임 입력(bd, Sm, rho)의 변화가 모두 atol + rtol*|값| 이내이면 수렴으로 보고,
+    early_stop 이면 해당 행(배치에서는 행별)의 반복을 멈춘다.
+    """
+    max_iters: int = 5
+    atol: float = 1e-9
+    rtol: float = 1e-6
+    early_stop: bool = True
+
+
+class LazyModels(Mapping):
+    """
+    분할 번들의 타깃별 모델을 처음 사용할 때 로드하는 dict 대용 객체.
+    mmap_mode 를 주면 큰 numpy 배열은 메모리 맵으로 열려 여러 프로세스가 페이지를 공유한다.
+    """
+
+    def __init__(self, paths: Dict[str, str], mmap_mode: Optional[str] = None):
+        self._paths = dict(paths)
+        self._mmap_mode = mmap_mode
+        self._loaded: Dict[str, Any] = {}
+        self._lock = threading.Lock()
+
+    def __getitem__(self, tgt: str) -> Any:
+        m = self._loaded.get(tgt)
+        if m is None:
+            with self._lock:
+                m = self._loaded.get(tgt)
+                if m is None:
+                    m = joblib.load(self._paths[tgt], mmap_mode=self._mmap_mode)
+                    self._loaded[tgt] = m
+        return m
+
+    def __iter__(self) -> Iterator[str]:
+        return iter(self._paths)
+
+    def __len__(self) -> int:
+        return len(self._paths)
+
+    def loaded(self) -> list:
+        return list(self._loaded)
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        state.pop("_lock", None)
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._lock = threading.Lock()
 
 
 @dataclass
@@ -14,10 +86,102 @@ class ModelBundle:
     features_by_target: Dict[str, list]
     #dtypes_by_target: Dict[str, Dict[str, str]]
     targets: list
+    solver: SolverConfig = field(default_factory=SolverConfig)
+    source: Optional[str] = None   # 로드한 번들 파일 경로 (캐시 무효화 기준)
+
+    def __post_init__(self):
+        self._compile()
+        self._cache: Optional[PredictionCache] = None
+        self._grid = None
+        self._executor = None
+        self._owns_executor = False
+
+    def _compile(self) -> None:
+        """
+        로드 시 1회: 공유 feature 버퍼의 열 배치와 타깃별 열 인덱스 맵을 만든다.
+        버퍼 열 = BASE_FEATURES + 되먹임 타깃 + 그 외 feature(항상 NaN).
+        """
+        cols = list(BASE_FEATURES)
+        for t in FEEDBACK_TARGETS:
+            if t not in cols:
+                cols.append(t)
+        for tgt in self.targets:
+            for f in self.features_by_target[tgt]:
+                if f not in cols:
+                    cols.append(f)
+        self._columns = cols
+        self._col_index = {c: i for i, c in enumerate(cols)}
+        self._feat_idx = {
+            tgt: np.array([self._col_index[f] for f in self.features_by_target[tgt]], dtype=np.intp)
+            for tgt in self.targets
+        }
+        # 컬럼명이 필요한 모델(DataFrame 으로 학습)만 pandas 래퍼 사용. 나머지는 ndarray 직접 전달
+        # (지연 로드 번들에서 모델을 미리 불러오지 않도록 첫 예측 때 판정)
+        self._needs_frame: Dict[str, bool] = {}
+        # 스레드별 작업 버퍼 (Streamlit 세션 스레드 간 공유 방지)
+        self._ws = threading.local()
+
+    def __getstate__(self):
+        # st.cache_data 등 pickle 복사 시 스레드 로컬 버퍼는 제외
+        state = self.__dict__.copy()
+        state.pop("_ws", None)
+        state["_executor"] = None   # 실행 풀은 복사하지 않음
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._ws = threading.local()
+
+    def view(self) -> "ModelBundle":
+        """
+        모델·feature 맵·예측 캐시·병렬 풀을 공유하는 얕은 복사본 (response grid 와 solver 설정은 따로).
+        공유 번들을 세션마다 다르게 쓸 때 사용. 뷰에서 enable_*/disable_*/attach_grid 를 해도 원본은 그대로다.
+        """
+        v = copy.copy(self)              # __getstate__: 작업 버퍼는 새로, 실행 풀은 빠짐
+        v.solver = replace(self.solver)
+        v._executor = self._executor
+        v._owns_executor = False
+        return v
+
+    def close(self) -> None:
+        """이 객체가 만든 병렬 풀을 닫는다."""
+        self.disable_parallel()
+
+    def _workspace(self, n: int):
+        """
+        (n, 열수) feature 버퍼와 타깃별 입력 버퍼를 반환. 용량이 부족할 때만 재할당하고
+        이후 호출은 앞쪽 n행 view 를 재사용한다.
+        """
+        ws = self._ws
+        cap = getattr(ws, "cap", 0)
+        if cap < n:
+            cap = max(n, 2 * cap)
+            ws.cap = cap
+            ws.buf = np.empty((cap, len(self._columns)))
+            ws.xbuf = {tgt: np.empty((cap, len(idx))) for tgt, idx in self._feat_idx.items()}
+        return ws.buf[:n], {tgt: x[:n] for tgt, x in ws.xbuf.items()}
 
     @classmethod
-    def load(cls, path: str | Path) -> "ModelBundle":
-        b = joblib.load(path)
+    def load(cls, path: str | Path, solver: Optional[SolverConfig] = None,
+             mmap_mode: Optional[str] = None, lazy: bool = True) -> "ModelBundle":
+        """
+        path 가 파일이면 joblib 번들 전체를, 디렉터리면 분할 번들(save_split)을 로드한다.
+        mmap_mode="r": 비압축 joblib 의 큰 numpy 배열을 메모리 맵으로 연다 (압축 파일은 무시됨)
+        lazy: 분할 번들에서 타깃별 모델을 처음 사용할 때 로드
+        """
+        path = Path(path)
+        with metrics.span("bundle_load", split=path.is_dir()):
+            if path.is_dir():
+                b = joblib.load(path / SPLIT_MANIFEST)
+                if b.get("format") != SPLIT_FORMAT:
+                    raise ValueError(f"unsupported split bundle format: {b.get('format')}")
+                paths = {t: str(path / rel) for t, rel in b["model_files"].items()}
+                models = LazyModels(paths, mmap_mode=mmap_mode)
+                if not lazy:
+                    models = {t: models[t] for t in models}
+                b["models"] = models
+            else:
+                b = joblib.load(path, mmap_mode=mmap_mode)
         # 방어적 체크
         for k in ["models", "features_by_target", "targets"]:   # bundle 구조
             if k not in b:
@@ -27,11 +191,87 @@ class ModelBundle:
             features_by_target=b["features_by_target"],
             #dtypes_by_target=b["dtypes_by_target"],
             targets=b["targets"],
+            solver=solver or SolverConfig(),
+            source=str(path),
         )
 
-    def predict_all(self, inputs: Dict[str, float]) -> Dict[str, float]:
+    def save_split(self, out_dir: str | Path) -> Path:
+        """
+        분할 번들로 저장: out_dir/manifest.joblib + out_dir/models/<타깃>.joblib (비압축, mmap 가능).
+        """
+        out = Path(out_dir)
+        (out / "models").mkdir(parents=True, exist_ok=True)
+        files = {}
+        for tgt in self.targets:
+            rel = f"models/{tgt}.joblib"
+            joblib.dump(self.models[tgt], out / rel, compress=0)
+            files[tgt] = rel
+        joblib.dump({
+            "format": SPLIT_FORMAT,
+            "features_by_target": self.features_by_target,
+            "targets": list(self.targets),
+            "model_files": files,
+        }, out / SPLIT_MANIFEST)
+        return out
+
+    def enable_cache(self, maxsize: int = 256, tol: float = 0.0,
+                     disk_path: Optional[str | Path] = None) -> PredictionCache:
+        """
+        predict_all 결과 LRU 캐시를 켠다. 키 = (f_idx, width, height, phi_mn) 을 tol 간격으로 반올림.
+        disk_path 를 주면 sqlite 영구 계층을 함께 사용하며, 다른 번들 파일의 항목은 무효화된다.
+        """
+        fp = bundle_fingerprint(self.source) if self.source else ""
+        self._cache = PredictionCache(maxsize=maxsize, tol=tol, disk_path=disk_path, fingerprint=fp)
+        return self._cache
+
+    def disable_cache(self) -> None:
+        self._cache = None
+
+    def cache_stats(self) -> Optional[Dict[str, Any]]:
+        return self._cache.stats() if self._cache is not None else None
+
+    def attach_grid(self, grid) -> None:
+        """
+        response_grid.ResponseGrid(또는 .npz 경로)를 연결한다. 연결 후 predict_all 은
+        grid 위의 질의를 보간으로 답하고, grid 밖이면 실제 모델로 계산한다.
+        """
+        from response_grid import ResponseGrid
+        if not isinstance(grid, ResponseGrid):
+            grid = ResponseGrid.load(grid)
+        if self.source and grid.fingerprint and grid.fingerprint != bundle_fingerprint(self.source):
+            raise ValueError("response grid was built from a different bundle file")
+        if list(grid.targets) != list(self.targets):
+            raise ValueError(f"response grid targets {grid.targets} != bundle targets {self.targets}")
+        self._grid = grid
+
+    def detach_grid(self) -> None:
+        self._grid = None
+
+    def enable_parallel(self, mode: str = "thread", workers: Optional[int] = None):
+        """
+        iteration 내 타깃별 predict 를 병렬로 실행한다 (parallel_predict.TargetExecutor).
+        mode: "thread" | "process",  workers: 풀 크기 (None 이면 min(타깃 수, CPU 수))
+        """
+        from parallel_predict import TargetExecutor
+        self.disable_parallel()
+        self._executor = TargetExecutor(self, mode=mode, workers=workers)
+        self._owns_executor = True
+        return self._executor
+
+    def disable_parallel(self) -> None:
+        # view() 로 빌린 풀은 닫지 않고 참조만 놓는다
+        if self._executor is not None and getattr(self, "_owns_executor", True):
+            self._executor.close()
+        self._executor = None
+        self._owns_executor = False
+
+    def parallel_stats(self) -> Optional[Dict[str, Any]]:
+        return self._executor.stats() if self._executor is not None else None
+
+    def predict_all(self, inputs: Dict[str, float], return_info: bool = False):
         """
         FastAPI 버전과 동일하게 반복 예측(동시 갱신) 방식 적용.
+        return_info=True 이면 (preds, {"iterations", "residual", "converged"}) 를 반환.
         """
         # f_idx 계산
         fck = float(inputs.get("fck"))
@@ -41,39 +281,288 @@ class ModelBundle:
         except Exception:
             f_idx = float(inputs.get("f_idx"))
 
-        # 초기 payload
-        feat_iter: Dict[str, float] = {
-            "f_idx": f_idx,
-            "width": float(inputs.get("width")),
-            "height": float(inputs.get("height")),
-            "phi_mn": float(inputs.get("phi_mn")) if inputs.get("phi_mn") is not None else np.nan,
-        }
+        width = float(inputs.get("width"))
+        height = float(inputs.get("height"))
+        phi_mn = float(inputs.get("phi_mn")) if inputs.get("phi_mn") is not None else np.nan
+
+        cache = self._cache
+        if cache is not None:
+            key = cache.make_key(f_idx, width, height, phi_mn) + astuple(self.solver)
+            hit = cache.get(key)
+            if hit is not None:
+                metrics.inc("predict_cache_hit")
+                log.debug("predict_all cache hit: %s", hit["preds"])
+                return (dict(hit["preds"]), dict(hit["info"])) if return_info else dict(hit["preds"])
+
+        if self._grid is not None:
+            approx = self._grid.lookup(fck, fy, width, height, phi_mn)
+            if approx is not None:
+                metrics.inc("predict_grid_hit")
+                log.debug("predict_all grid hit: %s", approx)
+                grid_info = {"iterations": 0, "residual": 0.0, "converged": True, "source": "grid"}
+                return (approx, grid_info) if return_info else approx
+
+        # 초기 payload (1행 배치)
+        buf, xbuf = self._workspace(1)
+        buf.fill(np.nan)
+        ci = self._col_index
+        buf[0, ci["f_idx"]] = f_idx
+        buf[0, ci["width"]] = width
+        buf[0, ci["height"]] = height
+        buf[0, ci["phi_mn"]] = phi_mn
+
+        with metrics.span("predict_all"):
+            preds, info = self._solve(buf, xbuf, echo=True)
+        last_preds = {tgt: float(v[0]) for tgt, v in preds.items()}
+        log.debug("predict_all final outputs: %s", last_preds)
+        last_info = {k: v[0].item() for k, v in info.items()}
+        if cache is not None:
+            cache.put(key, {"preds": dict(last_preds), "info": dict(last_info)})
+        if return_info:
+            return last_preds, last_info
+        return last_preds
+
+    def predict_batch(self, data: Union[pd.DataFrame, Dict[str, Any], np.ndarray],
+                      columns: Optional[Sequence[str]] = None, return_info: bool = False):
+        """
+        N행 입력을 한 번에 예측한다. iteration 마다 (미수렴 행에 대해) 타깃별 predict 1회.
+        data: DataFrame | {컬럼: 배열} | NumPy 행렬(열 순서 = columns 또는 BATCH_COLUMNS)
+        행별 결과는 predict_all 과 동일하며, 입력 DataFrame 의 index 를 유지한다.
+        return_info=True 이면 (preds, 행별 iterations/residual/converged DataFrame) 를 반환.
+        """
+        frame = _as_frame(data, columns)
+        n = len(frame)
+
+        def col(name: str) -> np.ndarray:
+            if name not in frame.columns:
+                raise ValueError(f"batch input missing column: {name}")
+            return pd.to_numeric(frame[name], errors="coerce").to_numpy(dtype=float)
+
+        # f_idx 계산: fck/fy 가 없거나 비정상인 행은 f_idx 컬럼으로 대체
+        fallback = col("f_idx") if "f_idx" in frame.columns else np.full(n, np.nan)
+        if "fck" in frame.columns and "fy" in frame.columns:
+            f_idx = _f_idx_array(col("fck"), col("fy"), fallback)
+        else:
+            f_idx = fallback
+        if not np.all(np.isfinite(f_idx)):
+            raise ValueError("batch input needs finite fck/fy or f_idx for every row")
+
+        buf, xbuf = self._workspace(n)
+        buf.fill(np.nan)
+        ci = self._col_index
+        buf[:, ci["f_idx"]] = f_idx
+        buf[:, ci["width"]] = col("width")
+        buf[:, ci["height"]] = col("height")
+        if "phi_mn" in frame.columns:
+            buf[:, ci["phi_mn"]] = col("phi_mn")
+
+        with metrics.span("predict_batch"):
+            preds, info = self._solve(buf, xbuf)
+        metrics.inc("predict_batch_rows", n)
+        out = pd.DataFrame(preds, index=frame.index, columns=list(self.targets))
+        if return_info:
+            return out, pd.DataFrame(info, index=frame.index)
+        return out
 
-        last_preds: Dict[str, float] = {}
-        MAX_ITERS = 5
-        for it in range(MAX_ITERS):
-            preds_k: Dict[str, float] = {}
+    def _solve(self, buf: np.ndarray, xbuf: Dict[str, np.ndarray], echo: bool = False):
+        """
+        동시 갱신 반복 예측. buf 는 (n, 열수) feature 버퍼이며 제자리에서 갱신된다.
+        전체 행이 active 인 동안 타깃 입력은 xbuf 에 np.take(out=) 로 채워 할당 없이 만든다.
+        수렴한 행은 고정하고 남은(active) 행만 다음 iteration 에서 예측한다.
+        반환: (타깃별 (n,) 예측, {"iterations", "residual", "converged"} 행별 배열)
+        """
+        cfg = self.solver
+        n = buf.shape[0]
+        ci = self._col_index
+        feedback = [t for t in FEEDBACK_TARGETS if t in self.targets]
+        last_preds: Dict[str, np.ndarray] = {tgt: np.full(n, np.nan) for tgt in self.targets}
+        iterations = np.zeros(n, dtype=int)
+        residual = np.full(n, np.inf)
+        converged = np.zeros(n, dtype=bool)
+        active = np.arange(n)
+        # 지표 수집이 꺼져 있으면 시간 측정 없이 기존 경로 그대로
+        timing = metrics.enabled()
+        kind = "single" if n == 1 else "batch"
+        echo = echo and log.isEnabledFor(logging.DEBUG)
+
+        for it in range(max(1, int(cfg.max_iters))):
+            t_it = time.perf_counter() if timing else 0.0
+            full = len(active) == n
+            Xs: Dict[str, np.ndarray] = {}
             for tgt in self.targets:
-                feats = self.features_by_target[tgt]
-                row = {f: feat_iter.get(f, np.nan) for f in feats}
-                X = pd.DataFrame([row], columns=feats)
+                if full:
+                    Xs[tgt] = np.take(buf, self._feat_idx[tgt], axis=1, out=xbuf[tgt])
+                else:
+                    Xs[tgt] = buf[np.ix_(active, self._feat_idx[tgt])]
+            # 같은 스냅샷을 입력으로 하므로 타깃 간 독립 → 병렬 실행 가능
+            if self._executor is not None and len(Xs) > 1:
+                preds_k = self._executor.map(Xs)
+            elif timing:
+                preds_k = {}
+                for tgt, X in Xs.items():
+                    t0 = time.perf_counter()
+                    preds_k[tgt] = self._predict_target(tgt, X)
+                    metrics.observe("predict_target_s", time.perf_counter() - t0, target=tgt, kind=kind)
+            else:
+                preds_k = {tgt: self._predict_target(tgt, X) for tgt, X in Xs.items()}
+
+            if echo:
+                # --- debug: per-iteration echo ---
+                log.debug("iter %d, preds=%s", it + 1, {t: float(v[0]) for t, v in preds_k.items()})
+
+            # 동시 갱신: bd, Sm, rho (행별로 유한한 예측값만 반영) + 변화량(잔차) 계산
+            res_k = np.zeros(len(active))
+            stable = np.ones(len(active), dtype=bool)
+            for tgt in feedback:
+                p = preds_k[tgt]
+                old = buf[active, ci[tgt]]
+                new = np.where(np.isfinite(p), p, old)
+                both_nan = np.isnan(old) & np.isnan(new)
+                with np.errstate(invalid="ignore"):
+                    diff = np.where(both_nan, 0.0, np.abs(new - old))
+                diff = np.where(np.isnan(diff), np.inf, diff)
+                res_k = np.maximum(res_k, diff)
+                stable &= diff <= cfg.atol + cfg.rtol * np.abs(np.nan_to_num(new))
+                buf[active, ci[tgt]] = new
+
+            for tgt in self.targets:
+                last_preds[tgt][active] = preds_k[tgt]
+            iterations[active] = it + 1
+            residual[active] = res_k
+            converged[active] = stable
+            if timing:
+                metrics.observe("solver_iter_s", time.perf_counter() - t_it, kind=kind)
+
+            if cfg.early_stop:
+                active = active[~stable]
+                if len(active) == 0:
+                    break
+        return last_preds, {"iterations": iterations, "residual": residual, "converged": converged}
+
+    def _predict_target(self, tgt: str, X: np.ndarray) -> np.ndarray:
+        """
+        한 타깃을 N행에 대해 예측. 컬럼명이 필요한 모델만 DataFrame(view) 으로 감싼다.
+        ndarray 입력이 컬럼명 때문에 거부되면 이후로는 DataFrame 을 쓰도록 기록한다 (입력 값 때문인 실패는 이번만 DataFrame 경로).
+        실패하면 NaN 위치가 같은 행끼리 묶어 재시도하고, 그래도 실패한 묶음만 행 단위로 재시도해
+        predict_all 과 같은 NaN 처리. (NaN 위치 때문에 거부되는 묶음은 첫 행만 확인하고 NaN 으로 둔다)
+        """
+        n = X.shape[0]
+        model = self.models[tgt]
+        feats = self.features_by_target[tgt]
+        needs_frame = self._needs_frame.get(tgt)
+        if needs_frame is None:
+            needs_frame = hasattr(model, "feature_names_in_") or hasattr(model, "feature_name_")
+            self._needs_frame[tgt] = needs_frame
+        if not needs_frame:
+            try:
+                return np.asarray(model.predict(X), dtype=float).reshape(n)
+            except Exception as e:
+                if _wants_frame(e):
+                    self._needs_frame[tgt] = True
+        Xf = pd.DataFrame(X, columns=feats, copy=False)
+        try:
+            return np.asarray(model.predict(Xf), dtype=float).reshape(n)
+        except Exception:
+            if n == 1:
+                return np.full(1, np.nan)
+        out = np.full(n, np.nan)
+        nan_mask = ~np.isfinite(X)
+        patterns, group = np.unique(nan_mask, axis=0, return_inverse=True)
+        for g, pat in enumerate(patterns):
+            idx = np.flatnonzero(group.reshape(-1) == g)
+            try:
+                out[idx] = np.asarray(model.predict(Xf.iloc[idx]), dtype=float).reshape(len(idx))
+                continue
+            except Exception:
+                pass
+            if pat.any():
+                # NaN 이 있는 묶음: 한 행도 안 되면 같은 NaN 위치의 나머지 행도 거부된다고 본다
                 try:
-                    preds_k[tgt] = float(self.models[tgt].predict(X)[0])
+                    out[idx[0]] = float(model.predict(Xf.iloc[idx[:1]])[0])
                 except Exception:
-                    preds_k[tgt] = np.nan
+                    continue
+                idx = idx[1:]
+            for i in idx:
+                try:
+                    out[i] = float(model.predict(Xf.iloc[i:i + 1])[0])
+                except Exception:
+                    pass
+        return out
 
-            # --- debug: per-iteration echo ---
-            print(f"[DEBUG] iter {it+1}, preds={preds_k}")
 
-            # 동시 갱신: bd, Sm, rho
-            if np.isfinite(preds_k.get("bd", np.nan)):
-                feat_iter["bd"] = preds_k["bd"]
-            if np.isfinite(preds_k.get("Sm", np.nan)):
-                feat_iter["Sm"] = preds_k["Sm"]
-            if np.isfinite(preds_k.get("rho", np.nan)):
-                feat_iter["rho"] = preds_k["rho"]
+def _as_frame(data: Union[pd.DataFrame, Dict[str, Any], np.ndarray],
+              columns: Optional[Sequence[str]] = None) -> pd.DataFrame:
+    """배치 입력을 DataFrame 으로 통일."""
+    if isinstance(data, pd.DataFrame):
+        return data
+    if isinstance(data, dict):
+        return pd.DataFrame({k: np.atleast_1d(np.asarray(v, dtype=float)) for k, v in data.items()})
+    arr = np.asarray(data, dtype=float)
+    if arr.ndim == 1:
+        arr = arr.reshape(1, -1)
+    cols = list(columns) if columns is not None else BATCH_COLUMNS[:arr.shape[1]]
+    if len(cols) != arr.shape[1]:
+        raise ValueError(f"matrix has {arr.shape[1]} columns, expected {len(cols)}")
+    return pd.DataFrame(arr, columns=cols)
 
-            last_preds = preds_k
 
-        print("[DEBUG] predict_all final outputs:", last_preds)
-        return last_preds
+def _wants_frame(e: Exception) -> bool:
+    """ndarray 입력 자체가 거부된 실패인지 (feature names 불일치 / DataFrame 전용 전처리). NaN 등 입력 값 문제는 제외."""
+    msg = str(e).lower()
+    return isinstance(e, (ValueError, KeyError, TypeError)) and any(
+        k in msg for k in ("feature_name", "feature name", "dataframe"))
+
+
+def _f_idx_array(fck: np.ndarray, fy: np.ndarray, fallback: np.ndarray) -> np.ndarray:
+    """
+    predict_all 의 f"{int(round(fck))}{int(round(fy))}" / 1000 을 벡터화.
+    (np.rint 는 round 와 같은 half-even 반올림)
+    """
+    fck_i = np.rint(fck)
+    fy_i = np.rint(fy)
+    ok = np.isfinite(fck_i) & np.isfinite(fy_i) & (fy_i >= 0)
+    with np.errstate(invalid="ignore", divide="ignore"):
+        digits = np.floor(np.log10(np.maximum(np.where(ok, fy_i, 1.0), 1.0))) + 1.0
+        mag = np.abs(fck_i) * 10.0 ** digits + fy_i
+    f_idx = np.where(fck_i < 0, -mag, mag) / 1000.0
+    return np.where(ok, f_idx, fallback)
+
+
+# ---------- 공유 핸들 ----------
+# 프로세스 안에서 같은 번들 파일은 한 번만 로드해 모든 세션/스레드가 같은 객체를 쓴다
+# (Streamlit st.cache_resource 와 같은 방식, pickle 복사 없음)
+_SHARED: Dict[tuple, ModelBundle] = {}
+_SHARED_LOCK = threading.Lock()
+
+
+def get_shared_bundle(path: str | Path, mmap_mode: Optional[str] = None, lazy: bool = True) -> ModelBundle:
+    """번들 파일이 바뀌면(fingerprint) 새로 로드한다."""
+    key = (str(Path(path).resolve()), bundle_fingerprint(path), mmap_mode, lazy)
+    with _SHARED_LOCK:
+        b = _SHARED.get(key)
+        if b is None:
+            b = ModelBundle.load(path, mmap_mode=mmap_mode, lazy=lazy)
+            # 같은 경로의 이전 버전은 버림
+            for k in [k for k in _SHARED if k[0] == key[0]]:
+                del _SHARED[k]
+            _SHARED[key] = b
+        return b
+
+
+def release_shared(path: str | Path) -> None:
+    """공유 핸들에서 번들을 내린다 (model_registry 의 메모리 예산 초과 시). 병렬 풀도 닫는다."""
+    root = str(Path(path).resolve())
+    with _SHARED_LOCK:
+        gone = [_SHARED.pop(k) for k in [k for k in _SHARED if k[0] == root]]
+    for b in gone:
+        b.disable_parallel()
+
+
+if __name__ == "__main__":
+    # 단일 joblib 번들 → 분할 번들 변환:  python model_bundle.py split <bundle.joblib> <out_dir>
+    import sys
+    if len(sys.argv) != 4 or sys.argv[1] != "split":
+        print("usage: python model_bundle.py split <bundle.joblib> <out_dir>")
+        sys.exit(1)
+    out_dir = ModelBundle.load(sys.argv[2]).save_split(sys.argv[3])
+    print(f"[SAVED] {out_dir}")
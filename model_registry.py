@@ -0,0 +1,297 @@
+# model_registry.py — 여러 GGUF 모델(과 번들)을 RAM 예산 안에 상주시키는 레지스트리
+#
+# 사이드바에서 모델 경로나 n_ctx 를 바꾸면 이전 모델이 내려가지 않고 쌓였고, "Reload model" 은
+# st.cache_resource.clear() 로 다른 캐시 자원까지 모두 버렸다.
+#   - request(key, loader, warmup, est_bytes): 없으면 백그라운드 로드(preload.Slot), 있으면 LRU 순서만 갱신
+#     → 예산 안에 함께 들어가는 모델끼리는 전환이 즉시
+#   - 예산(budget_bytes)을 넘으면 최근에 쓰지 않은 항목부터 내린다 (방금 요청한 항목, 로드 중인 항목 제외)
+#   - reload(key) / evict(key): 항목 하나만 다시 로드 / 내림
+#   - pool(key, name, factory): 모델별 warm pool (세션 KV 상태 캐시, batch scheduler 등) — 모델과 함께 유지/해제
+# 메모리 추정: 로드 전에는 파일 크기 + n_ctx × 토큰당 KV (처음 보는 모델은 기본값),
+# 로드 후에는 llama_model_size + 실제 KV 구성(layer × kv head × head dim, f16)으로 보정. pool 의 현재 bytes 도 더한다.
+from __future__ import annotations
+import os
+import threading
+import time
+from dataclasses import dataclass, field
+from typing import Any, Callable, Dict, Hashable, List, Optional
+
+import metrics
+import preload
+
+LLM, BUNDLE = "llm", "bundle"
+DEF_KV_BYTES_PER_TOKEN = 144 << 10     # 4B 급 GQA 모델 (36 layer × 8 kv head × 128 × K/V × f16)
+DEF_BUDGET_BYTES = 8 << 30
+
+log = metrics.get_logger("registry")
+
+_kv_per_token: Dict[str, int] = {}     # 모델 파일별 실측 토큰당 KV bytes
+
+
+# ---------- 메모리 추정 ----------
+def total_ram_bytes() -> int:
+    try:
+        import psutil
+        return int(psutil.virtual_memory().total)
+    except ImportError:
+        pass
+    try:
+        return os.sysconf("SC_PAGE_SIZE") * os.sysconf("SC_PHYS_PAGES")
+    except (AttributeError, ValueError, OSError):
+        pass
+    if os.name == "nt":
+        import ctypes
+
+        class _MemStatus(ctypes.Structure):
+            _fields_ = [("dwLength", ctypes.c_ulong), ("dwMemoryLoad", ctypes.c_ulong),
+                        ("ullTotalPhys", ctypes.c_ulonglong), ("ullAvailPhys", ctypes.c_ulonglong),
+                        ("ullTotalPageFile", ctypes.c_ulonglong), ("ullAvailPageFile", ctypes.c_ulonglong),
+                        ("ullTotalVirtual", ctypes.c_ulonglong), ("ullAvailVirtual", ctypes.c_ulonglong),
+                        ("ullAvailExtendedVirtual", ctypes.c_ulonglong)]
+
+        st = _MemStatus()
+        st.dwLength = ctypes.sizeof(_MemStatus)
+        if ctypes.windll.kernel32.GlobalMemoryStatusEx(ctypes.byref(st)):
+            return int(st.ullTotalPhys)
+    return 0
+
+
+def default_budget_bytes() -> int:
+    """물리 RAM 의 60% (알 수 없으면 8GB)."""
+    total = total_ram_bytes()
+    return int(total * 0.6) if total else DEF_BUDGET_BYTES
+
+
+def file_bytes(path: str) -> int:
+    """파일 크기, 폴더(분할 번들)면 안의 파일 합."""
+    if os.path.isdir(path):
+        return sum(os.path.getsize(os.path.join(d, f)) for d, _, fs in os.walk(path) for f in fs)
+    return os.path.getsize(path) if os.path.exists(path) else 0
+
+
+def estimate_llm_bytes(model_path: str, n_ctx: int) -> int:
+    per_tok = _kv_per_token.get(os.path.abspath(model_path), DEF_KV_BYTES_PER_TOKEN)
+    return file_bytes(model_path) + int(n_ctx) * per_tok
+
+
+def measure_llm_bytes(llm) -> int:
+    """로드된 Llama (또는 .llm 을 가진 LLMAccess): 가중치 + n_ctx 전체 KV 버퍼."""
+    import llama_cpp
+    llm = getattr(llm, "llm", llm)
+    m = llm._model.model
+    md = llm.metadata or {}
+    arch = md.get("general.architecture", "")
+    n_head = max(1, llama_cpp.llama_model_n_head(m))
+    head = llama_cpp.llama_model_n_embd(m) // n_head
+    k_len = int(md.get(f"{arch}.attention.key_length", head))
+    v_len = int(md.get(f"{arch}.attention.value_length", head))
+    per_tok = llama_cpp.llama_model_n_layer(m) * llama_cpp.llama_model_n_head_kv(m) * (k_len + v_len) * 2
+    _kv_per_token[os.path.abspath(llm.model_path)] = per_tok
+    return int(llama_cpp.llama_model_size(m)) + llm.n_ctx() * per_tok
+
+
+def _pool_bytes(item) -> int:
+    stats = getattr(item, "stats", None)
+    if stats is None:
+        return 0
+    try:
+        return int(stats().get("bytes", 0))
+    except Exception:
+        return 0
+
+
+def _close(item) -> None:
+    close = getattr(item, "close", None)
+    if close is not None:
+        try:
+            close()
+        except Exception as e:
+            log.warning("pool item close failed: %s", e)
+
+
+@dataclass
+class Entry:
+    key: Hashable
+    kind: str
+    name: str
+    slot: preload.Slot
+    est_bytes: int
+    measure: Optional[Callable[[Any], int]] = None
+    measured_version: int = 0
+    last_used: float = field(default_factory=time.monotonic)
+    hits: int = 0
+    pools: Dict[str, tuple] = field(default_factory=dict)     # name → (config, version | None, item)
+
+    def nbytes(self) -> int:
+        return self.est_bytes + sum(_pool_bytes(p[2]) for p in self.pools.values())
+
+
+class ModelRegistry:
+    """
+    프로세스 공유 모델/번들 레지스트리. Streamlit rerun 마다 request() 를 불러도 되고 (이미 있으면 no-op),
+    get(key) 로 준비된 자원(preload.Loaded)을 얻는다. 준비 전에는 None.
+    """
+
+    def __init__(self, budget_bytes: int = 0):
+        self.budget_bytes = int(budget_bytes) or default_budget_bytes()
+        self._entries: Dict[Hashable, Entry] = {}
+        self._lock = threading.RLock()
+        self.loads = 0
+        self.evictions = 0
+
+    # ---------- 요청 / 조회 ----------
+    def request(self, key: Hashable, loader: Callable[[], Any], warmup: Optional[Callable[[Any], None]] = None,
+                est_bytes: int = 0, kind: str = LLM, name: str = "",
+                dispose: Optional[Callable[[Any], None]] = None,
+                measure: Optional[Callable[[Any], int]] = None) -> Entry:
+        with self._lock:
+            e = self._entries.get(key)
+            if e is None:
+                e = Entry(key, kind, name or str(key), None, int(est_bytes), measure)
+                e.slot = preload.Slot(kind, dispose=lambda v, e=e: self._on_dispose(e, v, dispose))
+                self._entries[key] = e
+                self.loads += 1
+                metrics.inc("registry_load", kind=kind)
+            e.last_used = time.monotonic()
+            e.hits += 1
+            victims = self._fit(keep=key)
+        e.slot.request(key, loader, warmup)
+        self._release(victims)
+        return e
+
+    def get(self, key: Hashable) -> Optional[preload.Loaded]:
+        e = self._entries.get(key)
+        if e is None:
+            return None
+        cur = e.slot.get()
+        if cur is not None and e.measure is not None and e.measured_version != cur.version:
+            try:
+                e.est_bytes = int(e.measure(cur.value))
+            except Exception as ex:
+                log.warning("memory measure failed for %s: %s", e.name, ex)
+            e.measured_version = cur.version
+            with self._lock:
+                victims = self._fit(keep=key)
+            self._release(victims)
+        return cur
+
+    def entry(self, key: Hashable) -> Optional[Entry]:
+        return self._entries.get(key)
+
+    def entries(self) -> List[Entry]:
+        """최근 사용 순."""
+        with self._lock:
+            return sorted(self._entries.values(), key=lambda e: -e.last_used)
+
+    def touch(self, key: Hashable) -> None:
+        e = self._entries.get(key)
+        if e is not None:
+            e.last_used = time.monotonic()
+
+    # ---------- 선택적 재로드 / 해제 ----------
+    def reload(self, key: Hashable) -> bool:
+        """항목 하나만 다시 로드 (준비될 때까지 현재 인스턴스가 응답). 없으면 False."""
+        e = self._entries.get(key)
+        if e is None:
+            return False
+        e.slot.reload()
+        return True
+
+    def evict(self, key: Hashable, wait: bool = False) -> bool:
+        """항목 하나를 내린다. wait=True 면 해제(진행 중인 생성 종료 포함)가 끝날 때까지 기다린다."""
+        with self._lock:
+            e = self._entries.pop(key, None)
+        if e is None:
+            return False
+        if wait:
+            self.evictions += 1
+            self._unload(e)
+        else:
+            self._release([e])
+        return True
+
+    def set_budget(self, budget_bytes: int) -> None:
+        with self._lock:
+            self.budget_bytes = int(budget_bytes) or default_budget_bytes()
+            victims = self._fit(keep=None)
+        self._release(victims)
+
+    # ---------- warm pool ----------
+    def pool(self, key: Hashable, name: str, factory: Callable[[], Any], config: Any = None, bind: bool = False):
+        """
+        모델별로 유지되는 자원. config 가 바뀌면, bind=True 면 모델이 다시 로드되어도 이전 항목을 닫고 새로 만든다.
+        bind=False 항목(예: 세션 KV 상태 캐시)은 같은 모델의 재로드 후에도 유지되고, evict 때 함께 해제된다.
+        """
+        with self._lock:
+            e = self._entries.get(key)
+            if e is None:
+                raise KeyError(f"not resident: {key}")
+            cur = e.slot.get()
+            ver = cur.version if cur is not None else 0
+            old = e.pools.get(name)
+            if old is not None and old[0] == config and (not bind or old[1] == ver):
+                return old[2]
+            item = factory()
+            e.pools[name] = (config, ver if bind else None, item)
+        if old is not None:
+            _close(old[2])
+        return item
+
+    # ---------- 내부 ----------
+    def _fit(self, keep: Optional[Hashable]) -> List[Entry]:
+        """예산을 넘는 만큼 LRU 항목을 목록에서 뺀다 (정리는 잠금 밖 _release 에서). self._lock 안에서 호출."""
+        total = sum(e.nbytes() for e in self._entries.values())
+        victims = []
+        for e in sorted(self._entries.values(), key=lambda e: e.last_used):
+            if total <= self.budget_bytes:
+                break
+            if e.key == keep or e.slot.busy:
+                continue
+            total -= e.nbytes()
+            victims.append(self._entries.pop(e.key))
+        if total > self.budget_bytes:
+            log.warning("registry over budget: %.1f / %.1f GB", total / 2**30, self.budget_bytes / 2**30)
+        return victims
+
+    def _release(self, victims: List[Entry]) -> None:
+        for e in victims:
+            self.evictions += 1
+            metrics.inc("registry_evict", kind=e.kind)
+            log.info("registry: evict %s (%.0f MB)", e.name, e.nbytes() / 2**20)
+            # 진행 중인 생성이 끝날 때까지 기다릴 수 있으므로 백그라운드에서 해제
+            threading.Thread(target=self._unload, args=(e,), daemon=True, name=f"evict-{e.kind}").start()
+
+    def _unload(self, e: Entry) -> None:
+        with self._lock:
+            pools, e.pools = list(e.pools.values()), {}
+        for p in pools:
+            _close(p[2])
+        e.slot.unload()
+
+    def _on_dispose(self, e: Entry, value: Any, dispose: Optional[Callable[[Any], None]]) -> None:
+        """교체/해제된 인스턴스 정리: 그 인스턴스에 묶인 pool 항목을 먼저 닫는다."""
+        cur = e.slot.get()
+        with self._lock:
+            stale = [n for n, p in e.pools.items() if p[1] is not None and (cur is None or p[1] != cur.version)]
+            items = [e.pools.pop(n)[2] for n in stale]
+        for item in items:
+            _close(item)
+        if dispose is not None:
+            dispose(value)
+
+    # ---------- 표시 ----------
+    def stats(self) -> List[Dict[str, Any]]:
+        now = time.monotonic()
+        return [{"name": e.name, "kind": e.kind, "state": e.slot.status()["stage"] or "empty",
+                 "MB": round(e.nbytes() / 2**20), "idle_s": round(now - e.last_used, 1),
+                 "version": e.slot.version, "requests": e.hits, "pools": ", ".join(e.pools)}
+                for e in self.entries()]
+
+    def used_bytes(self) -> int:
+        with self._lock:
+            return sum(e.nbytes() for e in self._entries.values())
+
+
+def format_registry(reg: ModelRegistry) -> str:
+    return (f"resident {len(reg.stats())} · {reg.used_bytes() / 2**30:.1f}/{reg.budget_bytes / 2**30:.1f} GB · "
+            f"loads {reg.loads} · evictions {reg.evictions}")
@@ -0,0 +1,160 @@
+# parallel_predict.py — 반복 예측 iteration 내 타깃별 predict 병렬 실행
+#
+# 같은 iteration 의 타깃(bd, Sm, rho, phi_mn, ...)은 모두 같은 feature 스냅샷을 입력으로 받으므로
+# 서로 독립이다. 이를 동시에 평가한다.
+#   - mode="thread": GIL 을 놓는 추정기(xgboost, lightgbm, sklearn 트리 n_jobs 등)에 적합
+#   - mode="process": 워커마다 번들을 미리 로드해 두고 입력 배열만 주고받음 (순수 파이썬 모델용)
+from __future__ import annotations
+import os
+import threading
+import time
+from concurrent.futures import BrokenExecutor, ThreadPoolExecutor, ProcessPoolExecutor
+from typing import Any, Dict, Optional
+
+import numpy as np
+
+import metrics
+
+log = metrics.get_logger(__name__)
+
+# ---------- process worker ----------
+_WORKER_BUNDLE = None
+
+
+def _proc_init(bundle_path: str) -> None:
+    global _WORKER_BUNDLE
+    from model_bundle import ModelBundle
+    _WORKER_BUNDLE = ModelBundle.load(bundle_path)
+
+
+def _proc_predict(tgt: str, X: np.ndarray):
+    t0 = time.perf_counter()
+    y = _WORKER_BUNDLE._predict_target(tgt, X)
+    return y, time.perf_counter() - t0
+
+
+class TargetExecutor:
+    """
+    타깃별 predict 를 풀에서 동시에 실행한다.
+    풀 자체가 실패하면(워커 프로세스 종료, 종료된 풀) 로그를 남기고 해당 타깃을 이 프로세스에서 순차 계산하며,
+    깨진 풀은 다시 만든다 (조용히 NaN 을 돌려주지 않음).
+    stats(): calls, wall_s(병렬 구간 실측), busy_s(워커 안에서 잰 타깃별 소요 합), fallbacks, rebuilds,
+      overlap = busy_s / wall_s — 동시에 돌고 있던 정도일 뿐 (GIL/코어 경합이면 타깃별 시간도 같이 늘어 빨라지지 않아도 > 1),
+      speedup = 실측 순차 기준 / 병렬 — BASELINE_EVERY 번째 호출마다 같은 입력을 이 스레드에서 순차로 다시 재서 비교 (없으면 None)
+    """
+
+    BASELINE_EVERY = 50
+
+    def __init__(self, bundle, mode: str = "thread", workers: Optional[int] = None):
+        if mode not in ("thread", "process"):
+            raise ValueError(f"unknown parallel mode: {mode}")
+        self.mode = mode
+        self.workers = max(1, int(workers or min(len(bundle.targets), os.cpu_count() or 1)))
+        self._bundle = bundle
+        if mode == "process" and not bundle.source:
+            raise ValueError("process mode needs a bundle loaded from file (bundle.source)")
+        self._pool = self._new_pool()
+        self._closed = False
+        self._lock = threading.Lock()
+        self.calls = 0
+        self.wall_s = 0.0
+        self.busy_s = 0.0
+        self.base_serial_s = 0.0              # 순차 기준 측정 (표본 호출만)
+        self.base_wall_s = 0.0                # 같은 표본 호출의 병렬 실측
+        self.fallbacks = 0
+        self.rebuilds = 0
+
+    def _new_pool(self):
+        if self.mode == "thread":
+            return ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix="predict")
+        return ProcessPoolExecutor(max_workers=self.workers, initializer=_proc_init,
+                                   initargs=(self._bundle.source,))
+
+    def _rebuild(self, pool) -> None:
+        """깨진 풀 교체 (다른 스레드가 이미 바꿨거나 close() 된 경우는 그대로)."""
+        with self._lock:
+            if self._closed or self._pool is not pool:
+                return
+            self._pool = self._new_pool()
+            self.rebuilds += 1
+        pool.shutdown(wait=False, cancel_futures=True)
+        log.warning("parallel predict pool (%s) rebuilt", self.mode)
+
+    def _run_local(self, tgt: str, X: np.ndarray):
+        t0 = time.perf_counter()
+        y = self._bundle._predict_target(tgt, X)
+        return y, time.perf_counter() - t0
+
+    def map(self, inputs: Dict[str, np.ndarray]) -> Dict[str, np.ndarray]:
+        """{타깃: 입력 행렬} → {타깃: (n,) 예측}."""
+        t0 = time.perf_counter()
+        fn = self._run_local if self.mode == "thread" else _proc_predict
+        pool = self._pool
+        futs = {}
+        broken = False
+        try:
+            for tgt, X in inputs.items():
+                futs[tgt] = pool.submit(fn, tgt, X)
+        except RuntimeError as e:
+            # 종료된 풀(close) 또는 깨진 풀(BrokenExecutor) → 남은 타깃은 순차 계산
+            log.warning("parallel predict submit failed (%s: %s) → serial", type(e).__name__, e)
+            broken = isinstance(e, BrokenExecutor)
+        out: Dict[str, np.ndarray] = {}
+        busy = 0.0
+        for tgt, X in inputs.items():
+            f = futs.get(tgt)
+            y = None
+            if f is not None:
+                try:
+                    y, dt = f.result()
+                except Exception as e:
+                    # 모델 예측 실패는 _predict_target 안에서 NaN 처리되므로 여기 오는 것은 풀/워커 자체의 실패
+                    log.warning("parallel predict failed for %s (%s: %s) → serial", tgt, type(e).__name__, e)
+                    broken |= isinstance(e, BrokenExecutor)
+            if y is None:
+                with self._lock:
+                    self.fallbacks += 1
+                y, dt = self._run_local(tgt, X)
+            out[tgt] = y
+            busy += dt
+            metrics.observe("predict_target_s", dt, target=tgt, kind="parallel")
+        if broken:
+            self._rebuild(pool)
+        wall = time.perf_counter() - t0
+        with self._lock:
+            self.calls += 1
+            self.wall_s += wall
+            self.busy_s += busy
+            # 첫 호출은 풀/워커 기동이 섞이므로 두 번째 호출부터 표본
+            sample = self.calls % self.BASELINE_EVERY == 2
+        if sample:
+            self._baseline(inputs, wall)
+        return out
+
+    def _baseline(self, inputs: Dict[str, np.ndarray], wall: float) -> None:
+        """같은 입력을 풀 없이 순차로 다시 계산해 speedup 의 기준 시간을 잰다 (결과는 버림)."""
+        t0 = time.perf_counter()
+        for tgt, X in inputs.items():
+            self._bundle._predict_target(tgt, X)
+        serial = time.perf_counter() - t0
+        with self._lock:
+            self.base_serial_s += serial
+            self.base_wall_s += wall
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "mode": self.mode,
+            "workers": self.workers,
+            "calls": self.calls,
+            "wall_s": self.wall_s,
+            "busy_s": self.busy_s,
+            "overlap": self.busy_s / self.wall_s if self.wall_s > 0 else 0.0,
+            "speedup": self.base_serial_s / self.base_wall_s if self.base_wall_s > 0 else None,
+            "fallbacks": self.fallbacks,
+            "rebuilds": self.rebuilds,
+        }
+
+    def close(self) -> None:
+        with self._lock:
+            self._closed = True
+        self._pool.shutdown(wait=False, cancel_futures=True)
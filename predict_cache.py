@@ -0,0 +1,157 @@
+# predict_cache.py — ModelBundle 예측 결과 LRU 캐시 (+ 선택적 sqlite 디스크 계층)
+from __future__ import annotations
+import hashlib
+import json
+import math
+import os
+import sqlite3
+import threading
+from collections import OrderedDict
+from pathlib import Path
+from typing import Any, Dict, Optional, Tuple
+
+
+def bundle_fingerprint(path: str | Path) -> str:
+    """번들 파일 식별자: 경로 + 크기 + 수정시각. 다른 파일이 로드되면 값이 바뀐다."""
+    p = Path(path)
+    if p.is_dir():
+        # 분할 번들: manifest 기준
+        p = p / "manifest.joblib"
+    try:
+        st = p.stat()
+        raw = f"{p.resolve()}|{st.st_size}|{st.st_mtime_ns}"
+    except OSError:
+        raw = str(p)
+    return hashlib.sha1(raw.encode("utf-8")).hexdigest()[:16]
+
+
+class PredictionCache:
+    """
+    정규화된 입력 (f_idx, width, height, phi_mn, ...) → (preds, info) 를 저장하는 LRU 캐시.
+    - maxsize: 메모리 계층 최대 항목 수 (초과 시 가장 오래 안 쓴 항목 제거)
+    - tol: 입력 반올림 간격(0 이면 그대로 비교). 예: tol=1 → 800.4 와 800.0 은 같은 키
+    - disk_path: sqlite 파일 경로. 지정하면 Streamlit 재시작 후에도 유지되는 2차 계층
+    - fingerprint: 번들 식별자. 디스크 계층에서 다른 번들의 항목은 열 때 삭제
+    """
+
+    def __init__(self, maxsize: int = 256, tol: float = 0.0,
+                 disk_path: Optional[str | Path] = None, fingerprint: str = ""):
+        self.maxsize = max(1, int(maxsize))
+        self.tol = float(tol)
+        self.disk_path = str(disk_path) if disk_path else None
+        self.fingerprint = fingerprint
+        self._mem: "OrderedDict[Tuple, Any]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.disk_hits = 0
+        if self.disk_path:
+            self._init_disk()
+
+    # pickle(st.cache_data 복사 등) 시 lock 은 다시 만든다
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        state.pop("_lock", None)
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._lock = threading.Lock()
+
+    def make_key(self, *values: Optional[float]) -> Tuple:
+        """입력값을 tol 간격으로 반올림한 키. NaN/None 은 None 으로 통일."""
+        key = []
+        for v in values:
+            if v is None or (isinstance(v, float) and math.isnan(v)):
+                key.append(None)
+            elif self.tol > 0:
+                key.append(round(float(v) / self.tol))
+            else:
+                key.append(float(v))
+        return tuple(key)
+
+    def get(self, key: Tuple) -> Optional[Any]:
+        with self._lock:
+            if key in self._mem:
+                self._mem.move_to_end(key)
+                self.hits += 1
+                return self._mem[key]
+        if self.disk_path:
+            value = self._disk_get(key)
+            if value is not None:
+                with self._lock:
+                    self.hits += 1
+                    self.disk_hits += 1
+                self._mem_put(key, value)
+                return value
+        with self._lock:
+            self.misses += 1
+        return None
+
+    def put(self, key: Tuple, value: Any) -> None:
+        self._mem_put(key, value)
+        if self.disk_path:
+            self._disk_put(key, value)
+
+    def clear(self, disk: bool = False) -> None:
+        with self._lock:
+            self._mem.clear()
+        if disk and self.disk_path:
+            with sqlite3.connect(self.disk_path) as con:
+                con.execute("DELETE FROM preds")
+
+    def stats(self) -> Dict[str, Any]:
+        total = self.hits + self.misses
+        return {
+            "size": len(self._mem),
+            "maxsize": self.maxsize,
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "disk_hits": self.disk_hits,
+            "hit_rate": self.hits / total if total else 0.0,
+        }
+
+    # ---------- internal ----------
+    def _mem_put(self, key: Tuple, value: Any) -> None:
+        with self._lock:
+            self._mem[key] = value
+            self._mem.move_to_end(key)
+            while len(self._mem) > self.maxsize:
+                self._mem.popitem(last=False)
+                self.evictions += 1
+
+    def _init_disk(self) -> None:
+        d = os.path.dirname(self.disk_path)
+        if d:
+            os.makedirs(d, exist_ok=True)
+        with sqlite3.connect(self.disk_path) as con:
+            con.execute(
+                "CREATE TABLE IF NOT EXISTS preds ("
+                "fingerprint TEXT NOT NULL, key TEXT NOT NULL, value TEXT NOT NULL, "
+                "PRIMARY KEY (fingerprint, key))"
+            )
+            # 다른 번들 파일의 결과는 무효화
+            con.execute("DELETE FROM preds WHERE fingerprint != ?", (self.fingerprint,))
+
+    def _disk_get(self, key: Tuple) -> Optional[Any]:
+        try:
+            with sqlite3.connect(self.disk_path) as con:
+                row = con.execute(
+                    "SELECT value FROM preds WHERE fingerprint = ? AND key = ?",
+                    (self.fingerprint, json.dumps(key)),
+                ).fetchone()
+        except sqlite3.Error:
+            return None
+        return json.loads(row[0]) if row else None
+
+    def _disk_put(self, key: Tuple, value: Any) -> None:
+        try:
+            with sqlite3.connect(self.disk_path) as con:
+                con.execute(
+                    "INSERT OR REPLACE INTO preds (fingerprint, key, value) VALUES (?, ?, ?)",
+                    (self.fingerprint, json.dumps(key), json.dumps(value)),
+                )
+        except sqlite3.Error:
+            pass
@@ -1,5 +1,6 @@
 # predict_parser.py
 import re
+from dataclasses import dataclass
 from typing import Dict, Optional
 
 KEYMAP = {
@@ -16,6 +17,12 @@ KEYMAP = {
 # 예측에 필수로 필요한 기본 입력 정의
 REQUIRED_INPUT = ['fck', 'fy', 'width', 'height', 'phi_mn']
 
+# 별칭(소문자) → (표준키, 별칭 순번). 같은 표준키에 여러 별칭이 오면 순번이 큰 쪽이 우선 (기존 _normalize_keys 동작)
+_ALIAS = {a.lower(): (std, i) for std, aliases in KEYMAP.items() for i, a in enumerate(aliases)}
+
+_CLI_TOKEN = re.compile(r'([\w\-\u3131-\u318E\uAC00-\uD7A3]+)\s*[:=]\s*([-+]?[\d\.]+)')
+
+
 def parse_predict_message(text: str) -> Optional[Dict[str, float]]:
     """
     허용 형식: (단위 : mm, MPa, kN-m)
@@ -39,20 +46,34 @@ def parse_predict_message(text: str) -> Optional[Dict[str, float]]:
             pass
 
     # key=value or key:value 토큰 파싱
-    tokens = re.findall(r'([\w\-\u3131-\u318E\uAC00-\uD7A3]+)\s*[:=]\s*([-+]?[\d\.]+)', payload)
+    tokens = _CLI_TOKEN.findall(payload)
     d = {k: float(v) for k, v in tokens}
     return _normalize_keys(d)
 
+def resolve_columns(names) -> Dict[str, str]:
+    """표 컬럼명 → 표준키 매핑 {표준키: 원래 컬럼명}. 별칭 우선순위는 _normalize_keys 와 같다."""
+    best: Dict[str, tuple] = {}
+    for name in names:
+        hit = _ALIAS.get(str(name).strip().lower())
+        if hit is None:
+            continue
+        std, rank = hit
+        if std not in best or rank > best[std][0]:
+            best[std] = (rank, name)
+    return {std: best[std][1] for std in KEYMAP if std in best}
+
 def _normalize_keys(d: Dict) -> Dict[str, float]:
-    out: Dict[str, float] = {}
-    for std, aliases in KEYMAP.items():
-        for a in aliases:
-            for k in d.keys():
-                if k.lower() == a.lower():
-                    out[std] = float(d[k])
-                    break
-        # 누락 가능: Sm, bd, rho는 입력 없이 예측할 수 있도록 NaN 허용
-    return out
+    best: Dict[str, tuple] = {}
+    for k, v in d.items():
+        hit = _ALIAS.get(k.lower())
+        if hit is None:
+            continue
+        std, rank = hit
+        cur = best.get(std)
+        if cur is None or rank > cur[0]:
+            best[std] = (rank, v)
+    # 누락 가능: Sm, bd, rho는 입력 없이 예측할 수 있도록 NaN 허용
+    return {std: float(best[std][1]) for std in KEYMAP if std in best}
 
 
 # -------------------------------
@@ -64,37 +85,87 @@ _UNIT_MPA = r"(?:MPa|메가파스칼)?"
 _UNIT_MM = r"(?:mm|밀리미터)?"
 _UNIT_KNM = r"(?:kN[\-\s·]?m|kNm|킬로뉴턴미터)?"
 
-_NUM = r"([-+]?\d+(?:\.\d+)?)"
-_SP = r"[ \t]*"
-_UNIT_MPA = r"(?:MPa|메가파스칼)?"
-_UNIT_MM = r"(?:mm|밀리미터)?"
-_UNIT_KNM = r"(?:kN[\-\s·]?m|kNm|킬로뉴턴미터)?"
-
+# (키워드, 단위) — 단어 경계 적용: \b 또는 lookaround로 약어(b,h,mu 등)가 단어 내부(width, bd 등)에 매칭되지 않도록 함
+_NATURAL = {
+    "fck": (r"콘크리트\s*강도|설계\s*압축강도|\bfck\b", _UNIT_MPA),
+    "fy": (r"철근\s*항복강도|항복\s*강도|\bfy\b", ""),
+    "width": (r"단면\s*폭|폭|\bwidth\b|\bbw\b|(?<![A-Za-z])b(?![A-Za-z])", _UNIT_MM),
+    "height": (r"단면\s*높이|높이|\bheight\b|(?<![A-Za-z])h(?![A-Za-z])", _UNIT_MM),
+    "phi_mn": (r"휨\s*모멘트|공칭휨강도|\bmu\b|\bphi[_\-]?mn\b", _UNIT_KNM),
+}
 _PATTERNS = {
-    # 단어 경계 적용: \b 또는 lookaround로 약어(b,h,mu 등)가 단어 내부(width, bd 등)에 매칭되지 않도록 함
-    "fck": re.compile(rf"(?:콘크리트\s*강도|설계\s*압축강도|\bfck\b){_SP}[:=]?\s*{_NUM}\s*{_UNIT_MPA}", re.IGNORECASE),
-    "fy": re.compile(rf"(?:철근\s*항복강도|항복\s*강도|\bfy\b){_SP}[:=]?\s*{_NUM}", re.IGNORECASE),
-    "width": re.compile(rf"(?:단면\s*폭|폭|\bwidth\b|\bbw\b|(?<![A-Za-z])b(?![A-Za-z])){_SP}[:=]?\s*{_NUM}\s*{_UNIT_MM}", re.IGNORECASE),
-    "height": re.compile(rf"(?:단면\s*높이|높이|\bheight\b|(?<![A-Za-z])h(?![A-Za-z])){_SP}[:=]?\s*{_NUM}\s*{_UNIT_MM}", re.IGNORECASE),
-    "phi_mn": re.compile(rf"(?:휨\s*모멘트|공칭휨강도|\bmu\b|\bphi[_\-]?mn\b){_SP}[:=]?\s*{_NUM}\s*{_UNIT_KNM}", re.IGNORECASE),
+    key: re.compile(rf"(?:{kw}){_SP}[:=]?\s*{_NUM}\s*{unit}", re.IGNORECASE)
+    for key, (kw, unit) in _NATURAL.items()
 }
 
+# 예측 의도 키워드 (소문자 비교라 'Sm' 은 원래부터 매칭되지 않음 → 제외해 동작 유지)
+_INTENT_KWS = [
+    'fck', 'fy', 'phi_mn', 'mu',
+    '콘크리트', '강도', '철근', '항복강도', '철근량',
+    '단면', '폭', '높이', '휨모멘트', '휨강도', '공칭휨강도',
+    'bd', 'rho',
+]
+# 키워드 안에 포함된 다른 키워드 (같은 위치에서 긴 키워드가 잡히면 짧은 것도 존재)
+_KW_CLOSURE = {k: frozenset(o for o in _INTENT_KWS if o in k) for k in _INTENT_KWS}
+_KW_ALT = "|".join(re.escape(k) for k in sorted(_INTENT_KWS, key=len, reverse=True))
+# 키워드 첫 글자 집합 lookahead 로 키워드가 시작될 수 없는 위치는 바로 건너뛴다 (값 패턴 키워드 포함)
+_FIRST = "".join(sorted(set("콘설철항단폭높휨공강" "fwbhmpr")))
+_KW_SCAN = re.compile(rf"(?=[{_FIRST}])(?=({_KW_ALT}))")
+
+# 값 패턴 5개 + 의도 키워드를 한 번에 훑는 정규식.
+# 값 패턴이 매칭되면 그 구간을 소비하고, 아니면 zero-width lookahead 로 키워드만 기록하며 한 글자씩 진행한다.
+_VALUE_GROUPS = {f"v_{k}": k for k in _NATURAL}
+_SCAN = re.compile(
+    rf"(?=[{_FIRST}])(?:"
+    + "|".join(
+        rf"(?:{kw}){_SP}[:=]?\s*(?P<v_{key}>[-+]?\d+(?:\.\d+)?)\s*{unit}"
+        for key, (kw, unit) in _NATURAL.items()
+    ) + rf"|(?=(?P<kw>{_KW_ALT})))",
+    re.IGNORECASE,
+)
+
+
+@dataclass
+class PredictExtract:
+    intent: bool                         # 앱에서 예측 플로우로 볼지 (명령/값/키워드 2개 이상)
+    cli: Optional[Dict[str, float]]      # /predict 명령 값 (명령이 아니면 None)
+    natural: Dict[str, float]            # 자연어 값
+
+
+def _scan(text: str):
+    """text 를 한 번 훑어 (자연어 값, 의도 키워드 집합)."""
+    vals: Dict[str, float] = {}
+    kws = set()
+    for m in _SCAN.finditer(text):
+        kw = m.group("kw")
+        if kw is not None:
+            kws |= _KW_CLOSURE[kw.lower()]
+            continue
+        key = _VALUE_GROUPS[m.lastgroup]
+        if key not in vals:
+            vals[key] = float(m.group(m.lastgroup))
+    return vals, kws
+
+
+def extract(text: str) -> PredictExtract:
+    """
+    메시지 1개에서 예측 의도, CLI 값, 자연어 값을 함께 구한다 (자연어 스캔 1회).
+    intent == is_predict_intent(t) or parse_predict_message(t) is not None or bool(parse_predict_natural(t))
+    """
+    cli = parse_predict_message(text)
+    natural, kws = _scan(text)
+    intent = cli is not None or bool(natural) or len(kws) >= 2
+    return PredictExtract(intent, cli, natural)
+
+
 def parse_predict_natural(text: str) -> Dict[str, float]:
     """
     한국어/혼합 자연어에서 필수 입력값을 추출한다.
     예: '콘크리트 강도 27 MPa, 철근항복강도 400, 단면 폭 800mm, 높이 1000, 휨모멘트 1000 kN-m'
     """
-    d: Dict[str, float] = {}
-    for key, pat in _PATTERNS.items():
-        m = pat.search(text)
-        if m:
-            try:
-                d[key] = float(m.group(1))
-            except Exception:
-                pass
     # 선택항목도 키워드 그대로 허용
     # Sm, bd, rho가 자연어에 직접 나오면 'Sm=..' 같은 형식으로 parse_predict_message가 처리
-    return d
+    return _scan(text)[0]
 
 def is_predict_intent(text: str) -> bool:
     """
@@ -105,14 +176,12 @@ def is_predict_intent(text: str) -> bool:
     t = text.strip().lower()
     if t.startswith("/predict"):
         return True
-    kws = [
-        'fck', 'fy', 'phi_mn', 'mu',
-        '콘크리트', '강도', '철근', '항복강도', '철근량',
-        '단면', '폭', '높이', '휨모멘트', '휨강도', '공칭휨강도',
-        'Sm', 'bd', 'rho'
-        ]
-    hits = sum(1 for k in kws if k in t)
-    return hits >= 2
+    hits = set()
+    for m in _KW_SCAN.finditer(t):
+        hits |= _KW_CLOSURE[m.group(1)]
+        if len(hits) >= 2:
+            return True
+    return False
 
 
 def build_missing_prompt(missing_keys) -> str:
@@ -130,3 +199,24 @@ def build_missing_prompt(missing_keys) -> str:
         f"자연어로 입력하거나 예시처럼 입력하세요: {ex}"
     )
 
+
+
+if __name__ == "__main__":
+    # 마이크로 벤치마크: 메시지 1개당 파싱 비용 (앱은 매 메시지마다 호출)
+    import timeit
+    samples = [
+        "콘크리트 강도 27 MPa, 철근항복강도 400, 단면 폭 800mm, 높이 1000, 휨모멘트 1000 kN-m",
+        "/predict fck=27 fy=400 width=800 height=1000 phi_mn=1000",
+        "/predict {\"fck\":27, \"fy\":400, \"b\":800, \"h\":1000, \"mu\":1000}",
+        "철근 강도랑 단면 높이는 어떻게 정하나요?",
+        "오늘 점심 메뉴 추천해줘. 가능하면 한식으로 부탁해요.",
+    ]
+    n = 20000
+
+    def separate(t):
+        # 기존 앱 호출 방식: 의도 판단 + CLI + 자연어를 따로
+        return is_predict_intent(t), parse_predict_message(t), parse_predict_natural(t)
+
+    for name, fn in (("separate", separate), ("extract", extract)):
+        sec = timeit.timeit(lambda: [fn(t) for t in samples], number=n)
+        print(f"{name:>9}: {sec / (n * len(samples)) * 1e6:.2f} µs/message")
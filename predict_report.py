@@ -0,0 +1,138 @@
+# predict_report.py — 예측 결과 템플릿 요약 / 단위 표
+#
+# 예측 결과의 수치 4개를 문장으로 옮기려고 LLM 을 한 번 더 돌리면 CPU 에서 수 초가 걸리고 수치가 바뀔 위험도 있다.
+# render_report() 는 템플릿 문장 + 단위 표를 즉시 만든다 (LLM 불필요).
+# PolishJob 은 선택 기능: 백그라운드에서 LLM 으로 문장을 다듬고, 수치가 그대로 남아 있을 때만 결과를 채택한다.
+from __future__ import annotations
+import threading
+from contextlib import nullcontext
+from typing import Callable, Dict, List, Optional
+
+from think_stream import split_think
+
+INPUT_KEYS = ["fck", "fy", "width", "height", "phi_mn"]
+OUTPUT_KEYS = ["Sm", "bd", "rho", "phi_mn"]
+
+UNITS = {
+    "fck": "MPa", "fy": "MPa", "width": "mm", "height": "mm",
+    "phi_mn": "kN·m", "Sm": "mm²", "bd": "mm²", "rho": "",
+}
+LABELS = {
+    "fck": "콘크리트 강도", "fy": "철근 항복강도", "width": "단면 폭", "height": "단면 높이",
+    "phi_mn": "공칭휨강도", "Sm": "단면계수", "bd": "bd", "rho": "철근비",
+}
+# 표시 소수 자릿수 (rho 는 작은 값이라 유효숫자 위주)
+DECIMALS = {"fck": 1, "fy": 0, "width": 0, "height": 0, "phi_mn": 1, "Sm": 0, "bd": 0}
+
+
+def fmt_value(key: str, v) -> str:
+    if v is None:
+        return "-"
+    try:
+        x = float(v)
+    except (TypeError, ValueError):
+        return str(v)
+    if x != x:
+        return "NaN"
+    if key == "rho":
+        return f"{x:.5f}"
+    return f"{x:,.{DECIMALS.get(key, 3)}f}"
+
+
+def _with_unit(key: str, v) -> str:
+    s = fmt_value(key, v)
+    u = UNITS.get(key, "")
+    return f"{s} {u}" if u and s not in ("-", "NaN") else s
+
+
+def render_sentence(preds: Dict[str, float]) -> str:
+    return (
+        f"단면계수 Sm은 {_with_unit('Sm', preds.get('Sm'))}, "
+        f"철근비 rho는 {_with_unit('rho', preds.get('rho'))}, "
+        f"bd는 {_with_unit('bd', preds.get('bd'))}, "
+        f"공칭휨강도는 {_with_unit('phi_mn', preds.get('phi_mn'))} 입니다."
+    )
+
+
+def render_table(inputs: Dict[str, float], preds: Dict[str, float]) -> str:
+    rows = ["| 구분 | 항목 | 값 | 단위 |", "|---|---|---:|---|"]
+    for k in INPUT_KEYS:
+        rows.append(f"| 입력 | {LABELS[k]} ({k}) | {fmt_value(k, inputs.get(k))} | {UNITS[k] or '-'} |")
+    for k in OUTPUT_KEYS:
+        rows.append(f"| 예측 | {LABELS[k]} ({k}) | {fmt_value(k, preds.get(k))} | {UNITS[k] or '-'} |")
+    return "\n".join(rows)
+
+
+def render_report(inputs: Dict[str, float], preds: Dict[str, float]) -> str:
+    """채팅 말풍선용 markdown: 요약 문장 + 입력/예측 표."""
+    return render_sentence(preds) + "\n\n" + render_table(inputs, preds)
+
+
+# ---------- LLM polish (선택) ----------
+def polish_messages(system_prompt: str, inputs: Dict[str, float], preds: Dict[str, float]) -> List[Dict[str, str]]:
+    user = (
+        "다음 예측 결과 문장을 자연스럽게 다듬으세요. 수치와 단위는 표기 그대로 유지하세요.\n"
+        "- 입력: " + ", ".join(f"{k}={_with_unit(k, inputs.get(k))}" for k in INPUT_KEYS) + "\n"
+        f"- 문장: {render_sentence(preds)}"
+    )
+    return [{"role": "system", "content": system_prompt}, {"role": "user", "content": user}]
+
+
+def numbers_preserved(preds: Dict[str, float], text: str) -> bool:
+    """템플릿에 쓴 예측 수치 문자열이 모두 text 에 그대로 있는지 (쉼표 유무는 무시)."""
+    flat = text.replace(",", "")
+    for k in OUTPUT_KEYS:
+        s = fmt_value(k, preds.get(k))
+        if s in ("-", "NaN"):
+            continue
+        if s.replace(",", "") not in flat:
+            return False
+    return True
+
+
+class PolishJob:
+    """
+    백그라운드 LLM 다듬기. start() 후 done 이 되면 result 에 채택된 markdown(실패/수치 변경 시 None).
+    같은 llm 을 다른 요청과 동시에 쓰지 않도록, llm 을 쓰기 전에 wait() 로 끝나기를 기다린다.
+    prepare: 생성 직전에 같은 잠금 안에서 실행할 준비 작업 (스냅샷 복원 등). llm 에 hold() 가 있으면 그 잠금을 쓴다.
+    """
+
+    def __init__(self, llm, system_prompt: str, inputs: Dict[str, float], preds: Dict[str, float],
+                 max_tokens: int = 256, temperature: float = 0.3, prepare: Optional[Callable[[], None]] = None):
+        self.llm = llm
+        self.prepare = prepare
+        self.inputs = dict(inputs)
+        self.preds = dict(preds)
+        self.messages = polish_messages(system_prompt, inputs, preds)
+        self.max_tokens = int(max_tokens)
+        self.temperature = float(temperature)
+        self.result: Optional[str] = None
+        self.error: Optional[str] = None
+        self._thread = threading.Thread(target=self._run, daemon=True)
+
+    @property
+    def done(self) -> bool:
+        return self._thread.ident is not None and not self._thread.is_alive()
+
+    def start(self) -> "PolishJob":
+        self._thread.start()
+        return self
+
+    def wait(self, timeout: Optional[float] = None) -> None:
+        if self._thread.ident is not None:
+            self._thread.join(timeout)
+
+    def _run(self) -> None:
+        hold = getattr(self.llm, "hold", None)
+        try:
+            with hold() if hold is not None else nullcontext():
+                if self.prepare is not None:
+                    self.prepare()
+                resp = self.llm.create_chat_completion(messages=self.messages, max_tokens=self.max_tokens,
+                                                       temperature=self.temperature)
+            text = split_think(resp["choices"][0]["message"]["content"] or "")[0]
+        except Exception as e:
+            self.error = str(e)
+            return
+        if text and numbers_preserved(self.preds, text):
+            self.result = text + "\n\n" + render_table(self.inputs, self.preds)
@@ -0,0 +1,201 @@
+# preload.py — 모델/번들 백그라운드 로드 + 워밍업, 준비되면 원자적 교체
+#
+# Streamlit 스크립트 최상위에서 load_llm 을 바로 부르면 GGUF 로드가 끝날 때까지 첫 화면이 그려지지 않고,
+# 첫 질문은 차가운 캐시(모델 페이지, lazy 번들 모델, predict 작업 버퍼) 비용까지 치른다.
+#   - Slot: 자원 1개의 자리. request(key, loader, warmup) → 백그라운드 스레드에서 로드 → 워밍업 → current 교체
+#     교체 전까지는 이전 자원이 계속 응답하므로 Reload / 설정 변경 중에도 화면이 비지 않는다.
+#     교체된 이전 자원은 dispose(old) 로 정리 (예: 진행 중인 생성이 끝난 뒤 Llama 해제).
+#   - status(): stage(loading/warming/ready/failed), 경과 시간, 같은 key 의 직전 소요 시간(예상치)
+#   - warm_llm(): 짧은 생성 1회, warm_bundle(): 더미 predict_all 1회
+from __future__ import annotations
+import threading
+import time
+from dataclasses import dataclass
+from typing import Any, Callable, Dict, Hashable, Optional
+
+import metrics
+
+LOADING, WARMING, READY, FAILED = "loading", "warming", "ready", "failed"
+# 워밍업용 대표 입력 (lazy 번들의 타깃 모델을 모두 올리고 작업 버퍼를 만든다)
+WARM_PREDICT_INPUT = {"fck": 27.0, "fy": 400.0, "width": 400.0, "height": 600.0, "phi_mn": 300.0}
+
+log = metrics.get_logger("preload")
+
+
+@dataclass
+class Loaded:
+    key: Hashable
+    value: Any
+    version: int        # 교체될 때마다 1 증가 (캐시 키 등에 사용)
+    load_s: float
+    warm_s: float
+
+
+class LoadJob:
+    """loader() → warmup(value) 를 데몬 스레드에서 실행. 끝나면 on_done(job)."""
+
+    def __init__(self, key: Hashable, loader: Callable[[], Any], warmup: Optional[Callable[[Any], None]],
+                 on_done: Callable[["LoadJob"], None], name: str = ""):
+        self.key = key
+        self.loader = loader
+        self.warmup = warmup
+        self.on_done = on_done
+        self.name = name
+        self.stage = LOADING
+        self.value: Any = None
+        self.error: Optional[str] = None
+        self.load_s = self.warm_s = 0.0
+        self.t_start = time.perf_counter()
+        self._thread = threading.Thread(target=self._run, daemon=True, name=f"preload-{name}")
+
+    @property
+    def done(self) -> bool:
+        return self.stage in (READY, FAILED)
+
+    def start(self) -> "LoadJob":
+        self._thread.start()
+        return self
+
+    def wait(self, timeout: Optional[float] = None) -> None:
+        if self._thread.ident is not None:
+            self._thread.join(timeout)
+
+    def elapsed(self) -> float:
+        return (self.load_s + self.warm_s) if self.done else time.perf_counter() - self.t_start
+
+    def _run(self) -> None:
+        t0 = time.perf_counter()
+        try:
+            with metrics.span("preload_load", slot=self.name):
+                self.value = self.loader()
+            self.load_s = time.perf_counter() - t0
+            if self.warmup is not None:
+                self.stage = WARMING
+                t1 = time.perf_counter()
+                try:
+                    with metrics.span("preload_warm", slot=self.name):
+                        self.warmup(self.value)
+                except Exception as e:                 # 워밍업 실패는 치명적이지 않음
+                    log.warning("%s warm-up failed: %s", self.name, e)
+                self.warm_s = time.perf_counter() - t1
+            self.stage = READY
+        except Exception as e:
+            self.error = f"{type(e).__name__}: {e}"
+            self.load_s = time.perf_counter() - t0
+            self.stage = FAILED
+            log.warning("%s load failed: %s", self.name, self.error)
+        self.on_done(self)
+
+
+class Slot:
+    """
+    백그라운드로 채워지는 자원 자리 (프로세스 공유).
+    같은 key 를 다시 request() 하면 아무것도 하지 않으므로 Streamlit rerun 마다 불러도 된다.
+    실패한 key 는 reload() 전까지 다시 시도하지 않는다.
+    """
+
+    def __init__(self, name: str, dispose: Optional[Callable[[Any], None]] = None):
+        self.name = name
+        self.dispose = dispose
+        self._lock = threading.Lock()
+        self._current: Optional[Loaded] = None
+        self._job: Optional[LoadJob] = None
+        self._spec = None                              # 마지막 request 인자 (reload 용)
+        self._last_s: Dict[Hashable, float] = {}       # key 별 직전 로드+워밍업 시간
+        self.version = 0
+
+    def request(self, key: Hashable, loader: Callable[[], Any],
+                warmup: Optional[Callable[[Any], None]] = None, force: bool = False) -> None:
+        with self._lock:
+            self._spec = (key, loader, warmup)
+            job = self._job
+            if not force:
+                if job is not None and job.key == key and (not job.done or job.stage == FAILED):
+                    return                             # 진행 중 (또는 실패 — reload 로만 재시도)
+                if self._current is not None and self._current.key == key and (job is None or job.done):
+                    return
+            # 진행 중인 다른 작업은 끝나면 버려진다 (_finish 에서 job is not self._job)
+            self._job = LoadJob(key, loader, warmup, self._finish, self.name)
+            job = self._job
+        log.info("%s: loading %s", self.name, key)
+        job.start()
+
+    def reload(self) -> None:
+        """마지막으로 요청한 key 를 새로 로드. 준비될 때까지 현재 자원이 계속 쓰인다."""
+        if self._spec is not None:
+            self.request(*self._spec, force=True)
+
+    def unload(self) -> None:
+        """현재 자원을 내리고 정리 (진행 중인 로드는 끝나면 버려짐)."""
+        with self._lock:
+            old, self._current = self._current, None
+            self._job = None
+        self._dispose(old.value if old is not None else None)
+
+    def get(self) -> Optional[Loaded]:
+        return self._current
+
+    def wait(self, timeout: Optional[float] = None) -> None:
+        """진행 중인 로드가 끝날 때까지 대기."""
+        job = self._job
+        if job is not None:
+            job.wait(timeout)
+
+    @property
+    def value(self) -> Any:
+        cur = self._current
+        return cur.value if cur is not None else None
+
+    @property
+    def busy(self) -> bool:
+        job = self._job
+        return job is not None and not job.done
+
+    def status(self) -> Dict[str, Any]:
+        job, cur = self._job, self._current
+        if job is not None and (not job.done or job.stage == FAILED):
+            return {"name": self.name, "stage": job.stage, "key": job.key, "elapsed_s": job.elapsed(),
+                    "eta_s": self._last_s.get(job.key, 0.0), "error": job.error, "ready": cur is not None,
+                    "version": self.version}
+        return {"name": self.name, "stage": READY if cur is not None else "", "key": cur.key if cur else None,
+                "elapsed_s": (cur.load_s + cur.warm_s) if cur else 0.0, "eta_s": 0.0, "error": None,
+                "ready": cur is not None, "version": self.version}
+
+    def _finish(self, job: LoadJob) -> None:
+        old = None
+        with self._lock:
+            if job is not self._job:
+                old = job.value                        # 더 새 요청(또는 unload)에 밀린 결과
+            elif job.stage == READY:
+                old = self._current.value if self._current is not None else None
+                self.version += 1
+                self._current = Loaded(job.key, job.value, self.version, job.load_s, job.warm_s)
+                self._last_s[job.key] = job.load_s + job.warm_s
+                log.info("%s: ready %s (load %.1fs, warm-up %.1fs)", self.name, job.key, job.load_s, job.warm_s)
+        self._dispose(old)
+
+    def _dispose(self, value: Any) -> None:
+        if value is None or self.dispose is None:
+            return
+        try:
+            self.dispose(value)
+        except Exception as e:
+            log.warning("%s dispose failed: %s", self.name, e)
+
+
+def warm_llm(llm, max_tokens: int = 4) -> None:
+    """짧은 생성 1회: 가중치 페이지, 연산 버퍼, chat template 을 데운다."""
+    llm.create_chat_completion(messages=[{"role": "user", "content": "hi"}],
+                               max_tokens=max_tokens, temperature=0.0)
+
+
+def warm_bundle(bundle) -> None:
+    """더미 predict_all 1회: lazy 번들의 타깃 모델 로드 + 작업 버퍼 할당."""
+    bundle.predict_all(dict(WARM_PREDICT_INPUT))
+
+
+def format_status(s: Dict[str, Any]) -> str:
+    key = s["key"][0] if isinstance(s["key"], tuple) and s["key"] else s["key"]
+    name = str(key).replace("\\", "/").rsplit("/", 1)[-1] if key else ""
+    eta = f" / ~{s['eta_s']:.0f}s" if s["eta_s"] else ""
+    return f"{s['name']} {name}: {s['stage']} {s['elapsed_s']:.1f}s{eta}"
@@ -0,0 +1,115 @@
+# prompt_snapshot.py — 고정 system prompt 의 llama 상태(KV) 스냅샷 저장/복원
+#
+# 새 대화·Clear chat·예측 요약처럼 항상 같은 system prompt 로 시작하는 요청은
+# 매번 그 prompt 를 처음부터 평가한다. prompt 평가 직후의 상태를 (모델 파일, n_ctx, chat_format, prompt)
+# 키로 디스크에 저장해 두고, 새 대화에서는 상태를 복원해 system prompt 이후 suffix 만 평가한다.
+from __future__ import annotations
+import hashlib
+import os
+import pickle
+import threading
+from pathlib import Path
+from typing import Dict, Iterable, Optional
+
+from llama_cpp import Llama
+
+DEF_SNAPSHOT_DIR = os.path.join(".cache", "prompt_snapshots")
+
+
+def model_fingerprint(model_path: str, sample_bytes: int = 1 << 20) -> str:
+    """
+    GGUF 파일 식별 해시: 크기 + 앞/뒤 1MB 내용.
+    수 GB 파일 전체를 해시하지 않고도 다른 양자화/버전 파일을 구분한다.
+    """
+    h = hashlib.sha1()
+    size = os.path.getsize(model_path)
+    h.update(str(size).encode())
+    with open(model_path, "rb") as f:
+        h.update(f.read(sample_bytes))
+        if size > sample_bytes:
+            f.seek(max(0, size - sample_bytes))
+            h.update(f.read(sample_bytes))
+    return h.hexdigest()[:16]
+
+
+class PromptSnapshotStore:
+    """
+    system prompt 상태 스냅샷 저장소 (디스크 + 메모리).
+    prime(): 스냅샷이 있으면 복원, 없으면 prompt 를 평가해 만들고 저장한다.
+    """
+
+    def __init__(self, cache_dir: str = DEF_SNAPSHOT_DIR):
+        self.cache_dir = Path(cache_dir)
+        self.cache_dir.mkdir(parents=True, exist_ok=True)
+        self._mem: Dict[str, object] = {}
+        self._model_fp: Dict[str, str] = {}
+        self._lock = threading.Lock()
+
+    def key(self, model_path: str, n_ctx: int, prompt: str, chat_format: Optional[str] = None) -> str:
+        fp = self._model_fp.get(model_path)
+        if fp is None:
+            fp = self._model_fp[model_path] = model_fingerprint(model_path)
+        raw = "\x00".join([fp, str(int(n_ctx)), str(chat_format), prompt])
+        return hashlib.sha1(raw.encode("utf-8")).hexdigest()
+
+    def prime(self, llm: Llama, model_path: str, n_ctx: int, prompt: str,
+              chat_format: Optional[str] = None) -> str:
+        """
+        llm 을 "system prompt 평가 직후" 상태로 만든다.
+        반환: "warm"(이미 해당 상태), "restored"(스냅샷 복원), "built"(새로 평가 후 저장)
+        """
+        k = self.key(model_path, n_ctx, prompt, chat_format)
+        with self._lock:
+            state = self._mem.get(k)
+            if state is None:
+                state = self._read(k)
+            if state is not None:
+                self._mem[k] = state
+                n = int(state.n_tokens)
+                cur = llm._input_ids.tolist()
+                if Llama.longest_token_prefix(cur, state.input_ids[:n].tolist()) >= n:
+                    return "warm"
+                llm.load_state(state)
+                return "restored"
+            state = self._build(llm, prompt)
+            self._mem[k] = state
+            self._write(k, state)
+            return "built"
+
+    def ensure(self, llm: Llama, model_path: str, n_ctx: int, prompts: Iterable[str],
+               chat_format: Optional[str] = None) -> Dict[str, str]:
+        """알려진 system prompt 들의 스냅샷을 미리 만들어 둔다 (앱 시작 시 1회)."""
+        return {p: self.prime(llm, model_path, n_ctx, p, chat_format) for p in prompts}
+
+    # ---------- internal ----------
+    @staticmethod
+    def _build(llm: Llama, prompt: str):
+        # system + 빈 user 까지 평가: 새 대화는 "<system>…<user>" prefix 를 공유한다
+        llm.create_chat_completion(
+            messages=[{"role": "system", "content": prompt}, {"role": "user", "content": ""}],
+            max_tokens=1,
+            temperature=0.0,
+        )
+        return llm.save_state()
+
+    def _path(self, k: str) -> Path:
+        return self.cache_dir / f"{k}.state"
+
+    def _read(self, k: str):
+        p = self._path(k)
+        if not p.exists():
+            return None
+        try:
+            with open(p, "rb") as f:
+                return pickle.load(f)
+        except Exception:
+            return None
+
+    def _write(self, k: str, state) -> None:
+        tmp = self._path(k).with_suffix(".tmp")
+        try:
+            with open(tmp, "wb") as f:
+                pickle.dump(state, f, protocol=pickle.HIGHEST_PROTOCOL)
+            os.replace(tmp, self._path(k))
+        except OSError:
+            pass
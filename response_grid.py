@@ -0,0 +1,173 @@
+# response_grid.py — ModelBundle 응답면(grid) 사전 계산 + 다중선형 보간
+#
+# 사용 예 (grid 생성):
+#   python response_grid.py --bundle stack_bundle_1.joblib --out grid.npz \
+#       --fck 24,27,30,35 --fy 400,500 --width 300:1500:50 --height 400:1500:50 --phi-mn 100:3000:100
+#
+# 결과물: grid.npz (축, 타깃, 번들 식별자) + grid.values.npy (예측값, mmap 으로 로드)
+from __future__ import annotations
+import argparse
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Dict, List, Optional, Sequence
+
+import numpy as np
+import pandas as pd
+
+# 축 순서. fck/fy 는 규격값(정확히 일치해야 함), 나머지는 구간 내 선형 보간
+GRID_AXES = ("fck", "fy", "width", "height", "phi_mn")
+EXACT_AXES = ("fck", "fy")
+
+
+@dataclass
+class ResponseGrid:
+    axes: Dict[str, np.ndarray]
+    targets: List[str]
+    values: np.ndarray            # shape = (*축 길이, 타깃 수)
+    fingerprint: str = ""         # 생성에 사용한 번들 식별자
+    exact_tol: float = 1e-6       # fck/fy 일치 허용오차
+
+    # ---------- build / save / load ----------
+    @classmethod
+    def build(cls, bundle, axes: Dict[str, Sequence[float]], chunk_rows: int = 20000,
+              progress=None) -> "ResponseGrid":
+        """bundle.predict_batch 로 grid 전체를 chunk 단위 평가."""
+        ax = {k: np.asarray(sorted(set(float(v) for v in axes[k])), dtype=float) for k in GRID_AXES}
+        shape = tuple(len(ax[k]) for k in GRID_AXES)
+        targets = list(bundle.targets)
+        values = np.full(shape + (len(targets),), np.nan)
+        flat = values.reshape(-1, len(targets))
+        total = flat.shape[0]
+        mesh = np.stack(np.meshgrid(*(ax[k] for k in GRID_AXES), indexing="ij"), axis=-1).reshape(-1, len(GRID_AXES))
+        for start in range(0, total, chunk_rows):
+            chunk = pd.DataFrame(mesh[start:start + chunk_rows], columns=list(GRID_AXES))
+            flat[start:start + len(chunk)] = bundle.predict_batch(chunk)[targets].to_numpy()
+            if progress is not None:
+                progress(min(start + chunk_rows, total), total)
+        from predict_cache import bundle_fingerprint
+        fp = bundle_fingerprint(bundle.source) if getattr(bundle, "source", None) else ""
+        return cls(axes=ax, targets=targets, values=values, fingerprint=fp)
+
+    def save(self, path: str | Path) -> None:
+        path = Path(path)
+        np.savez(path, targets=np.array(self.targets), fingerprint=np.array(self.fingerprint),
+                 **{f"axis_{k}": v for k, v in self.axes.items()})
+        np.save(_values_path(path), self.values)
+
+    @classmethod
+    def load(cls, path: str | Path, mmap: bool = True) -> "ResponseGrid":
+        path = Path(path)
+        with np.load(path) as z:
+            axes = {k: z[f"axis_{k}"] for k in GRID_AXES}
+            targets = [str(t) for t in z["targets"]]
+            fp = str(z["fingerprint"])
+        values = np.load(_values_path(path), mmap_mode="r" if mmap else None)
+        return cls(axes=axes, targets=targets, values=values, fingerprint=fp)
+
+    # ---------- query ----------
+    def lookup(self, fck: float, fy: float, width: float, height: float,
+               phi_mn: float) -> Optional[Dict[str, float]]:
+        """
+        grid 위의 값이면 다중선형 보간 결과를 반환.
+        fck/fy 가 규격값이 아니거나, 다른 축이 범위를 벗어나거나, 주변 격자점에 NaN 이 있으면 None.
+        """
+        q = {"fck": fck, "fy": fy, "width": width, "height": height, "phi_mn": phi_mn}
+        idx: List[np.ndarray] = []
+        weights = np.ones(1)
+        for k in GRID_AXES:
+            a = self.axes[k]
+            v = q[k]
+            if v is None or not np.isfinite(v):
+                return None
+            if k in EXACT_AXES:
+                i = int(np.searchsorted(a, v - self.exact_tol))
+                if i >= len(a) or abs(a[i] - v) > self.exact_tol:
+                    return None
+                idx.append(np.array([i]))
+                continue
+            if v < a[0] or v > a[-1]:
+                return None
+            if len(a) == 1:
+                idx.append(np.array([0]))
+                continue
+            i = min(int(np.searchsorted(a, v, side="right")) - 1, len(a) - 2)
+            t = (v - a[i]) / (a[i + 1] - a[i])
+            idx.append(np.array([i, i + 1]))
+            weights = np.multiply.outer(weights, np.array([1.0 - t, t])).reshape(-1)
+
+        corners = self.values[np.ix_(*idx)].reshape(-1, len(self.targets))
+        if np.isnan(corners).any():
+            return None
+        out = weights @ corners
+        return {t: float(v) for t, v in zip(self.targets, out)}
+
+    def check(self, bundle, n: int = 50, seed: int = 0) -> Dict[str, float]:
+        """grid 범위 내 임의 점에서 보간값과 실제 모델 예측의 최대 상대오차(타깃별)."""
+        rng = np.random.default_rng(seed)
+        rows = []
+        for _ in range(n):
+            rows.append({
+                k: (float(rng.choice(self.axes[k])) if k in EXACT_AXES
+                    else float(rng.uniform(self.axes[k][0], self.axes[k][-1])))
+                for k in GRID_AXES
+            })
+        exact = bundle.predict_batch(pd.DataFrame(rows))
+        err = {t: 0.0 for t in self.targets}
+        for i, r in enumerate(rows):
+            approx = self.lookup(**r)
+            if approx is None:
+                continue
+            for t in self.targets:
+                ref = exact.iloc[i][t]
+                if np.isfinite(ref) and ref != 0:
+                    err[t] = max(err[t], abs(approx[t] - ref) / abs(ref))
+        return err
+
+
+def _values_path(path: Path) -> Path:
+    return path.with_name(path.stem + ".values.npy")
+
+
+def parse_axis(spec: str) -> np.ndarray:
+    """'24,27,30' 또는 'start:stop:step'(stop 포함) 형식."""
+    if ":" in spec:
+        start, stop, step = (float(x) for x in spec.split(":"))
+        return np.arange(start, stop + step / 2, step)
+    return np.array([float(x) for x in spec.split(",") if x.strip()])
+
+
+# ---------- CLI ----------
+def main():
+    p = argparse.ArgumentParser(description="ModelBundle 응답면 grid 생성")
+    p.add_argument("--bundle", required=True, help="joblib bundle path")
+    p.add_argument("--out", required=True, help="output .npz path")
+    p.add_argument("--fck", default="24,27,30,35")
+    p.add_argument("--fy", default="400,500")
+    p.add_argument("--width", default="300:1500:50")
+    p.add_argument("--height", default="400:1500:50")
+    p.add_argument("--phi-mn", default="100:3000:100")
+    p.add_argument("--check", type=int, default=0, help="보간 오차 확인용 샘플 수")
+    args = p.parse_args()
+
+    from model_bundle import ModelBundle
+    bundle = ModelBundle.load(args.bundle)
+    axes = {
+        "fck": parse_axis(args.fck), "fy": parse_axis(args.fy), "width": parse_axis(args.width),
+        "height": parse_axis(args.height), "phi_mn": parse_axis(args.phi_mn),
+    }
+    n = int(np.prod([len(v) for v in axes.values()]))
+    print(f"[INFO] grid points: {n:,}")
+
+    def progress(done, total):
+        print(f"\r[INFO] {done:,}/{total:,}", end="", flush=True)
+
+    grid = ResponseGrid.build(bundle, axes, progress=progress)
+    print()
+    grid.save(args.out)
+    print(f"[SAVED] {args.out} ({grid.values.nbytes / 1e6:.1f} MB)")
+    if args.check:
+        print("[CHECK] max rel. error:", grid.check(bundle, n=args.check))
+
+
+if __name__ == "__main__":
+    main()
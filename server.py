@@ -0,0 +1,467 @@
+# server.py — 로컬 추론 서버 (FastAPI + uvicorn)
+#
+# Llama 1개와 ModelBundle 1개를 프로세스에 한 번만 올려 두고 HTTP 로 공유한다.
+# Streamlit 앱 / CLI 는 --server(또는 사이드바 URL)로 server_client 의 얇은 클라이언트를 쓴다.
+#   - POST /v1/chat/completions : create_chat_completion 과 같은 형식, stream=true 면 SSE
+#   - POST /v1/tokenize, /v1/detokenize : ContextWindow 토큰 계산용
+#   - POST /predict, /predict/batch : ModelBundle.predict_all / predict_batch
+#   - GET  /health, /stats, /metrics (Prometheus text, --metrics)
+# 요청은 제한된 대기열(admission control)을 거친다: 꽉 차면 503 + Retry-After, 요청별 timeout 초과 시 생성 중단.
+#   python server.py --model Qwen3-4B.gguf --bundle stack_bundle_1.joblib --port 8765
+from __future__ import annotations
+import argparse
+import asyncio
+import json
+import math
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Dict, List, Optional
+
+import uvicorn
+from fastapi import FastAPI, HTTPException
+from fastapi.responses import JSONResponse, PlainTextResponse, StreamingResponse
+from pydantic import BaseModel
+
+import metrics
+
+DEF_PORT = 8765
+_END = object()
+
+
+class QueueFull(Exception):
+    pass
+
+
+class Admission:
+    """
+    실행 중 + 대기 중 요청 수를 max_pending 으로 제한한다 (스레드 안전).
+    stats(): running, waiting, admitted, rejected, timeouts, completed, avg_wait_s
+    """
+
+    def __init__(self, max_pending: int):
+        self.max_pending = int(max_pending)
+        self._lock = threading.Lock()
+        self.pending = 0
+        self.running = 0
+        self.admitted = 0
+        self.rejected = 0
+        self.timeouts = 0
+        self.completed = 0
+        self.wait_s = 0.0
+
+    def enter(self) -> None:
+        with self._lock:
+            if self.pending >= self.max_pending:
+                self.rejected += 1
+                raise QueueFull(f"server busy ({self.pending} requests pending)")
+            self.pending += 1
+            self.admitted += 1
+
+    def started(self, waited: float) -> None:
+        with self._lock:
+            self.running += 1
+            self.wait_s += waited
+
+    def leave(self, ran: bool) -> None:
+        with self._lock:
+            self.pending -= 1
+            if ran:
+                self.running -= 1
+                self.completed += 1
+
+    def timed_out(self) -> None:
+        with self._lock:
+            self.timeouts += 1
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            started = self.completed + self.running
+            return {
+                "running": self.running,
+                "waiting": self.pending - self.running,
+                "max_pending": self.max_pending,
+                "admitted": self.admitted,
+                "rejected": self.rejected,
+                "timeouts": self.timeouts,
+                "completed": self.completed,
+                "avg_wait_s": self.wait_s / started if started else 0.0,
+            }
+
+
+async def _run_admitted(executor, admission: Admission, fn, timeout_s: float):
+    """admission 을 거쳐 executor 에서 fn 실행. timeout 이 나도 이미 넣은 작업은 끝까지 돌고 자리를 반납한다."""
+    admission.enter()
+    loop = asyncio.get_running_loop()
+    t0 = time.perf_counter()
+
+    def work():
+        admission.started(time.perf_counter() - t0)
+        try:
+            return fn()
+        finally:
+            admission.leave(True)
+
+    fut = loop.run_in_executor(executor, work)
+    try:
+        return await asyncio.wait_for(asyncio.shield(fut), timeout_s)
+    except asyncio.TimeoutError:
+        admission.timed_out()
+        raise
+
+
+class LLMService:
+    """
+    Llama 는 동시에 한 요청만 처리할 수 있으므로 단일 스레드 executor 에서 순서대로 실행한다.
+    batch(batch_decode.BatchScheduler)가 있으면 채팅 생성은 batch.n_seq 개까지 동시에 받아 한 batch 로 decode 한다.
+    스트리밍 chunk 는 asyncio.Queue 로 이벤트 루프에 넘기고, timeout/연결 종료 시 cancel 플래그로 생성을 멈춘다.
+    """
+
+    def __init__(self, llm, max_pending: int = 8, timeout_s: float = 300.0, kv=None, batch=None):
+        self.llm = llm
+        self.timeout_s = float(timeout_s)
+        self.kv = kv
+        self.batch = batch
+        self.admission = Admission(max_pending)
+        self._exec = ThreadPoolExecutor(max_workers=1, thread_name_prefix="llm")
+        self._gen_exec = (ThreadPoolExecutor(max_workers=batch.n_seq, thread_name_prefix="llm-batch")
+                          if batch is not None else self._exec)
+
+    async def tokenize(self, text: str, add_bos: bool = False, special: bool = True) -> List[int]:
+        """
+        tokenize/detokenize 는 vocab 만 읽으므로 생성 대기열·admission 을 거치지 않는다.
+        다만 워커 모드(WorkerLLM)에서는 IPC 왕복이라 이벤트 루프를 막지 않게 별도 스레드에서 실행.
+        """
+        return await asyncio.to_thread(
+            lambda: list(self.llm.tokenize(text.encode("utf-8"), add_bos=add_bos, special=special)))
+
+    async def detokenize(self, tokens: List[int]) -> str:
+        return await asyncio.to_thread(lambda: self.llm.detokenize(tokens).decode("utf-8", errors="ignore"))
+
+    def start(self, messages: List[Dict[str, str]], gen: Dict[str, Any],
+              session: Optional[str] = None, timeout_s: Optional[float] = None):
+        """
+        생성을 대기열에 넣고 chunk 를 내보내는 async iterator 를 반환.
+        대기열이 꽉 차 있으면 여기서 바로 QueueFull (응답 헤더를 보내기 전에 503 가능).
+        """
+        self.admission.enter()
+        loop = asyncio.get_running_loop()
+        q: asyncio.Queue = asyncio.Queue()
+        cancel = threading.Event()
+        t0 = time.perf_counter()
+
+        def put(item):
+            loop.call_soon_threadsafe(q.put_nowait, item)
+
+        def work():
+            ran = not cancel.is_set()
+            try:
+                if not ran:
+                    return                      # 대기 중 timeout/연결 종료
+                self.admission.started(time.perf_counter() - t0)
+                gen_llm = self.batch if self.batch is not None else self.llm
+                if self.batch is None and self.kv is not None:
+                    self.llm.set_cache(self.kv.for_session(session or "default"))
+                perf0 = metrics.llama_perf(self.llm) if self.batch is None else None
+                t_start = time.perf_counter()
+                t_first = t_last = None
+                n = 0
+                it = gen_llm.create_chat_completion(messages=messages, stream=True, **gen)
+                try:
+                    for ch in it:
+                        if cancel.is_set():
+                            break
+                        if ch["choices"][0]["delta"].get("content"):
+                            t_last = time.perf_counter()
+                            t_first = t_first or t_last
+                            n += 1
+                        put(ch)
+                finally:
+                    close = getattr(it, "close", None)
+                    if close is not None:
+                        close()
+                if t_first is not None:
+                    gen_span = t_last - t_first
+                    metrics.record_generation({"ttft_s": t_first - t_start, "tokens": n,
+                                               "tok_per_s": (n - 1) / gen_span if n > 1 and gen_span > 0 else 0.0},
+                                              perf0, self.llm, "server")
+            except Exception as e:
+                put(e)
+            finally:
+                self.admission.leave(ran)
+                put(_END)
+
+        loop.run_in_executor(self._gen_exec, work)
+        return self._drain(q, cancel, loop.time() + (timeout_s or self.timeout_s))
+
+    async def _drain(self, q: asyncio.Queue, cancel: threading.Event, deadline: float):
+        loop = asyncio.get_running_loop()
+        try:
+            while True:
+                try:
+                    item = await asyncio.wait_for(q.get(), max(deadline - loop.time(), 0.001))
+                except asyncio.TimeoutError:
+                    self.admission.timed_out()
+                    raise
+                if item is _END:
+                    break
+                if isinstance(item, Exception):
+                    raise item
+                yield item
+        finally:
+            cancel.set()
+
+    async def complete(self, messages, gen, session=None, timeout_s=None) -> Dict[str, Any]:
+        """논스트림 응답: 스트림 chunk 를 모아 create_chat_completion 과 같은 형태로."""
+        parts, finish, model = [], None, ""
+        async for ch in self.start(messages, gen, session, timeout_s):
+            c = ch["choices"][0]
+            parts.append(c["delta"].get("content", "") or "")
+            finish = c.get("finish_reason") or finish
+            model = ch.get("model", model)
+        return {
+            "object": "chat.completion",
+            "model": model,
+            "created": int(time.time()),
+            "choices": [{"index": 0, "message": {"role": "assistant", "content": "".join(parts)},
+                         "finish_reason": finish}],
+        }
+
+
+class PredictService:
+    """ModelBundle 예측은 스레드 안전(스레드별 작업 버퍼)이므로 작은 풀에서 병렬 실행."""
+
+    def __init__(self, bundle, workers: int = 2, max_pending: int = 32, timeout_s: float = 60.0):
+        self.bundle = bundle
+        self.timeout_s = float(timeout_s)
+        self.admission = Admission(max_pending)
+        self._exec = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="predict")
+
+    async def run(self, fn):
+        return await _run_admitted(self._exec, self.admission, fn, self.timeout_s)
+
+
+# ---------- request bodies ----------
+class ChatRequest(BaseModel):
+    messages: List[Dict[str, str]]
+    temperature: float = 0.6
+    top_p: float = 0.95
+    max_tokens: int = 512
+    stream: bool = False
+    session: Optional[str] = None
+    timeout_s: Optional[float] = None
+
+
+class TokenizeRequest(BaseModel):
+    text: str
+    add_bos: bool = False
+    special: bool = True
+
+
+class DetokenizeRequest(BaseModel):
+    tokens: List[int]
+
+
+class PredictRequest(BaseModel):
+    inputs: Dict[str, Optional[float]]
+
+
+class BatchRequest(BaseModel):
+    rows: List[Dict[str, Optional[float]]]
+
+
+def _clean(v):
+    """JSON 으로 보낼 수 있게: NaN/inf → None, numpy 스칼라 → float/int/bool."""
+    if isinstance(v, dict):
+        return {k: _clean(x) for k, x in v.items()}
+    if isinstance(v, (list, tuple)):
+        return [_clean(x) for x in v]
+    if hasattr(v, "item"):
+        v = v.item()
+    if isinstance(v, float) and not math.isfinite(v):
+        return None
+    return v
+
+
+def _sse(obj) -> str:
+    return f"data: {json.dumps(obj, ensure_ascii=False)}\n\n"
+
+
+def create_app(llm_svc: Optional[LLMService], predict_svc: Optional[PredictService],
+               info: Dict[str, Any]) -> FastAPI:
+    app = FastAPI(title="BKChat local inference server")
+
+    def need_llm() -> LLMService:
+        if llm_svc is None:
+            raise HTTPException(404, "no model loaded (--model)")
+        return llm_svc
+
+    def need_bundle() -> PredictService:
+        if predict_svc is None:
+            raise HTTPException(404, "no bundle loaded (--bundle)")
+        return predict_svc
+
+    def busy(e: Exception):
+        return JSONResponse({"error": str(e)}, status_code=503, headers={"Retry-After": "1"})
+
+    @app.get("/health")
+    async def health():
+        return {**info, "stats": await stats()}
+
+    @app.get("/metrics", response_class=PlainTextResponse)
+    async def prometheus():
+        # Prometheus scrape 용 (--metrics 로 수집을 켜야 값이 쌓인다)
+        return metrics.prometheus_text()
+
+    @app.get("/stats")
+    async def stats():
+        out = {}
+        if llm_svc is not None:
+            out["llm"] = llm_svc.admission.stats()
+            if llm_svc.kv is not None:
+                out["kv"] = llm_svc.kv.stats()
+            if llm_svc.batch is not None:
+                out["batch"] = llm_svc.batch.stats()
+        if predict_svc is not None:
+            out["predict"] = predict_svc.admission.stats()
+            out["predict_cache"] = _clean(predict_svc.bundle.cache_stats())
+        return out
+
+    @app.post("/v1/chat/completions")
+    async def chat(req: ChatRequest):
+        svc = need_llm()
+        gen = {"temperature": req.temperature, "top_p": req.top_p, "max_tokens": req.max_tokens}
+        if not req.stream:
+            try:
+                return await svc.complete(req.messages, gen, req.session, req.timeout_s)
+            except QueueFull as e:
+                return busy(e)
+            except asyncio.TimeoutError:
+                raise HTTPException(504, "generation timed out")
+
+        try:
+            chunks = svc.start(req.messages, gen, req.session, req.timeout_s)
+        except QueueFull as e:
+            return busy(e)
+
+        async def events():
+            try:
+                async for ch in chunks:
+                    yield _sse(ch)
+                yield "data: [DONE]\n\n"
+            except asyncio.TimeoutError:
+                yield f"event: error\n{_sse({'error': 'generation timed out', 'status': 504})}"
+            except Exception as e:
+                yield f"event: error\n{_sse({'error': str(e), 'status': 500})}"
+
+        return StreamingResponse(events(), media_type="text/event-stream",
+                                 headers={"Cache-Control": "no-cache"})
+
+    @app.post("/v1/tokenize")
+    async def tokenize(req: TokenizeRequest):
+        return {"tokens": await need_llm().tokenize(req.text, add_bos=req.add_bos, special=req.special)}
+
+    @app.post("/v1/detokenize")
+    async def detokenize(req: DetokenizeRequest):
+        return {"text": await need_llm().detokenize(req.tokens)}
+
+    @app.post("/predict")
+    async def predict(req: PredictRequest):
+        svc = need_bundle()
+        try:
+            preds, pinfo = await svc.run(lambda: svc.bundle.predict_all(req.inputs, return_info=True))
+        except QueueFull as e:
+            return busy(e)
+        except asyncio.TimeoutError:
+            raise HTTPException(504, "predict timed out")
+        except Exception as e:
+            raise HTTPException(400, f"predict failed: {e}")
+        return _clean({"preds": preds, "info": pinfo})
+
+    @app.post("/predict/batch")
+    async def predict_batch(req: BatchRequest):
+        svc = need_bundle()
+        import pandas as pd
+        frame = pd.DataFrame(req.rows, dtype=float)
+        try:
+            preds, pinfo = await svc.run(lambda: svc.bundle.predict_batch(frame, return_info=True))
+        except QueueFull as e:
+            return busy(e)
+        except asyncio.TimeoutError:
+            raise HTTPException(504, "predict timed out")
+        except Exception as e:
+            raise HTTPException(400, f"predict failed: {e}")
+        return _clean({"preds": preds.to_dict(orient="list"), "info": pinfo.to_dict(orient="list")})
+
+    return app
+
+
+def parse_args():
+    p = argparse.ArgumentParser(description="로컬 추론 서버 (LLM 채팅 + 회귀 번들 예측)")
+    p.add_argument("--model", default="", help="GGUF model path ('' 이면 채팅 비활성)")
+    p.add_argument("--chat-format", default="auto")
+    p.add_argument("--ctx", type=int, default=2048)
+    p.add_argument("--threads", type=int, default=None, help="decode 스레드 수 (기본: autotune 결과 또는 cpu_count-1)")
+    p.add_argument("--bundle", default="", help="joblib bundle path or split dir ('' 이면 예측 비활성)")
+    p.add_argument("--host", default="127.0.0.1")
+    p.add_argument("--port", type=int, default=DEF_PORT)
+    p.add_argument("--max-queue", type=int, default=8, help="LLM 요청 최대 대기+실행 수 (초과 시 503)")
+    p.add_argument("--timeout", type=float, default=300.0, help="LLM 요청별 timeout (s)")
+    p.add_argument("--predict-workers", type=int, default=2)
+    p.add_argument("--predict-queue", type=int, default=32)
+    p.add_argument("--predict-timeout", type=float, default=60.0)
+    p.add_argument("--predict-cache", type=int, default=256, help="예측 LRU 캐시 크기 (0 이면 끔)")
+    p.add_argument("--grid", default="", help="response grid (.npz) path")
+    p.add_argument("--kv-mb", type=int, default=2048, help="세션별 KV 상태 캐시 (MB, 0 이면 끔)")
+    p.add_argument("--metrics", action="store_true", help="구간 타이밍/카운터 수집 → GET /metrics (Prometheus text)")
+    p.add_argument("--metrics-jsonl", default="", help="지표 이벤트 JSONL 파일 (--metrics 와 함께)")
+    p.add_argument("--log-level", default="", choices=["", *metrics.LOG_LEVELS])
+    p.add_argument("--batch-seq", type=int, default=0,
+                   help="동시 채팅 요청을 최대 N 개 세션까지 한 batch 로 decode (0 이면 순차, --kv-mb 무시)")
+    return p.parse_args()
+
+
+def main():
+    args = parse_args()
+    metrics.configure_logging(args.log_level or None)
+    if args.metrics:
+        metrics.enable()
+        metrics.set_sinks(jsonl=args.metrics_jsonl)
+    llm_svc = predict_svc = None
+    info: Dict[str, Any] = {"model": "", "n_ctx": 0, "targets": []}
+
+    if args.model:
+        from chat_cli import auto_chat_format, load_llm
+        chat_format = auto_chat_format(args.model, args.chat_format)
+        print(f"[INFO] Loading model… {args.model}")
+        llm = load_llm(args.model, args.ctx, args.threads, chat_format)
+        kv = batch = None
+        if args.batch_seq > 0:
+            import batch_decode
+            batch = batch_decode.BatchScheduler(llm, n_seq=args.batch_seq)
+        elif args.kv_mb > 0:
+            from llm_cache import KVCacheManager
+            kv = KVCacheManager(capacity_bytes=args.kv_mb << 20)
+        llm_svc = LLMService(llm, max_pending=args.max_queue, timeout_s=args.timeout, kv=kv, batch=batch)
+        info.update(model=os.path.basename(args.model), n_ctx=llm.n_ctx(), chat_format=chat_format)
+
+    if args.bundle:
+        from model_bundle import get_shared_bundle
+        print(f"[INFO] Loading bundle… {args.bundle}")
+        bundle = get_shared_bundle(args.bundle)
+        if args.predict_cache > 0:
+            bundle.enable_cache(maxsize=args.predict_cache)
+        if args.grid:
+            bundle.attach_grid(args.grid)
+        predict_svc = PredictService(bundle, workers=args.predict_workers, max_pending=args.predict_queue,
+                                     timeout_s=args.predict_timeout)
+        info.update(targets=list(bundle.targets))
+
+    app = create_app(llm_svc, predict_svc, info)
+    print(f"[READY] http://{args.host}:{args.port}")
+    uvicorn.run(app, host=args.host, port=args.port, log_level="warning")
+
+
+if __name__ == "__main__":
+    main()
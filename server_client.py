@@ -0,0 +1,157 @@
+# server_client.py — server.py 의 얇은 클라이언트 (표준 라이브러리 urllib 만 사용)
+#
+# RemoteLLM   : Llama 대신 쓸 수 있는 create_chat_completion / tokenize / detokenize / n_ctx
+# RemoteBundle: ModelBundle 대신 쓸 수 있는 predict_all / predict_batch
+# 모델과 번들은 서버 프로세스에 한 번만 올라가므로 앱/CLI 를 여러 개 띄워도 메모리·로딩 시간은 한 번이다.
+from __future__ import annotations
+import json
+import urllib.error
+import urllib.request
+from typing import Any, Dict, Iterator, List, Optional, Sequence
+
+DEF_SERVER = "http://127.0.0.1:8765"
+
+
+class ServerError(RuntimeError):
+    def __init__(self, status: int, message: str):
+        super().__init__(f"[{status}] {message}")
+        self.status = status
+
+
+def _request(url: str, body: Optional[dict] = None, timeout: float = 600.0, stream: bool = False):
+    data = None if body is None else json.dumps(body, ensure_ascii=False).encode("utf-8")
+    req = urllib.request.Request(url, data=data, method="GET" if body is None else "POST",
+                                 headers={"Content-Type": "application/json"})
+    try:
+        resp = urllib.request.urlopen(req, timeout=timeout)
+    except urllib.error.HTTPError as e:
+        try:
+            d = json.loads(e.read().decode("utf-8"))
+            msg = d.get("error") or d.get("detail") or str(d)
+        except Exception:
+            msg = e.reason
+        raise ServerError(e.code, str(msg)) from None
+    if stream:
+        return resp
+    with resp:
+        return json.loads(resp.read().decode("utf-8"))
+
+
+def _num(v) -> Optional[float]:
+    """None/빈 값/NaN 은 None 으로 그대로 보낸다 (서버 쪽 번들이 결측으로 처리)."""
+    if v is None or (isinstance(v, str) and not v.strip()):
+        return None
+    v = float(v)
+    return None if v != v else v
+
+
+class _Client:
+    def __init__(self, base_url: str = DEF_SERVER, timeout: float = 600.0):
+        self.base_url = base_url.rstrip("/")
+        self.timeout = timeout
+        self._health: Optional[Dict[str, Any]] = None
+
+    def _get(self, path: str):
+        return _request(self.base_url + path, timeout=self.timeout)
+
+    def _post(self, path: str, body: dict, stream: bool = False):
+        return _request(self.base_url + path, body, timeout=self.timeout, stream=stream)
+
+    def health(self, refresh: bool = False) -> Dict[str, Any]:
+        if self._health is None or refresh:
+            self._health = self._get("/health")
+        return self._health
+
+    def stats(self) -> Dict[str, Any]:
+        return self._get("/stats")
+
+
+class RemoteLLM(_Client):
+    """llama_cpp.Llama 의 채팅 관련 일부 인터페이스를 HTTP 로 구현."""
+
+    def __init__(self, base_url: str = DEF_SERVER, timeout: float = 600.0, session: Optional[str] = None):
+        super().__init__(base_url, timeout)
+        self.session = session
+
+    def n_ctx(self) -> int:
+        return int(self.health().get("n_ctx") or 0)
+
+    def tokenize(self, text: bytes, add_bos: bool = True, special: bool = False) -> List[int]:
+        d = self._post("/v1/tokenize", {"text": text.decode("utf-8", errors="ignore"),
+                                        "add_bos": add_bos, "special": special})
+        return d["tokens"]
+
+    def detokenize(self, tokens: Sequence[int]) -> bytes:
+        return self._post("/v1/detokenize", {"tokens": list(tokens)})["text"].encode("utf-8")
+
+    def set_cache(self, cache) -> None:
+        # KV 캐시는 서버가 세션별로 관리
+        pass
+
+    def close(self) -> None:
+        pass
+
+    def create_chat_completion(self, messages: List[Dict[str, str]], stream: bool = False,
+                               temperature: float = 0.6, top_p: float = 0.95, max_tokens: int = 512, **_):
+        body = {"messages": [{"role": m["role"], "content": m["content"]} for m in messages],
+                "temperature": temperature, "top_p": top_p, "max_tokens": max_tokens,
+                "stream": stream, "session": self.session}
+        if not stream:
+            return self._post("/v1/chat/completions", body)
+        return self._stream(body)
+
+    def _stream(self, body: dict) -> Iterator[Dict[str, Any]]:
+        resp = self._post("/v1/chat/completions", body, stream=True)
+        event = None
+        with resp:
+            for raw in resp:
+                line = raw.decode("utf-8").rstrip("\r\n")
+                if not line:
+                    event = None
+                    continue
+                if line.startswith("event:"):
+                    event = line[6:].strip()
+                    continue
+                if not line.startswith("data:"):
+                    continue
+                payload = line[5:].strip()
+                if payload == "[DONE]":
+                    return
+                d = json.loads(payload)
+                if event == "error":
+                    raise ServerError(int(d.get("status", 500)), d.get("error", "stream error"))
+                yield d
+
+
+class RemoteBundle(_Client):
+    """ModelBundle 의 예측 인터페이스(predict_all / predict_batch)를 HTTP 로 구현."""
+
+    @property
+    def targets(self) -> List[str]:
+        return list(self.health().get("targets") or [])
+
+    def predict_all(self, inputs: Dict[str, float], return_info: bool = False):
+        d = self._post("/predict", {"inputs": {k: _num(v) for k, v in inputs.items()}})
+        preds = {k: (float("nan") if v is None else v) for k, v in d["preds"].items()}
+        return (preds, d["info"]) if return_info else preds
+
+    def predict_batch(self, data, columns=None, return_info: bool = False):
+        import pandas as pd
+        from model_bundle import _as_frame
+        frame = _as_frame(data, columns)
+        rows = frame.astype(float).astype(object).where(frame.notna(), None).to_dict(orient="records")
+        d = self._post("/predict/batch", {"rows": rows})
+        preds = pd.DataFrame(d["preds"], index=frame.index, dtype=float)
+        if return_info:
+            return preds, pd.DataFrame(d["info"], index=frame.index)
+        return preds
+
+    # 로컬 번들 전용 기능은 서버 쪽 설정을 따른다 (server.py --predict-cache / --grid)
+    def attach_grid(self, grid) -> None:
+        raise RuntimeError("서버 모드에서는 server.py --grid 로 지정하세요")
+
+    def cache_stats(self) -> Dict[str, Any]:
+        return {}
+
+    def parallel_stats(self) -> Dict[str, Any]:
+        return {}
@@ -0,0 +1,213 @@
+# speculative.py — 추측(speculative) 디코딩: 작은 draft GGUF 또는 n-gram prompt-lookup
+#
+# CPU 에서 4B 모델의 decode 는 토큰마다 가중치 전체를 한 번 읽어야 해서 느리다.
+# drafter 가 다음 토큰 k 개를 싸게 추측하면 본 모델은 [직전 토큰 + 추측 k 개] 를 한 번의 decode 로 검증하고,
+# 일치하는 앞부분만 받아들인다 (Llama.generate 의 draft_model 경로 — 위치마다 같은 sampler 로 뽑으므로 출력은 drafting 없이와 같다).
+#   - "lookup": PromptLookup — 프롬프트/앞선 출력에서 같은 n-gram 뒤를 그대로 추측 (예측 요약처럼 수치를 되풀이할 때 유리)
+#   - *.gguf  : DraftLlama — 같은 vocab 의 작은 모델(Qwen3-0.6B 등)로 greedy 추측
+# Llama(draft_model=...) 로 만들면 logits_all=True 가 강제되어 prompt 전체의 logits(n_ctx × n_vocab 배열)를 계산·복사한다.
+# attach() 는 이미 로드된 Llama 에 drafter 만 붙이고, 검증 batch(1 + n_draft 토큰 이하)에서만 모든 위치의 logits 를 요청한다
+# (모델 재로드 없이 켜고 끌 수 있음). stats(): 추측 수락률, 검증 step 당 토큰 수.
+from __future__ import annotations
+import types
+from typing import Any, Dict, Optional
+
+import numpy as np
+from llama_cpp import Llama
+from llama_cpp.llama_speculative import LlamaDraftModel
+
+import metrics
+
+LOOKUP = "lookup"
+DEF_N_DRAFT = 8
+
+
+class PromptLookup(LlamaDraftModel):
+    """
+    마지막 n-gram(max_ngram → min_ngram 순)이 앞에서 나온 가장 최근 위치를 찾아 그 뒤 토큰들을 추측.
+    llama_cpp 의 LlamaPromptLookupDecoding 과 달리 1-gram 일치는 쓰지 않고(빗나가는 추측만 늘어남) 최근 일치를 우선한다.
+    """
+
+    def __init__(self, n_draft: int = DEF_N_DRAFT, max_ngram: int = 3, min_ngram: int = 2):
+        self.n_draft = int(n_draft)
+        self.max_ngram = int(max_ngram)
+        self.min_ngram = int(min_ngram)
+
+    def __call__(self, input_ids, /, **kwargs: Any):
+        n = len(input_ids)
+        for size in range(min(self.max_ngram, n - 1), self.min_ngram - 1, -1):
+            windows = np.lib.stride_tricks.sliding_window_view(input_ids[:n - 1], size)
+            hits = np.nonzero((windows == input_ids[n - size:]).all(axis=1))[0]
+            if len(hits):
+                start = int(hits[-1]) + size
+                return np.array(input_ids[start:start + self.n_draft], dtype=np.intc)
+        return np.array([], dtype=np.intc)
+
+
+class DraftLlama(LlamaDraftModel):
+    """
+    작은 GGUF 로 다음 토큰을 greedy 추측. 자체 KV 는 직전 호출과의 공통 prefix 만큼 재사용하므로
+    호출마다 새로 평가하는 토큰은 (수락된 토큰 + 보정 토큰) 뿐이다.
+    """
+
+    def __init__(self, model_path: str, n_draft: int = DEF_N_DRAFT, n_ctx: int = 2048,
+                 n_threads: Optional[int] = None):
+        self.llm = Llama(model_path=model_path, n_ctx=n_ctx, n_threads=n_threads, verbose=False)
+        self.model_path = model_path
+        self.n_draft = int(n_draft)
+        self._n_vocab = self.llm.n_vocab()
+        from batch_decode import _eog_checker
+        self._is_eog = _eog_checker(self.llm._model)
+
+    def __call__(self, input_ids, /, **kwargs: Any):
+        d = self.llm
+        n_in = len(input_ids)
+        if n_in == 0 or n_in + self.n_draft >= d.n_ctx():
+            return np.array([], dtype=np.intc)
+        # 직전 상태와의 공통 prefix (마지막 입력 토큰은 logits 를 얻기 위해 항상 다시 평가)
+        limit = min(d.n_tokens, n_in - 1)
+        diff = np.nonzero(d.input_ids[:limit] != input_ids[:limit])[0]
+        d.n_tokens = int(diff[0]) if len(diff) else limit
+        d.eval(input_ids[d.n_tokens:].tolist())
+        out = []
+        while True:
+            logits = np.ctypeslib.as_array(d._ctx.get_logits_ith(-1), shape=(self._n_vocab,))
+            tok = int(logits.argmax())
+            if self._is_eog(tok):
+                break
+            out.append(tok)
+            if len(out) >= self.n_draft:
+                break
+            d.eval([tok])
+        return np.array(out, dtype=np.intc)
+
+    def close(self) -> None:
+        self.llm.close()
+
+
+class _Counted(LlamaDraftModel):
+    """
+    drafter 래퍼: 추측 길이를 k(≤ n_max)로 자르고 수락 수를 센다.
+    다음 호출의 입력(= 검증 후 확정된 시퀀스)과 직전 추측을 비교해 수락된 앞부분 길이를 구한다.
+    k 는 전부 수락되면 2배, 빗나가면 (수락 수 + 1) 로 줄인다 → 추측이 안 맞는 구간에서 검증 batch 비용을 줄임.
+    생성이 끝나 결과를 알 수 없는 마지막 추측은 세지 않는다.
+    """
+
+    def __init__(self, inner: LlamaDraftModel, n_max: int, name: str):
+        self.inner = inner
+        self.n_max = int(n_max)
+        self.k = self.n_max
+        self.name = name
+        self.steps = 0          # 검증 step (추측 결과가 확인된 호출)
+        self.proposed = 0
+        self.accepted = 0
+        self._pending = None    # (추측 시점 입력 길이, 추측 토큰)
+
+    def _settle(self, input_ids) -> None:
+        if self._pending is None:
+            return
+        n0, draft = self._pending
+        self._pending = None
+        new = input_ids[n0:]
+        if len(input_ids) <= n0 or len(new) > len(draft) + 1:
+            return                              # 다른 생성의 입력
+        m = min(len(draft), len(new))
+        miss = np.nonzero(draft[:m] != new[:m])[0]
+        acc = int(miss[0]) if len(miss) else m
+        self.steps += 1
+        self.proposed += len(draft)
+        self.accepted += acc
+        self.k = min(self.n_max, 2 * self.k) if acc == len(draft) else max(1, acc + 1)
+        metrics.inc("spec_proposed", len(draft), drafter=self.name)
+        metrics.inc("spec_accepted", acc, drafter=self.name)
+
+    def __call__(self, input_ids, /, **kwargs: Any):
+        self._settle(input_ids)
+        draft = np.array(self.inner(input_ids, **kwargs), dtype=np.intc)[:self.k]   # 복사 (lookup 은 input_ids 의 view)
+        if len(draft):
+            self._pending = (len(input_ids), draft)
+        return draft
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "drafter": self.name,
+            "steps": self.steps,
+            "proposed": self.proposed,
+            "accepted": self.accepted,
+            "acceptance": self.accepted / self.proposed if self.proposed else 0.0,
+            # 검증 step 1회(본 모델 decode 1회)당 확정 토큰 = 수락 + 보정/추가 1
+            "tokens_per_step": (self.accepted + self.steps) / self.steps if self.steps else 0.0,
+        }
+
+
+def _spec_eval(self: Llama, tokens) -> None:
+    """
+    Llama.eval 과 같되, 검증 batch(토큰 수 ≤ _spec_window)는 모든 위치의 logits 를 요청한다.
+    generate() 는 sampler 로 ctx 의 logits 를 직접 읽으므로 scores 배열(logits_all 전용)은 쓰지 않는다.
+    """
+    verify = len(tokens) <= self._spec_window
+    self._ctx.kv_cache_seq_rm(-1, self.n_tokens, -1)
+    for i in range(0, len(tokens), self.n_batch):
+        batch = tokens[i:min(len(tokens), i + self.n_batch)]
+        n_past = self.n_tokens
+        self._batch.set_batch(batch=batch, n_past=n_past, logits_all=verify)
+        self._ctx.decode(self._batch)
+        self.input_ids[n_past:n_past + len(batch)] = batch
+        self.n_tokens += len(batch)
+
+
+def make_drafter(spec: str, n_draft: int = DEF_N_DRAFT, n_ctx: int = 2048,
+                 n_threads: Optional[int] = None) -> Optional[LlamaDraftModel]:
+    """spec: '' → None, 'lookup' → prompt-lookup, 그 외 → draft GGUF 경로."""
+    spec = (spec or "").strip()
+    if not spec:
+        return None
+    if spec.lower() == LOOKUP:
+        return PromptLookup(n_draft)
+    return DraftLlama(spec, n_draft=n_draft, n_ctx=n_ctx, n_threads=n_threads)
+
+
+def is_attached(llm: Llama, drafter: Optional[LlamaDraftModel], n_draft: int = DEF_N_DRAFT) -> bool:
+    """llm 에 이미 같은 drafter / n_draft 가 붙어 있는지 (앱 rerun 마다 잠금 없이 확인)."""
+    cur = getattr(llm, "draft_model", None)
+    if drafter is None:
+        return cur is None
+    return isinstance(cur, _Counted) and cur.inner is drafter and cur.n_max == int(n_draft)
+
+
+def attach(llm: Llama, drafter: Optional[LlamaDraftModel], n_draft: int = DEF_N_DRAFT) -> None:
+    """drafter 를 붙인다 (None 이면 detach). 다른 스레드가 이 Llama 로 생성 중이 아닐 때 호출."""
+    if drafter is None:
+        detach(llm)
+        return
+    if isinstance(drafter, DraftLlama) and drafter._n_vocab != llm.n_vocab():
+        raise ValueError(f"draft model vocab ({drafter._n_vocab}) != target vocab ({llm.n_vocab()})")
+    name = "draft" if isinstance(drafter, DraftLlama) else LOOKUP
+    llm.draft_model = _Counted(drafter, n_draft, name)
+    llm._spec_window = 1 + int(n_draft)
+    if not llm._logits_all:
+        llm.eval = types.MethodType(_spec_eval, llm)
+
+
+def detach(llm: Llama) -> None:
+    llm.draft_model = None
+    llm.__dict__.pop("eval", None)
+
+
+def stats(llm) -> Optional[Dict[str, Any]]:
+    d = getattr(llm, "draft_model", None)
+    return d.stats() if isinstance(d, _Counted) else None
+
+
+def format_spec_stats(before: Optional[Dict[str, Any]], after: Optional[Dict[str, Any]]) -> str:
+    """두 stats() 사이(한 응답)의 수락률. drafting 이 꺼져 있으면 ''."""
+    if after is None:
+        return ""
+    b = before if before is not None and before.get("drafter") == after["drafter"] else {}
+    prop = after["proposed"] - b.get("proposed", 0)
+    acc = after["accepted"] - b.get("accepted", 0)
+    steps = after["steps"] - b.get("steps", 0)
+    if not steps:
+        return f"{after['drafter']}: no drafts"
+    return (f"{after['drafter']}: accept {acc / prop if prop else 0.0:.0%} ({acc}/{prop}) · "
+            f"{(acc + steps) / steps:.2f} tok/step")
@@ -0,0 +1,113 @@
+# stream_render.py — 스트리밍 출력 묶음(coalescing) 렌더러
+#
+# 토큰마다 placeholder.markdown("".join(buf)) 를 호출하면 응답 길이에 대해 O(n²) 로 느려진다.
+# StreamRenderer 는 delta 를 모아 두었다가 interval_ms 가 지나거나 max_pending 토큰이 쌓이면 한 번에 내보낸다.
+#   - full=True : sink(누적 전체 텍스트)  → Streamlit placeholder.markdown
+#   - full=False: sink(새로 모인 delta)   → CLI print
+from __future__ import annotations
+import time
+from typing import Callable, Dict, List, Optional, Tuple
+
+import metrics
+
+
+class StreamRenderer:
+    def __init__(self, sink: Callable[[str], None], full: bool = True,
+                 interval_ms: float = 100.0, max_pending: int = 32):
+        self.sink = sink
+        self.full = full
+        self.interval = interval_ms / 1000.0
+        self.max_pending = max(1, int(max_pending))
+        self._text = ""                 # 내보낸 누적 텍스트
+        self._pending: List[str] = []   # 아직 내보내지 않은 delta
+        self._last_flush = time.perf_counter()
+        self.flushes = 0
+        self.render_s = 0.0             # sink 호출에 쓴 시간(UI 비용)
+
+    @property
+    def text(self) -> str:
+        return self._text + "".join(self._pending)
+
+    def feed(self, delta: str) -> None:
+        if not delta:
+            return
+        self._pending.append(delta)
+        now = time.perf_counter()
+        if len(self._pending) >= self.max_pending or now - self._last_flush >= self.interval:
+            self.flush(now)
+
+    def flush(self, now: Optional[float] = None) -> None:
+        if not self._pending:
+            return
+        chunk = "".join(self._pending)
+        self._pending.clear()
+        self._text += chunk
+        t0 = time.perf_counter()
+        self.sink(self._text if self.full else chunk)
+        t1 = time.perf_counter()
+        self.render_s += t1 - t0
+        self.flushes += 1
+        self._last_flush = now if now is not None else t1
+
+    def close(self) -> str:
+        self.flush()
+        return self._text
+
+
+def stream_chat(llm, messages: List[Dict[str, str]], renderer: StreamRenderer,
+                metrics_path: str = "chat", **gen_kwargs) -> Tuple[str, Dict[str, float]]:
+    """
+    create_chat_completion 스트리밍 → renderer. 스트리밍 미지원(TypeError)이면 논스트림으로 폴백.
+    renderer 는 feed/close/render_s/flushes 를 가진 객체(StreamRenderer, think_stream.ThinkRouter).
+    feed() 가 True 를 반환하면 생성을 중단한다.
+    반환: (원문 텍스트, 통계) — 통계는 생성기 기준(렌더링 시간 제외) tokens/sec 를 포함.
+    지표 수집이 켜져 있으면 TTFT / decode tokens/s / 프롬프트 평가 시간을 metrics 에 metrics_path 라벨로 기록.
+    """
+    perf0 = metrics.llama_perf(llm)
+    t0 = time.perf_counter()
+    n = 0
+    t_first = t_last = None
+    try:
+        it = llm.create_chat_completion(messages=messages, stream=True, **gen_kwargs)
+        try:
+            for ch in it:
+                delta = ch["choices"][0]["delta"].get("content", "")
+                if not delta:
+                    continue
+                t_last = time.perf_counter()
+                if t_first is None:
+                    t_first = t_last
+                n += 1
+                if renderer.feed(delta):
+                    break
+        finally:
+            close = getattr(it, "close", None)
+            if close is not None:
+                close()
+    except TypeError:
+        resp = llm.create_chat_completion(messages=messages, **gen_kwargs)
+        raw = resp["choices"][0]["message"]["content"] or ""
+        t_first = t_last = time.perf_counter()
+        n = int(resp.get("usage", {}).get("completion_tokens", 0) or 0)
+        renderer.feed(raw)
+    render_in_span = renderer.render_s
+    raw = renderer.close()
+    total = time.perf_counter() - t0
+    gen_span = (t_last - t_first) if (t_first is not None and t_last is not None) else 0.0
+    # 첫 토큰 이후 구간에서 렌더링 시간을 빼 생성기 자체 속도를 구함
+    gen_only = max(gen_span - render_in_span, 1e-9)
+    stats = {
+        "tokens": n,
+        "ttft_s": (t_first - t0) if t_first is not None else total,
+        "total_s": total,
+        "tok_per_s": (n - 1) / gen_only if n > 1 else 0.0,
+        "render_s": renderer.render_s,
+        "flushes": renderer.flushes,
+    }
+    metrics.record_generation(stats, perf0, llm, metrics_path)
+    return raw, stats
+
+
+def format_stats(stats: Dict[str, float]) -> str:
+    return (f"{stats['tokens']} tok · {stats['tok_per_s']:.1f} tok/s · "
+            f"TTFT {stats['ttft_s']:.2f}s · render {stats['render_s'] * 1000:.0f}ms/{stats['flushes']} flush")
@@ -0,0 +1,124 @@
+# think_stream.py — 스트리밍 <think> 블록 분리기
+#
+# 응답이 끝난 뒤 정규식으로 <think>…</think> 를 떼어내면, 생성 중에는 추론 텍스트가 본문 말풍선에 그대로 흐른다.
+# ThinkRouter 는 delta 가 도착하는 대로 상태 머신(visible ↔ reasoning)으로 태그를 해석해
+# 본문은 visible sink 로, 추론은 reasoning sink 로 보낸다. 태그가 chunk 경계에서 잘려도("<thi" + "nk>") 처리한다.
+# max_reasoning_tokens 를 넘기면 feed() 가 True 를 반환 → stream_chat 이 생성을 중단한다.
+# </think> 없이 스트림이 끝나면(예산 중단 제외) close() 가 보류한 추론을 본문으로 되돌린다.
+from __future__ import annotations
+from typing import List, Optional, Tuple
+
+OPEN_TAG = "<think>"
+CLOSE_TAG = "</think>"
+
+
+def _partial_suffix(s: str, tag: str) -> int:
+    """s 의 끝부분 중 tag 의 접두사와 일치하는 최대 길이 (다음 chunk 로 이어질 수 있는 부분)."""
+    for n in range(min(len(s), len(tag) - 1), 0, -1):
+        if tag.startswith(s[-n:]):
+            return n
+    return 0
+
+
+class ThinkRouter:
+    """
+    stream_chat 의 renderer 자리에 넣는 delta 분배기.
+    visible / reasoning 은 feed(str)·close() 를 가진 싱크(StreamRenderer 등). reasoning 이 None 이면 추론은 모으기만 한다.
+    close() 후 .visible, .reasoning 으로 최종 텍스트를 얻는다 (기존 _split_reasoning 과 같은 형태).
+    """
+
+    def __init__(self, visible=None, reasoning=None, max_reasoning_tokens: Optional[int] = None):
+        self.visible_sink = visible
+        self.reasoning_sink = reasoning
+        self.max_reasoning_tokens = max_reasoning_tokens if max_reasoning_tokens else None
+        self.in_think = False
+        self._tail = ""                       # 태그 일부일 수 있어 보류 중인 텍스트
+        self._raw: List[str] = []
+        self._vis: List[str] = []
+        self._blocks: List[List[str]] = []    # think 블록별 조각
+        self.reasoning_tokens = 0
+        self.truncated = False                # 추론 예산 초과로 중단됨
+
+    # ---------- 스트림 인터페이스 ----------
+    def feed(self, delta: str) -> bool:
+        """delta 를 분배. 추론 예산을 넘기면 True (생성 중단 요청)."""
+        if not delta:
+            return False
+        self._raw.append(delta)
+        if self.in_think:
+            self.reasoning_tokens += 1
+        s = self._tail + delta
+        self._tail = ""
+        while s:
+            tag = CLOSE_TAG if self.in_think else OPEN_TAG
+            i = s.find(tag)
+            if i >= 0:
+                self._emit(s[:i])
+                s = s[i + len(tag):]
+                self.in_think = not self.in_think
+                if self.in_think:
+                    self._blocks.append([])
+                continue
+            keep = _partial_suffix(s, tag)
+            self._emit(s[:len(s) - keep])
+            self._tail = s[len(s) - keep:]
+            break
+        if self.in_think and self.max_reasoning_tokens and self.reasoning_tokens >= self.max_reasoning_tokens:
+            self.truncated = True
+            return True
+        return False
+
+    def close(self) -> str:
+        # 끝까지 남은 보류 텍스트는 태그가 아니므로 현재 상태로 내보냄
+        if self._tail:
+            self._emit(self._tail)
+            self._tail = ""
+        if self.in_think and not self.truncated:
+            # </think> 없이 끝난 블록은 추론이 아니라 본문으로 본다 (기존 정규식 split 과 동일)
+            text = OPEN_TAG + "".join(self._blocks.pop())
+            self.in_think = False
+            self._emit(text)
+        for sink in (self.visible_sink, self.reasoning_sink):
+            if sink is not None:
+                sink.close()
+        return "".join(self._raw)
+
+    # ---------- 결과 ----------
+    @property
+    def visible(self) -> str:
+        return "".join(self._vis).strip()
+
+    @property
+    def reasoning(self) -> str:
+        return "\n\n".join(t for t in ("".join(b).strip() for b in self._blocks) if t)
+
+    @property
+    def render_s(self) -> float:
+        return sum(getattr(s, "render_s", 0.0) for s in (self.visible_sink, self.reasoning_sink) if s is not None)
+
+    @property
+    def flushes(self) -> int:
+        return sum(getattr(s, "flushes", 0) for s in (self.visible_sink, self.reasoning_sink) if s is not None)
+
+    # ---------- internal ----------
+    def _emit(self, text: str) -> None:
+        if not text:
+            return
+        if self.in_think:
+            self._blocks[-1].append(text)
+            if self.reasoning_sink is not None:
+                self.reasoning_sink.feed(text)
+        else:
+            if not self._vis and not text.strip():
+                return                        # 답변 앞의 빈 줄은 버림 (</think>\n\n 등)
+            self._vis.append(text)
+            if self.visible_sink is not None:
+                self.visible_sink.feed(text)
+
+
+def split_think(text: str) -> Tuple[str, str]:
+    """완성된 응답을 한 번 훑어 (visible, think) 로 분리. 스트리밍이 아닌 경로(요약 등)용."""
+    r = ThinkRouter()
+    r.feed(text)
+    r.close()
+    return r.visible, r.reasoning